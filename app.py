@@ -6,11 +6,20 @@ import tempfile
 import sounddevice as sd
 import soundfile as sf
 import time
+import math
 import numpy as np
 import base64
 import hashlib
 from flask import Flask, request, jsonify, render_template, send_file, Response, stream_with_context
+from flask.json.provider import JSONProvider
 from talk2sql.engine import Talk2SQLAzure
+from talk2sql.session import QuerySession
+from talk2sql.connection_pool import SQLiteConnectionPool, read_sql_with_deadline
+from talk2sql.result_format import negotiate_result_format
+from talk2sql.schema_catalog import SchemaCatalogCache
+from talk2sql.profiler import TableProfiler
+from talk2sql.metrics import histogram_quantile
+from talk2sql import json_encoding
 # from talk2sql.engine import Talk2SQL_anthropic
 from talk2sql.utils import format_sql_with_xml_tags, extract_content_from_xml_tags
 import groq
@@ -21,10 +30,8 @@ import datetime
 import io
 import csv
 import zipfile
-import statistics
 import traceback
 import uuid
-from collections import Counter, defaultdict
 import re
 
 try:
@@ -33,7 +40,28 @@ try:
 except ImportError:
     print("Warning: python-dotenv not installed. Install with 'pip install python-dotenv' to load environment variables from .env file")
 
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by the shared orjson encoder."""
+    
+    def dumps(self, obj, **kwargs):
+        return json_encoding.dumps_str(obj)
+    
+    def loads(self, s, **kwargs):
+        return json_encoding.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+def json_response(payload, raw=None, status=200):
+    """
+    Build a JSON response, splicing in already-encoded fields.
+    
+    Args:
+        payload: Response dictionary
+        raw: Mapping of key to pre-encoded JSON bytes (e.g. cached result records)
+        status: HTTP status code
+    """
+    return Response(json_encoding.dumps_with_raw(payload, raw or {}), status=status, mimetype='application/json')
 
 DB_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'databases')
 
@@ -61,6 +89,26 @@ config = {
     "save_query_history": True,
     "history_db_path": os.path.join(DB_FOLDER, "query_history.sqlite"),  # Store query history in databases folder
     
+    # Query deadlines - seconds before a runaway query is cancelled (per-database overrides by file name)
+    "query_timeout": 30,
+    "database_query_timeouts": {},
+    
+    # Schema profiling - rows read per table (larger tables are sampled) and tables profiled at once
+    "schema_profile_sample_size": 100000,
+    "schema_profile_workers": 4,
+    
+    # Result size cap - rows kept per query; larger results are truncated and their full size reported
+    "max_result_rows": 10000,
+    
+    # Latency sketches - hourly per-database quantile sketches, checkpointed to the history database
+    # so every worker process sees the merged view
+    "latency_sketch_accuracy": 0.01,
+    "latency_sketch_checkpoint_interval": 60,
+    
+    # Embedding cache - persisted next to the databases so restarts and reconnects reuse embeddings
+    # (.sqlite3 so it is not listed as a connectable database)
+    "embedding_cache_path": os.path.join(DB_FOLDER, "embedding_cache.sqlite3"),
+    
     # General settings
     "debug_mode": True,
 }
@@ -122,26 +170,147 @@ current_db_path = None
 current_db_name = None
 db_collection_created = {}  # Keep track of which databases have collections
 
-# Thread-safe SQLite connection
-_thread_local = threading.local()
+# Read-only connections to the selectable databases, shared by all requests
+db_pool = SQLiteConnectionPool(
+    max_databases=config.get("pool_max_databases", 8),
+    max_connections_per_database=config.get("pool_max_connections_per_database", 4)
+)
+
+# Schema introspection results per database, persisted next to each database file
+# (large tables are profiled from a sample, several tables at a time)
+schema_catalog = SchemaCatalogCache(
+    pool=db_pool,
+    profiler=TableProfiler(
+        sample_size=config.get("schema_profile_sample_size", 100000),
+        max_workers=config.get("schema_profile_workers", 4)
+    )
+)
+# The engine reads schema through the same cache
+Talk2SQL.schema_catalog_cache = schema_catalog
 
-def get_thread_safe_connection():
+def list_queryable_databases():
     """
-    Gets a thread-safe connection to the current database.
-    If there's no connection for the current thread, creates one.
+    List the user databases in DB_FOLDER (what /databases offers for querying).
+    
+    Returns:
+        Absolute paths of *.sqlite and *.db files, excluding internal databases
+        (query history, embedding cache)
     """
-    thread_id = threading.get_ident()
-    if not hasattr(_thread_local, 'connection'):
-        logging.info(f"Creating new connection for thread {thread_id}")
-        if app.config.get('DATABASE_PATH'):
-            # Create a new connection with check_same_thread=False for this thread
-            db_path = app.config.get('DATABASE_PATH')
-            _thread_local.connection = sqlite3.connect(db_path, check_same_thread=False)
-            logging.info(f"Created new SQLite connection for thread {thread_id}")
-        else:
-            logging.warning(f"No database selected for thread {thread_id}")
+    internal = {
+        os.path.abspath(path)
+        for path in (config.get("history_db_path"), config.get("embedding_cache_path"))
+        if path
+    }
+    db_files = glob.glob(os.path.join(DB_FOLDER, '*.sqlite')) + glob.glob(os.path.join(DB_FOLDER, '*.db'))
+    return [os.path.abspath(path) for path in db_files if os.path.abspath(path) not in internal]
+
+def resolve_request_db_path(db_id=None, require_vectors=True):
+    """
+    Pick the database a request should run against.
     
-    return _thread_local.connection if hasattr(_thread_local, 'connection') else None
+    Args:
+        db_id: Database path or file name sent with the request (None = current database)
+        require_vectors: Only accept databases whose vector collections can be
+            used for retrieval: the connected one, or any trained one when
+            collections are persisted per database
+    
+    Returns:
+        Path of the database, or None if db_id isn't a queryable database
+    """
+    if not db_id:
+        return current_db_path
+    
+    candidate = os.path.abspath(db_id if os.path.isabs(db_id) else os.path.join(DB_FOLDER, db_id))
+    if current_db_path and candidate == os.path.abspath(current_db_path):
+        return current_db_path
+    if candidate not in list_queryable_databases():
+        return None
+    if require_vectors:
+        # In-memory collections only hold the connected database's training data
+        if not using_persistent_vectors:
+            return None
+        if not any(os.path.abspath(path) == candidate and created
+                   for path, created in db_collection_created.items()):
+            return None
+    return candidate
+
+def parse_query_timeout(value):
+    """
+    Validate a client-supplied query timeout.
+    
+    Args:
+        value: Timeout from the request body (number or numeric string)
+    
+    Returns:
+        Timeout in seconds, or None if the client didn't send one
+    
+    Raises:
+        ValueError: If the value isn't a positive, finite number of seconds
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError("timeout must be a number of seconds")
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("timeout must be a number of seconds")
+    if not math.isfinite(timeout) or timeout <= 0:
+        raise ValueError("timeout must be a positive number of seconds")
+    return timeout
+
+def create_query_session(db_path=None, save_query_history=None, query_timeout=None, max_result_rows=None):
+    """
+    Build a request-scoped query session for a database.
+    
+    SQL runs on pooled read-only connections to that database, and retrieval
+    uses its vector collections, so concurrent requests don't share or swap them.
+    
+    Args:
+        db_path: Database to query (None = the current database)
+        save_query_history: Override the history setting for this request (None = default)
+        query_timeout: Seconds each query may run, as requested by the client; it can
+            only shorten the per-database or global limit (None = that limit)
+        max_result_rows: Rows kept from each result (None = global default)
+    """
+    db_path = db_path or current_db_path
+    
+    limit = config["database_query_timeouts"].get(os.path.basename(db_path)) if db_path else None
+    if limit is None:
+        limit = Talk2SQL.query_timeout
+    # A limit of 0 means no limit
+    if query_timeout is None or (limit and query_timeout > limit):
+        query_timeout = limit
+    if max_result_rows is None:
+        max_result_rows = Talk2SQL.max_result_rows
+    
+    session_options = {
+        "save_query_history": save_query_history,
+        "query_timeout": query_timeout,
+        "max_result_rows": max_result_rows
+    }
+    
+    if db_path:
+        def read_from_pool(sql_query):
+            with db_pool.connection(db_path) as conn:
+                return read_sql_with_deadline(conn, sql_query, query_timeout, max_rows=max_result_rows)
+
+        def run_sql(sql_query):
+            return Talk2SQL.run_sql_cached(
+                db_path, sql_query, lambda: read_from_pool(sql_query), max_rows=max_result_rows
+            )
+        session_options["run_sql"] = run_sql
+        session_options["database_path"] = os.path.abspath(db_path)
+    
+    if using_persistent_vectors and db_path:
+        collection_name = get_collection_name_for_db(db_path)
+        session_options.update(
+            questions_collection=f"{collection_name}_questions",
+            schema_collection=f"{collection_name}_schema",
+            docs_collection=f"{collection_name}_docs"
+        )
+    
+    return QuerySession(**session_options)
 
 # Generate deterministic collection name for a database
 def get_collection_name_for_db(db_path):
@@ -154,7 +323,7 @@ def get_collection_name_for_db(db_path):
 # Connect to a selected database
 @app.route('/connect', methods=['POST'])
 def connect_to_database():
-    global current_db_path, current_db_name, db_collection_created, _thread_local
+    global current_db_path, current_db_name, db_collection_created
     
     db_path = request.json.get('db_path')
     
@@ -180,20 +349,9 @@ def connect_to_database():
         # Store the database path in app configuration for thread-safe access
         app.config['DATABASE_PATH'] = db_path
         
-        # Reset thread-local storage since we're connecting to a new database
-        # This ensures each thread will create a new connection to the new database
-        if hasattr(_thread_local, 'connection'):
-            # Close existing connection if it exists
-            try:
-                _thread_local.connection.close()
-            except:
-                pass
-            _thread_local.connection = None
-        
-        # Create a connection for the main thread
-        conn = sqlite3.connect(db_path, check_same_thread=False)
-        _thread_local.connection = conn
-        logging.info(f"Created thread-safe connection for main thread: {threading.get_ident()}")
+        # Make sure the pool can open the database read-only before requests use it
+        with db_pool.connection(db_path):
+            pass
         
         # Check if we've already created a collection for this database
         collections_exist = False
@@ -344,11 +502,21 @@ def list_databases():
 @app.route('/vector_store_status', methods=['GET'])
 def vector_store_status():
     try:
+        embedding_cache = getattr(Talk2SQL, "embedding_cache", None)
+        embedding_cache_stats = embedding_cache.stats() if embedding_cache else None
+        sql_cache = getattr(Talk2SQL, "sql_cache", None)
+        sql_cache_stats = sql_cache.stats() if sql_cache else None
+        result_cache = getattr(Talk2SQL, "result_cache", None)
+        result_cache_stats = result_cache.stats() if result_cache else None
+        
         if not using_persistent_vectors:
             return jsonify({
                 "status": "success",
                 "vector_store": "in-memory",
-                "message": "Using in-memory vector storage"
+                "message": "Using in-memory vector storage",
+                "embedding_cache": embedding_cache_stats,
+                "sql_cache": sql_cache_stats,
+                "result_cache": result_cache_stats
             })
         
         # Get list of collections
@@ -375,7 +543,10 @@ def vector_store_status():
             "vector_store": "persistent",
             "url": config["location"],
             "collections": collection_names,
-            "current_db_collections": counts if current_db_path else None
+            "current_db_collections": counts if current_db_path else None,
+            "embedding_cache": embedding_cache_stats,
+            "sql_cache": sql_cache_stats,
+            "result_cache": result_cache_stats
         })
     except Exception as e:
         print(f"Error getting vector store status: {e}")
@@ -400,25 +571,13 @@ def query_history_status():
             
             # Try to get query count
             try:
-                history = Talk2SQL.get_query_history(limit=None)
-                
-                # Make sure data is serializable before storing in file_info
-                serializable_history = []
-                for item in history:
-                    # Convert any bytes objects in each history item
-                    for key, value in list(item.items()):
-                        if isinstance(value, bytes):
-                            try:
-                                # Convert bytes to base64 string
-                                import base64
-                                item[key] = base64.b64encode(value).decode('utf-8')
-                            except:
-                                # If conversion fails, remove the key
-                                item[key] = None
-                    serializable_history.append(item)
-                    
-                file_info["query_count"] = len(serializable_history) if serializable_history else 0
+                if hasattr(Talk2SQL, "count_query_history"):
+                    file_info["query_count"] = Talk2SQL.count_query_history()
+                else:
+                    file_info["query_count"] = len(Talk2SQL.get_query_history(columns=["id"]))
                 print(f"Found {file_info['query_count']} queries in history database")
+                if hasattr(Talk2SQL, "get_history_storage_stats"):
+                    file_info["blob_store"] = Talk2SQL.get_history_storage_stats()
             except Exception as e:
                 file_info["query_count_error"] = str(e)
                 print(f"Error getting query count: {e}")
@@ -564,23 +723,22 @@ def load_training_file(file_path):
         with open(file_path, 'r') as f:
             data = json.load(f)
             
-        # Add examples to Talk2SQL
-        added_count = 0
+        # Collect valid examples
+        examples = []
         for example in data:
-            question = example['natural_language']
-            sql = example['sql']
-            
-            # Format SQL with XML tags for storage
-            formatted_sql = format_sql_with_xml_tags(sql)
-            
-            # Add to Talk2SQL
+            if 'natural_language' not in example or 'sql' not in example:
+                print(f"Skipping invalid training example: {example}")
+                continue
+            examples.append((example['natural_language'], example['sql']))
+        
+        # Add all examples to Talk2SQL with batched embeddings and upserts
+        added_count = 0
+        if examples:
             try:
-                # Extract the SQL without tags for adding to the database
-                Talk2SQL.add_question_sql(question, sql)
-                added_count += 1
+                Talk2SQL.add_question_sql_batch(examples)
+                added_count = len(examples)
             except Exception as e:
-                print(f"Error adding example: {question}, error: {e}")
-                continue
+                print(f"Error adding training examples from {file_path}: {e}")
         
         print(f"Added {added_count} of {len(data)} training examples")
         return added_count > 0, added_count
@@ -735,73 +893,32 @@ def get_db_schema():
     try:
         print("Attempting to extract database schema...")
         
-        # First, verify database connection
-        try:
-            test_df = Talk2SQL.run_sql("SELECT 1")
-            print(f"Database connection test: {not test_df.empty}")
-        except Exception as e:
-            print(f"Database connection test failed: {e}")
+        if not current_db_path:
+            print("No database connected")
             return ""
         
-        # Get all tables using a more robust query
-        print("Querying for tables...")
-        tables_df = Talk2SQL.run_sql("""
-            SELECT name 
-            FROM sqlite_master 
-            WHERE type='table' AND name NOT LIKE 'sqlite_%'
-        """)
+        # Read from the catalog cache; the database is only scanned if it changed
+        catalog = schema_catalog.get(current_db_path)
         
-        print(f"Tables found: {len(tables_df) if not tables_df.empty else 0}")
-        if not tables_df.empty:
-            print(f"Table names: {', '.join(tables_df['name'].tolist())}")
+        print(f"Tables found: {len(catalog.tables)}")
+        if catalog.tables:
+            print(f"Table names: {', '.join(catalog.table_names())}")
         
-        if tables_df.empty:
+        if not catalog.tables:
             print("No tables found in database - checking if database file exists and has content")
             # This could indicate an issue with the database file
             return ""
-            
-        schema_definitions = []
-        table_count = 0
-        
-        # Get create statements for each table
-        for table in tables_df['name']:
-            print(f"Processing table: {table}")
-            try:
-                create_stmt_df = Talk2SQL.run_sql(f"SELECT sql FROM sqlite_master WHERE name='{table}'")
-                if not create_stmt_df.empty and create_stmt_df['sql'][0] is not None:
-                    schema_definitions.append(create_stmt_df['sql'][0])
-                    
-                    # Also get a sample of the data to better understand the schema
-                    sample_df = Talk2SQL.run_sql(f"SELECT * FROM {table} LIMIT 1")
-                    columns = list(sample_df.columns)
-                    schema_definitions.append(f"-- Table {table} columns: {', '.join(columns)}")
-                    
-                    # Add column descriptions (simplified to avoid potential errors)
-                    column_info = []
-                    for col in columns:
-                        try:
-                            # Only get distinct values for columns (simpler approach)
-                            distinct_df = Talk2SQL.run_sql(f"SELECT COUNT(DISTINCT {col}) FROM {table}")
-                            if not distinct_df.empty and distinct_df.iloc[0, 0] < 10:
-                                values_df = Talk2SQL.run_sql(f"SELECT DISTINCT {col} FROM {table} LIMIT 10")
-                                values = values_df[values_df.columns[0]].tolist()
-                                column_info.append(f"-- Column {col} possible values: {', '.join(map(str, values))}")
-                        except Exception as e:
-                            print(f"Error getting column stats for {table}.{col}: {e}")
-                    
-                    schema_definitions.extend(column_info)
-                    table_count += 1
-            except Exception as e:
-                print(f"Error getting schema for table {table}: {e}")
         
+        # One chunk per table; foreign keys link tables in both directions
+        table_chunks = catalog.table_chunks()
+        table_count = len(table_chunks)
         print(f"Extracted schema for {table_count} tables")
         
-        # Join all schema definitions
-        full_schema = '\n\n'.join(schema_definitions)
+        full_schema = catalog.to_ddl()
         
-        # Add schema to Talk2SQL
-        if full_schema:
-            Talk2SQL.add_schema(full_schema)
+        # Add schema to Talk2SQL, one entry per table
+        if table_chunks:
+            Talk2SQL.add_table_schemas(table_chunks)
             
             # Add a more readable description
             description = f"""
@@ -827,21 +944,29 @@ def ask_question():
         
         # Check if we should save the query to history
         save_query = request.json.get('save_query', True)
-        original_save_query = Talk2SQL.save_query_history
-        
-        if not save_query:
-            Talk2SQL.save_query_history = False
-        
-        # Ensure database connection
-        get_thread_safe_connection()
         
-        # Execute the query
-        result = Talk2SQL.smart_query(question, print_results=False, visualize=visualize)
+        try:
+            query_timeout = parse_query_timeout(request.json.get('timeout'))
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
         
-        # Restore save_query_history setting
-        Talk2SQL.save_query_history = original_save_query
+        db_path = resolve_request_db_path(db_id)
+        if db_id and db_path is None:
+            return jsonify({
+                "status": "error",
+                "message": f"Unknown database or database not trained for querying: {db_id}"
+            }), 400
+        
+        # Execute the query with this request's connection and settings
+        session = create_query_session(
+            db_path=db_path,
+            save_query_history=None if save_query else False,
+            query_timeout=query_timeout
+        )
+        result = Talk2SQL.smart_query(question, print_results=False, visualize=visualize, session=session)
         
         # Prepare the response
+        raw_fields = {}
         response = {
             "status": "success" if result["success"] else "error",
             "sql": result["sql"],
@@ -858,8 +983,17 @@ def ask_question():
             # If successful, include data and visualization
             df = result["data"]
             if df is not None:
-                response["data"] = df.to_dict(orient='records')
-                response["columns"] = df.columns.tolist()
+                # Rows in the format the client asked for (records by default)
+                result_format = negotiate_result_format(request.json.get('format'), request.headers.get('Accept'))
+                fields, raw_fields = json_encoding.result_fields(
+                    df, result_format, dictionary_encode=request.json.get('dictionary_encode', True)
+                )
+                response.update(fields)
+                
+                # Rows returned may be capped; report the full result size separately
+                response["row_count"] = result.get("row_count", len(df))
+                response["row_count_exact"] = result.get("row_count_exact", True)
+                response["truncated"] = result.get("truncated", False)
                 
                 # The summary is already generated in smart_query and stored in the result
                 if "summary" in result:
@@ -879,7 +1013,7 @@ def ask_question():
             if "corrected_sql" in result:
                 response["corrected_sql"] = result["corrected_sql"]
                 
-        return jsonify(response)
+        return json_response(response, raw_fields)
     except Exception as e:
         print(f"Error processing question: {e}")
         import traceback
@@ -929,7 +1063,7 @@ def generate_data_summary(question, result):
         I ran the following SQL query:
         {result["sql"]}
         
-        The query returned a dataframe with {len(result["data"])} rows and {len(result["data"].columns)} columns.
+        The query returned a dataframe with {Talk2SQL.get_result_size(result["data"])["row_count"]} rows and {len(result["data"].columns)} columns.
         Column names: {', '.join(result["data"].columns)}
         
         Here's a sample of the data:
@@ -977,24 +1111,9 @@ def generate_data_summary(question, result):
         
         summary_end_time = datetime.datetime.now()
         summary_time_ms = (summary_end_time - summary_start_time).total_seconds() * 1000
-        # Get recent history and update with summary
-        recent_history = Talk2SQL.get_query_history(successful_only=True, limit=10)
-        for entry in recent_history:
-            if entry.get("question") == question and "summary" not in entry:
-                # Re-record the query attempt with the summary added
-                Talk2SQL.record_query_attempt(
-                    question=entry.get("question"),
-                    sql=entry.get("sql"),
-                    success=True,
-                    retry_count=entry.get("retry_count", 0),
-                    data=entry.get("data"),
-                    columns=entry.get("columns"),
-                    visualization=entry.get("visualization"),
-                    summary=summary,
-                    explanation_time_ms=summary_time_ms
-                )
-                print(f"Added summary to query history for: '{question}'")
-                break
+        # Attach the summary to this question's history entry (written in the background)
+        if hasattr(Talk2SQL, "update_query_summary"):
+            Talk2SQL.update_query_summary(question, summary, explanation_time_ms=summary_time_ms)
                 
         return summary, summary_time_ms
     except Exception as e:
@@ -1013,43 +1132,19 @@ def get_history():
         
         print(f"DEBUG: history request with time_range={time_range}, status_filter={status_filter}")
         
-        # Get full history first
-        history = Talk2SQL.get_query_history()
-        print(f"DEBUG: Raw history returned from Talk2SQL.get_query_history(): {len(history) if history else 0} items")
+        # Time range and status are filtered by the history query itself
+        history = Talk2SQL.get_query_history(
+            since=_time_range_since(time_range),
+            successful_only=status_filter == "success",
+            failed_only=status_filter == "failed"
+        )
+        print(f"DEBUG: History returned from Talk2SQL.get_query_history(): {len(history) if history else 0} items")
         
         if not history:
             print("DEBUG: No history found from Talk2SQL.get_query_history()")
             # Return empty array for frontend to handle
             return jsonify({"status": "success", "history": []})
         
-        # Apply time filter if specified
-        if time_range != "all":
-            now = datetime.datetime.now()
-            filtered_history = []
-            for item in history:
-                try:
-                    ts = item.get("timestamp", "")
-                    if ts:
-                        item_date = _parse_iso(ts)
-                        # Filter based on time range
-                        delta = {"day": 1, "week": 7, "month": 30}[time_range]
-                        if (now - item_date).days <= delta:
-                            filtered_history.append(item)
-                except Exception as e:
-                    print(f"Error filtering by time: {e}")
-            history = filtered_history
-            print(f"DEBUG: After time filtering: {len(history)} items")
-            
-        # Apply status filter if specified
-        if status_filter != "all":
-            filtered_history = []
-            for item in history:
-                success_status = item.get("success", False)
-                if (status_filter == "success" and success_status) or (status_filter == "failed" and not success_status):
-                    filtered_history.append(item)
-            history = filtered_history
-            print(f"DEBUG: After status filtering: {len(history)} items")
-        
         # Enhance history items with additional data if available
         enhanced_history = []
         for item in history:
@@ -1209,9 +1304,6 @@ def upload_audio():
     audio_file.save(audio_path)
     
     try:
-        # Ensure we're using a thread-safe connection
-        get_thread_safe_connection()
-        
         # Transcribe the audio
         transcription = transcribe_audio(audio_path)
         
@@ -1357,20 +1449,9 @@ def voice_assistant():
         
         # Step 2: Generate SQL and execute query using thread-safe connection
         try:
-            # Define a thread-safe run_sql function for this request
-            def thread_safe_run_sql(sql_query):
-                conn = get_thread_safe_connection()
-                return pd.read_sql_query(sql_query, conn)
-            
-            # Temporarily replace the run_sql function
-            original_run_sql = Talk2SQL.run_sql
-            Talk2SQL.run_sql = thread_safe_run_sql
-            
-            # Now run the query with the thread-safe function
-            result = Talk2SQL.smart_query(question, print_results=False, visualize=True)
-            
-            # Restore original function
-            Talk2SQL.run_sql = original_run_sql
+            # Run the query with this request's connection and collections
+            result = Talk2SQL.smart_query(question, print_results=False, visualize=True,
+                                          session=create_query_session())
         except Exception as e:
             print(f"Error in thread-safe SQL execution: {e}")
             import traceback
@@ -1507,20 +1588,9 @@ def voice_assistant_stream():
             # Step 2: Generate SQL and execute query
             # Create a thread-local connection for this request
             try:
-                # Define a thread-safe run_sql function for this request
-                def thread_safe_run_sql(sql_query):
-                    conn = get_thread_safe_connection()
-                    return pd.read_sql_query(sql_query, conn)
-                
-                # Temporarily replace the run_sql function
-                original_run_sql = Talk2SQL.run_sql
-                Talk2SQL.run_sql = thread_safe_run_sql
-                
-                # Now run the query with the thread-safe function
-                result = Talk2SQL.smart_query(question, print_results=False, visualize=True)
-                
-                # Restore original function
-                Talk2SQL.run_sql = original_run_sql
+                # Run the query with this request's connection and collections
+                result = Talk2SQL.smart_query(question, print_results=False, visualize=True,
+                                              session=create_query_session())
             except Exception as e:
                 print(f"Error in thread-safe SQL execution: {e}")
                 import traceback
@@ -1635,6 +1705,10 @@ def ask_stream():
     if not question:
         return jsonify({"status": "error", "message": "No question provided"}), 400
     
+    # EventSource can't set headers, so the format usually comes as a query parameter
+    result_format = negotiate_result_format(request.args.get('format'), request.headers.get('Accept'))
+    dictionary_encode = request.args.get('dictionary_encode', 'true').lower() != 'false'
+    
     def generate():
         try:
             # Set appropriate headers for Server-Sent Events
@@ -1646,20 +1720,9 @@ def ask_stream():
             
             # Step 2: Generate SQL and execute query with thread-safe connection
             try:
-                # Define a thread-safe run_sql function for this request
-                def thread_safe_run_sql(sql_query):
-                    conn = get_thread_safe_connection()
-                    return pd.read_sql_query(sql_query, conn)
-                
-                # Temporarily replace the run_sql function
-                original_run_sql = Talk2SQL.run_sql
-                Talk2SQL.run_sql = thread_safe_run_sql
-                
-                # Now run the query with the thread-safe function
-                result = Talk2SQL.smart_query(question, print_results=False, visualize=True)
-                
-                # Restore original function
-                Talk2SQL.run_sql = original_run_sql
+                # Run the query with this request's connection and collections
+                result = Talk2SQL.smart_query(question, print_results=False, visualize=True,
+                                              session=create_query_session())
             except Exception as e:
                 print(f"Error in thread-safe SQL execution: {e}")
                 import traceback
@@ -1683,35 +1746,10 @@ def ask_stream():
             })
             yield f"data: {sql_data}\n\n"
             
-            # Send data to client
-            data_obj = {
-                "type": "data", 
-                "data": result["data"].to_dict(orient='records') if hasattr(result["data"], 'to_dict') else [], 
-                "columns": list(result["data"].columns) if hasattr(result["data"], 'columns') else []
-            }
-            
-            # Ensure all values are JSON serializable
-            def ensure_serializable(obj):
-                if isinstance(obj, bytes):
-                    import base64
-                    return base64.b64encode(obj).decode('utf-8')
-                elif hasattr(obj, 'to_dict'):
-                    return obj.to_dict()
-                elif hasattr(obj, 'tolist'):
-                    return obj.tolist()
-                else:
-                    return str(obj)
-            
-            # Process data to ensure it's serializable
-            serializable_data = []
-            for record in data_obj["data"]:
-                serializable_record = {}
-                for key, value in record.items():
-                    serializable_record[key] = ensure_serializable(value)
-                serializable_data.append(serializable_record)
-            
-            data_obj["data"] = serializable_data
-            data_json = json.dumps(data_obj)
+            # Send data to client in the negotiated format
+            fields, raw_fields = json_encoding.result_fields(result["data"], result_format, dictionary_encode)
+            data_obj = {"type": "data", **fields, **Talk2SQL.get_result_size(result["data"])}
+            data_json = json_encoding.dumps_with_raw(data_obj, raw_fields).decode('utf-8')
             yield f"data: {data_json}\n\n"
             
             # Step 3: Generate visualization if available
@@ -1824,12 +1862,7 @@ def export_history():
         # Get query history from SQLite database
         if query_id:
             # Fetch a specific query by ID
-            history_to_export = []
-            recent_history = Talk2SQL.get_query_history()
-            for item in recent_history:
-                if item.get('id') == query_id:
-                    history_to_export = [item]
-                    break
+            history_to_export = Talk2SQL.get_query_history(query_id=query_id, limit=1)
                     
             if not history_to_export:
                 return jsonify({'status': 'error', 'message': f'Query with ID {query_id} not found'}), 404
@@ -2170,24 +2203,29 @@ Export generated on: """ + datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         traceback.print_exc()
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-def _parse_iso(ts: str) -> datetime.datetime:
-    """Robust ISO‑timestamp → datetime (fallback = now)."""
-    try:
-        return datetime.datetime.fromisoformat(ts)
-    except Exception:
-        return datetime.datetime.now()
+def _time_range_since(time_range: str):
+    """Start of a named time range (day | week | month); None for "all"."""
+    days = {"day": 1, "week": 7, "month": 30}.get(time_range)
+    if days is None:
+        return None
+    return datetime.datetime.now() - datetime.timedelta(days=days)
 
 
-def _percentile(values, q):
-    """Safe percentile (returns 0 if data missing)."""
-    try:
-        return float(np.percentile(values, q)) if values else 0
-    except Exception:
-        return 0
+def _stage_percentile(stage, sketch, q):
+    """
+    Percentile of a stage (0 if no data).
+    
+    Uses the stage's latency sketch when it holds exactly the queries of the
+    range, otherwise the rollup histogram. Sketch buckets (an hour, or a day
+    once compacted) can reach before the range start; the rollups cannot.
+    """
+    if sketch and sketch["count"] == stage["count"] and sketch.get(f"p{q}_ms") is not None:
+        return sketch[f"p{q}_ms"]
+    return histogram_quantile(stage["histogram"], q) if stage["count"] else 0
 
 
-def _mean(values):
-    return float(statistics.mean(values)) if values else 0
+def _stage_mean(stage):
+    return stage["sum_ms"] / stage["count"] if stage["count"] else 0
 
 # Get evaluation metrics from query history
 @app.route('/metrics', methods=['GET'])
@@ -2196,14 +2234,15 @@ def get_metrics():
     try:
         # 1️⃣ Parameters
         time_range = request.args.get("time_range", "all")  # all | day | week | month
-        limit = int(request.args.get("limit", 1000))
 
-        # 2️⃣ Pull history (latest first)
-        history = Talk2SQL.get_query_history(limit=limit)
+        # 2️⃣ Merge the rollups of the range (maintained as queries are recorded)
+        since = _time_range_since(time_range)
+        metrics = Talk2SQL.get_query_metrics(since=since)
         
         # Create a default empty response that the frontend can safely render
         default_response = {
             "status": "success",
+            "since": since.isoformat() if since else None,
             "total_queries": 0,
             "successful_queries": 0,
             "error_queries": 0,
@@ -2211,12 +2250,19 @@ def get_metrics():
             "latency": {
                 "p50_total_ms": 0,
                 "p95_total_ms": 0,
+                "p99_total_ms": 0,
                 "stage_p95_ms": {
                     "generation_ms": 0,
                     "execution_ms": 0,
                     "visualization_ms": 0,
                     "explanation_ms": 0,
                 },
+                "stage_p99_ms": {
+                    "generation_ms": 0,
+                    "execution_ms": 0,
+                    "visualization_ms": 0,
+                    "explanation_ms": 0,
+                },
                 "mean_breakdown_pct": {
                     "generation_pct": 25,
                     "execution_pct": 25,
@@ -2246,50 +2292,47 @@ def get_metrics():
             },
         }
         
-        if not history:
-            default_response["message"] = "No query history"
+        totals = metrics["totals"]
+        if not totals.get("total"):
+            default_response["message"] = "No query history" if time_range == "all" else "No query history in selected time range"
             return jsonify(default_response)
 
-        # 3️⃣ Filter by time window
-        if time_range != "all":
-            now = datetime.datetime.now()
-            delta = {"day": 1, "week": 7, "month": 30}[time_range]
-            history = [item for item in history if (now - _parse_iso(item.get("timestamp", ""))).days <= delta]
+        stages = metrics["stages"]
+        sketches = Talk2SQL.get_latency_quantiles(since=since) if hasattr(Talk2SQL, "get_latency_quantiles") else {}
 
-        if not history:
-            default_response["message"] = "No query history in selected time range"
-            return jsonify(default_response)
-
-        # Pre‑extract common lists for fast stats
-        total_times = [item.get("total_time_ms", 0) for item in history if item.get("total_time_ms")]
-        gen_times   = [item.get("sql_generation_time_ms", 0) for item in history if item.get("sql_generation_time_ms")]
-        exec_times  = [item.get("sql_execution_time_ms", 0) for item in history if item.get("sql_execution_time_ms")]
-        viz_times   = [item.get("visualization_time_ms", 0) for item in history if item.get("visualization_time_ms")]
-        expl_times  = [item.get("explanation_time_ms", 0) for item in history if item.get("explanation_time_ms")]
-
-        # 4️⃣ High‑level counts
-        total_q        = len(history)
-        success_q      = sum(1 for h in history if h.get("success"))
+        # 3️⃣ High‑level counts
+        total_q        = totals["total"]
+        success_q      = totals["success"]
         error_q        = total_q - success_q
         success_rate   = (success_q / total_q) * 100 if total_q else 0
 
-        # 5️⃣ Percentiles (p50 & p95)
-        latency_p50 = _percentile(total_times, 50)
-        latency_p95 = _percentile(total_times, 95)
+        # 4️⃣ Percentiles (p50, p95 & p99) from the merged latency sketches/histograms
+        def stage_percentile(name, q):
+            return _stage_percentile(stages[name], sketches.get(name), q)
+
+        latency_p50 = stage_percentile("total", 50)
+        latency_p95 = stage_percentile("total", 95)
+        latency_p99 = stage_percentile("total", 99)
 
         stage_p95 = {
-            "generation_ms": _percentile(gen_times, 95),
-            "execution_ms":  _percentile(exec_times, 95),
-            "visualization_ms": _percentile(viz_times, 95),
-            "explanation_ms":  _percentile(expl_times, 95),
+            "generation_ms": stage_percentile("generation", 95),
+            "execution_ms":  stage_percentile("execution", 95),
+            "visualization_ms": stage_percentile("visualization", 95),
+            "explanation_ms":  stage_percentile("explanation", 95),
+        }
+        stage_p99 = {
+            "generation_ms": stage_percentile("generation", 99),
+            "execution_ms":  stage_percentile("execution", 99),
+            "visualization_ms": stage_percentile("visualization", 99),
+            "explanation_ms":  stage_percentile("explanation", 99),
         }
 
-        # 6️⃣ Latency breakdown (mean share)
-        mean_gen = _mean(gen_times)
-        mean_exec = _mean(exec_times)
-        mean_viz = _mean(viz_times)
-        mean_expl = _mean(expl_times)
-        mean_total = _mean(total_times)
+        # 5️⃣ Latency breakdown (mean share)
+        mean_gen = _stage_mean(stages["generation"])
+        mean_exec = _stage_mean(stages["execution"])
+        mean_viz = _stage_mean(stages["visualization"])
+        mean_expl = _stage_mean(stages["explanation"])
+        mean_total = _stage_mean(stages["total"])
         breakdown_share = {
             "generation_pct": (mean_gen / mean_total) * 100 if mean_total else 25,
             "execution_pct":  (mean_exec / mean_total) * 100 if mean_total else 25,
@@ -2297,63 +2340,35 @@ def get_metrics():
             "explanation_pct":  (mean_expl / mean_total) * 100 if mean_total else 25,
         }
 
-        # 7️⃣ Retry insights
-        retry_counts = [h.get("retry_count", 0) for h in history]
-        queries_with_retry = sum(1 for r in retry_counts if r > 0)
-        total_retries = sum(retry_counts)
+        # 6️⃣ Retry insights
+        queries_with_retry = totals["retried"]
+        total_retries = totals["retries"]
         retry_rate   = (queries_with_retry / total_q) * 100 if total_q else 0
-        retry_success = sum(1 for h in history if h.get("retry_count", 0) > 0 and h.get("success"))
+        retry_success = totals["retry_success"]
         retry_success_rate = (retry_success / queries_with_retry) * 100 if queries_with_retry else 0
 
-        # 8️⃣ Memory usage stats
-        uses_mem = [h for h in history if h.get("used_memory")]
-        mem_used_q = len(uses_mem)
-        mem_success_q = sum(1 for h in uses_mem if h.get("success"))
+        # 7️⃣ Memory usage stats
+        mem_used_q = totals["with_memory"]
+        mem_success_q = totals["memory_success"]
         mem_success_rate = (mem_success_q / mem_used_q) * 100 if mem_used_q else 0
         no_mem_q = total_q - mem_used_q
         no_mem_success_rate = (success_q - mem_success_q) / no_mem_q * 100 if no_mem_q else 0
 
-        # 9️⃣ Error taxonomy (top 5)
-        err_bucket = Counter()
-        for h in history:
-            if h.get("success"):
-                continue
-            msg = (h.get("error_message") or "").lower()
-            if "syntax" in msg:
-                err_bucket["syntax_error"] += 1
-            elif "timeout" in msg:
-                err_bucket["timeout"] += 1
-            elif any(t in msg for t in ["permission", "access"]):
-                err_bucket["permission"] += 1
-            elif "connection" in msg:
-                err_bucket["connection"] += 1
-            elif "not exist" in msg or "not found" in msg:
-                if "table" in msg:
-                    err_bucket["table_not_found"] += 1
-                elif "column" in msg:
-                    err_bucket["column_not_found"] += 1
-            else:
-                err_bucket["other"] += 1
-        top_errors = err_bucket.most_common(5)
-
-        # 🔟 Time‑series (per‑day)
-        ts_counts = defaultdict(lambda: {"total": 0, "success": 0, "retry": 0})
-        for h in history:
-            d = _parse_iso(h.get("timestamp", "")).date().isoformat()
-            ts_counts[d]["total"] += 1
-            if h.get("success"):
-                ts_counts[d]["success"] += 1
-            if h.get("retry_count", 0) > 0:
-                ts_counts[d]["retry"] += 1
-        ts_sorted = sorted(ts_counts.items())
-        dates             = [d for d, _ in ts_sorted]
-        daily_total       = [v["total"] for _, v in ts_sorted]
-        daily_success     = [v["success"] for _, v in ts_sorted]
-        daily_retry       = [v["retry"] for _, v in ts_sorted]
+        # 8️⃣ Error taxonomy (top 5)
+        top_errors = sorted(metrics["errors"]["class"].items(), key=lambda x: x[1], reverse=True)[:5]
+
+        # 9️⃣ Time‑series (per‑day)
+        days              = metrics["days"]
+        dates             = [d["day"] for d in days]
+        daily_total       = [d["total"] for d in days]
+        daily_success     = [d["success"] for d in days]
+        daily_retry       = [d["retried"] for d in days]
         daily_success_pct = [(s / t) * 100 if t else 0 for s, t in zip(daily_success, daily_total)]
 
-        # 1️⃣1️⃣ Package response
+        # 🔟 Package response
         response = {
+            # Start of the window every count and percentile covers (None = all history)
+            "since": since.isoformat() if since else None,
             "total_queries": total_q,
             "successful_queries": success_q,
             "error_queries": error_q,
@@ -2362,7 +2377,9 @@ def get_metrics():
             "latency": {
                 "p50_total_ms": latency_p50,
                 "p95_total_ms": latency_p95,
+                "p99_total_ms": latency_p99,
                 "stage_p95_ms": stage_p95,
+                "stage_p99_ms": stage_p99,
                 "mean_breakdown_pct": breakdown_share,
             },
 
@@ -2398,6 +2415,42 @@ def get_metrics():
         return jsonify({"status": "error", "message": str(exc)}), 500
 
 
+# Latency quantiles per pipeline stage from the streaming sketches
+@app.route('/latency', methods=['GET'])
+def get_latency():
+    """
+    Return p50/p95/p99 latency per stage over a time window.
+
+    Query parameters: time_range (all | day | week | month) or since/until
+    (ISO timestamps), and db_id to restrict to one database.
+    """
+    try:
+        since = request.args.get("since")
+        until = request.args.get("until")
+        since = datetime.datetime.fromisoformat(since) if since else _time_range_since(request.args.get("time_range", "all"))
+        until = datetime.datetime.fromisoformat(until) if until else None
+
+        db_id = request.args.get("db_id")
+        database = resolve_request_db_path(db_id, require_vectors=False) if db_id else None
+        if db_id and database is None:
+            return jsonify({"status": "error", "message": f"Unknown database: {db_id}"}), 400
+
+        stages = Talk2SQL.get_latency_quantiles(since=since, until=until, database=database)
+        return jsonify({
+            "status": "success",
+            "since": since.isoformat() if since else None,
+            "until": until.isoformat() if until else None,
+            "database": database,
+            "stages": stages,
+            "sketches": Talk2SQL.latency_sketches.stats()
+        })
+    except ValueError as exc:
+        return jsonify({"status": "error", "message": f"Invalid timestamp: {exc}"}), 400
+    except Exception as exc:
+        traceback.print_exc()
+        return jsonify({"status": "error", "message": str(exc)}), 500
+
+
 # @app.route('/starter_questions', methods=['GET'])
 # def get_starter_questions():
 #     """
@@ -2611,48 +2664,17 @@ def get_starter_questions():
         db_name = os.path.basename(db_path).lower()
         app.logger.info(f"[STARTER_QUESTIONS] Database name: {db_name}")
         
-        # Create a temporary connection to get schema info
+        # Get schema info from the catalog cache instead of re-scanning the database
         schema_info = ""
-        temp_conn = None
         
         try:
-            # Connect to the database to get schema
-            app.logger.info(f"[STARTER_QUESTIONS] Connecting to database: {db_path}")
-            temp_conn = sqlite3.connect(db_path)
-            cursor = temp_conn.cursor()
-            
-            # Get table list
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
-            tables = cursor.fetchall()
-            table_names = [table[0] for table in tables]
-            
+            catalog = schema_catalog.get(db_path)
+            table_names = catalog.table_names()
             app.logger.info(f"[STARTER_QUESTIONS] Found tables: {table_names}")
-            
-            # Get schema details for each table
-            for table_name in table_names:
-                schema_info += f"Table: {table_name}\n"
-                cursor.execute(f"PRAGMA table_info({table_name})")
-                columns = cursor.fetchall()
-                for col in columns:
-                    schema_info += f"  - {col[1]} ({col[2]})\n"
-                schema_info += "\n"
-                
-                # For the first few tables, also get sample data count
-                if tables.index((table_name,)) < 3:
-                    try:
-                        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                        count = cursor.fetchone()[0]
-                        schema_info += f"  Count: {count} rows\n\n"
-                    except:
-                        pass
+            schema_info = catalog.to_text()
         except Exception as e:
             app.logger.error(f"[STARTER_QUESTIONS] Error getting schema: {str(e)}")
             schema_info = "Error getting schema"
-        finally:
-            # Close the temporary connection
-            if temp_conn:
-                temp_conn.close()
-                app.logger.info("[STARTER_QUESTIONS] Temporary connection closed")
         
         # Get the requested number of questions
         count = request.args.get('count', default=10, type=int)
@@ -2797,14 +2819,14 @@ def get_schema_visualization():
     This provides a quick overview of tables, columns, and relationships.
     """
     try:
-        if not Talk2SQL or not Talk2SQL.conn:
+        if not current_db_path:
             return jsonify({"success": False, "error": "No database connection"}), 400
             
-        # Get database schema
-        schema_info = get_db_schema()
+        # Get database schema from the catalog cache
+        catalog = schema_catalog.get(current_db_path)
         
         # Format the schema as a tree structure for visualization
-        schema_tree = format_schema_as_tree(schema_info['tables'])
+        schema_tree = catalog.to_tree()
         
         return jsonify({
             "success": True,
@@ -2814,53 +2836,6 @@ def get_schema_visualization():
         app.logger.error(f"Error generating schema visualization: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
-def format_schema_as_tree(tables):
-    """
-    Format database schema as a tree structure for visualization.
-    
-    Args:
-        tables: Dictionary of tables and their columns
-        
-    Returns:
-        Tree structure of the schema
-    """
-    tree = []
-    
-    for table_name, table_info in tables.items():
-        table_node = {
-            "id": f"table-{table_name}",
-            "name": table_name,
-            "type": "table",
-            "children": []
-        }
-        
-        # Add columns as children
-        for column in table_info['columns']:
-            column_node = {
-                "id": f"column-{table_name}-{column['name']}",
-                "name": column['name'],
-                "type": "column",
-                "dataType": column['type'],
-                "isPrimaryKey": column['pk'] == 1,
-                "isNullable": column['notnull'] == 0
-            }
-            table_node["children"].append(column_node)
-            
-        # Add foreign keys if available
-        if 'foreign_keys' in table_info:
-            for fk in table_info['foreign_keys']:
-                for column_name, reference in fk.items():
-                    # Find the column node
-                    for column in table_node["children"]:
-                        if column["name"] == column_name:
-                            column["isForeignKey"] = True
-                            column["references"] = reference
-                            break
-        
-        tree.append(table_node)
-    
-    return tree
-
 @app.route('/update_documentation', methods=['PUT'])
 def update_documentation():
     """
@@ -2917,22 +2892,38 @@ def bulk_manage_training_data():
             if 'examples' not in data or not isinstance(data['examples'], list):
                 return jsonify({"success": False, "error": "Examples list is required for bulk upload"}), 400
                 
-            results = []
-            for example in data['examples']:
+            results = [None] * len(data['examples'])
+            
+            # Question-SQL pairs go through the batched ingest path
+            question_indexes = [
+                i for i, example in enumerate(data['examples'])
+                if isinstance(example, dict) and 'question' in example and 'sql' in example
+            ]
+            if question_indexes:
                 try:
-                    if 'question' in example and 'sql' in example:
-                        example_id = Talk2SQL.add_question_sql(example['question'], example['sql'])
-                        results.append({"id": example_id, "type": "question", "success": True})
-                    elif 'schema' in example:
+                    example_ids = Talk2SQL.add_question_sql_batch([
+                        (data['examples'][i]['question'], data['examples'][i]['sql']) for i in question_indexes
+                    ])
+                    for i, example_id in zip(question_indexes, example_ids):
+                        results[i] = {"id": example_id, "type": "question", "success": True}
+                except Exception as e:
+                    for i in question_indexes:
+                        results[i] = {"error": str(e), "success": False}
+            
+            for i, example in enumerate(data['examples']):
+                if results[i] is not None:
+                    continue
+                try:
+                    if 'schema' in example:
                         schema_id = Talk2SQL.add_schema(example['schema'])
-                        results.append({"id": schema_id, "type": "schema", "success": True})
+                        results[i] = {"id": schema_id, "type": "schema", "success": True}
                     elif 'documentation' in example:
                         doc_id = Talk2SQL.add_documentation(example['documentation'])
-                        results.append({"id": doc_id, "type": "documentation", "success": True})
+                        results[i] = {"id": doc_id, "type": "documentation", "success": True}
                     else:
-                        results.append({"error": "Invalid example format", "success": False})
+                        results[i] = {"error": "Invalid example format", "success": False}
                 except Exception as e:
-                    results.append({"error": str(e), "success": False})
+                    results[i] = {"error": str(e), "success": False}
                     
             return jsonify({
                 "success": True,
@@ -3043,23 +3034,7 @@ def debug_starter_questions():
                     # Get schema from database
                     schema_info = ""
                     try:
-                        # Connect temporarily if needed
-                        if not Talk2SQL.conn:
-                            app.logger.info(f"[DEBUG] Connecting to {db_path}")
-                            Talk2SQL.connect_to_sqlite(db_path)
-                            
-                        cursor = Talk2SQL.conn.cursor()
-                        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
-                        tables = cursor.fetchall()
-                        
-                        for table in tables:
-                            table_name = table[0]
-                            schema_info += f"Table: {table_name}\n"
-                            cursor.execute(f"PRAGMA table_info({table_name})")
-                            columns = cursor.fetchall()
-                            for col in columns:
-                                schema_info += f"  - {col[1]} ({col[2]})\n"
-                            schema_info += "\n"
+                        schema_info = schema_catalog.get(db_path).to_text(count_tables=0)
                     except Exception as e:
                         app.logger.error(f"[DEBUG] Error getting schema: {str(e)}")
                         response_data["steps"].append({
@@ -1,32 +1,284 @@
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from typing import List, Tuple, Union, Callable, Dict, Any, Optional, Iterator
 import pandas as pd
 import plotly.graph_objects as go
 import sqlparse
+import hashlib
 import re
+import threading
 import traceback
 from talk2sql.exceptions import SQLParsingError
+from talk2sql.cache.result import QueryResultCache
+from talk2sql.cache.sql import SQLAnswerCache
+from talk2sql.schema_catalog import SchemaCatalog, SchemaCatalogCache
+from talk2sql.session import QuerySession, SessionAwareMixin, get_current_session
 
-class Talk2SQLBase(ABC):
+class Talk2SQLBase(SessionAwareMixin, ABC):
     """Abstract base class for Talk2SQL that defines core interfaces and functionality."""
     
     def __init__(self, config=None):
         self.config = config or {}
         self.run_sql_is_set = False
+        # File behind the engine's own run_sql (set by connect_to_sqlite, see get_database_path)
+        self.database_path = None
+        self._database_path_run_sql = None
         self.static_documentation = ""
         self.dialect = self.config.get("dialect", "SQL")
         self.language = self.config.get("language", None)
         self.max_tokens = self.config.get("max_tokens", 8000)
         self.max_retry_attempts = self.config.get("max_retry_attempts", 3)
+        self.query_timeout = self.config.get("query_timeout", 30)
+        self.max_result_rows = self.config.get("max_result_rows", 10000)
+        self.stream_sql_generation = self.config.get("stream_sql_generation", True)
         # Initialize streaming pipeline if enabled
         self._streaming_pipeline = None
         self._enable_streaming = self.config.get("enable_streaming", False)
         self._enable_threading = self.config.get("enable_threading", False)
+        # Request-scoped retrieval state (one per thread, see retrieval_context)
+        self._retrieval_state = threading.local()
+        # Previously successful SQL, reused for repeated questions (see get_cached_sql)
+        self.sql_cache = None
+        if self.config.get("sql_cache", True):
+            self.sql_cache = SQLAnswerCache(
+                similarity_threshold=self.config.get("sql_cache_similarity_threshold", None),
+                max_entries=self.config.get("sql_cache_max_entries", 1000)
+            )
+        # Schema catalogs of connected databases (see get_schema_catalog); apps may share one cache
+        self.schema_catalog_cache = SchemaCatalogCache(persist=self.config.get("persist_schema_catalog", True))
+        # Results of recently run SQL, reused until the database changes (see run_sql_cached)
+        self.result_cache = None
+        if self.config.get("result_cache", True):
+            self.result_cache = QueryResultCache(
+                max_bytes=self.config.get("result_cache_max_bytes", 64 * 1024 * 1024)
+            )
     
     def log(self, message, title="Info"):
         """Log a message with a title."""
         print(f"{title}: {message}")
     
+    @contextmanager
+    def query_session(self, session: Optional[QuerySession] = None):
+        """
+        Run the enclosed block with a request-scoped session active.
+        
+        While active, run_sql, the collection names and save_query_history are
+        read from the session (where set) instead of this instance.
+        
+        Args:
+            session: Session to activate (None = use the instance settings)
+        """
+        if session is None:
+            yield None
+            return
+        
+        token = session.activate()
+        try:
+            yield session
+        finally:
+            QuerySession.deactivate(token)
+    
+    @contextmanager
+    def retrieval_context(self, question: str):
+        """
+        Share a single question embedding across all retrieval calls in a request.
+        
+        While the context is active, every search for the same question on the
+        current thread reuses one embedding instead of calling the embeddings API
+        again. Nested contexts for the same question reuse the outer one.
+        
+        Args:
+            question: Natural language question being answered
+        """
+        previous = getattr(self._retrieval_state, "context", None)
+        if previous is not None and previous["question"] == question:
+            yield previous
+            return
+        
+        self._retrieval_state.context = {"question": question, "embedding": None}
+        try:
+            yield self._retrieval_state.context
+        finally:
+            self._retrieval_state.context = previous
+    
+    def _get_query_embedding(self, question: str, embedding: List[float] = None) -> List[float]:
+        """
+        Get the embedding for a search query, reusing the active retrieval context.
+        
+        Args:
+            question: Natural language question
+            embedding: Precomputed embedding (used as-is if provided)
+            
+        Returns:
+            Embedding vector for the question
+        """
+        if embedding is not None:
+            return embedding
+        
+        context = getattr(self._retrieval_state, "context", None)
+        if context is None or context["question"] != question:
+            return self.generate_embedding(question)
+        
+        if context["embedding"] is None:
+            context["embedding"] = self.generate_embedding(question)
+        return context["embedding"]
+    
+    @staticmethod
+    def get_result_size(df) -> Dict[str, Any]:
+        """
+        Describe the full size of a query result that may have been capped at max_result_rows.
+        
+        Args:
+            df: DataFrame returned by run_sql
+            
+        Returns:
+            Dictionary with row_count (total rows, a lower bound if not exact),
+            row_count_exact and truncated
+        """
+        if df is None:
+            return {"row_count": 0, "row_count_exact": True, "truncated": False}
+        return {
+            "row_count": df.attrs.get("total_rows", len(df)),
+            "row_count_exact": df.attrs.get("row_count_exact", True),
+            "truncated": df.attrs.get("truncated", False)
+        }
+    
+    def get_database_path(self) -> Optional[str]:
+        """
+        Get the file of the database SQL currently runs against.
+        
+        Returns:
+            Database file path, or None if there is no file-backed database
+        """
+        if not self.run_sql_is_set:
+            return None
+        
+        # Known from connect_to_sqlite or the request's session; only look it up once otherwise
+        session = get_current_session()
+        owner = session if session is not None and session.run_sql is not None else None
+        if owner is not None:
+            if owner.database_path:
+                return owner.database_path
+        elif self.database_path and self._database_path_run_sql is self.run_sql:
+            return self.database_path
+        
+        databases = self.run_sql("PRAGMA database_list")
+        main = databases[databases["name"] == "main"]
+        database = str(main["file"].iloc[0]) if not main.empty else ""
+        database = database or None
+        if owner is not None:
+            owner.database_path = database
+        else:
+            self.database_path = database
+            self._database_path_run_sql = self.run_sql
+        return database
+    
+    def get_schema_catalog(self) -> Optional[SchemaCatalog]:
+        """
+        Get the schema catalog of the database SQL currently runs against.
+        
+        Returns:
+            SchemaCatalog, or None if there is no file-backed database
+        """
+        try:
+            database = self.get_database_path()
+            if not database:
+                return None
+            return self.schema_catalog_cache.get(database)
+        except Exception as e:
+            print(f"Error getting schema catalog: {e}")
+            return None
+    
+    def get_schema_fingerprint(self) -> Optional[Tuple[str, str]]:
+        """
+        Identify the connected database and hash its schema.
+        
+        Returns:
+            (database file, schema hash), or None if it can't be determined
+        """
+        try:
+            database = self.get_database_path() or ""
+            
+            schema_df = self.run_sql("SELECT type, name, sql FROM sqlite_master ORDER BY type, name")
+            fingerprint = hashlib.sha256(schema_df.to_csv(index=False).encode("utf-8")).hexdigest()
+            return database, fingerprint
+        except Exception as e:
+            print(f"Error computing schema fingerprint: {e}")
+            return None
+    
+    def get_cached_sql(self, question: str) -> Optional[Tuple[str, str]]:
+        """
+        Look up previously successful SQL for this question on the current schema.
+        
+        Args:
+            question: Natural language question
+            
+        Returns:
+            (sql, tier) where tier is "exact" or "similar", or None on a miss
+        """
+        if self.sql_cache is None or not self.run_sql_is_set:
+            return None
+        
+        fingerprint = self.get_schema_fingerprint()
+        if fingerprint is None:
+            return None
+        
+        def embed():
+            try:
+                return self._get_query_embedding(question)
+            except Exception as e:
+                print(f"Error embedding question for SQL cache lookup: {e}")
+                return None
+        
+        database, schema_hash = fingerprint
+        if self.sql_cache.similarity_threshold is None:
+            return self.sql_cache.get(database, schema_hash, question)
+        return self.sql_cache.get(database, schema_hash, question, embed=embed)
+    
+    def cache_sql(self, question: str, sql: str):
+        """
+        Remember SQL that answered a question successfully.
+        
+        Args:
+            question: Natural language question
+            sql: SQL that executed successfully
+        """
+        if self.sql_cache is None or not sql:
+            return
+        
+        fingerprint = self.get_schema_fingerprint()
+        if fingerprint is None:
+            return
+        
+        # Embeddings are only needed by the (opt-in) similarity tier
+        embedding = None
+        if self.sql_cache.similarity_threshold is not None:
+            try:
+                embedding = self._get_query_embedding(question)
+            except Exception as e:
+                print(f"Error embedding question for SQL cache: {e}")
+        
+        database, schema_hash = fingerprint
+        self.sql_cache.put(database, schema_hash, question, sql, embedding=embedding)
+    
+    def run_sql_cached(self, database: str, sql: str, execute: Callable[[], pd.DataFrame],
+                       max_rows: int = None) -> pd.DataFrame:
+        """
+        Run SQL through the result cache.
+        
+        Args:
+            database: Path to the database the SQL runs on
+            sql: SQL query
+            execute: Function that runs the query and returns a DataFrame
+            max_rows: Row cap the query runs with
+            
+        Returns:
+            Query result (``df.attrs["result_cache_hit"]`` is True when it came from the cache)
+        """
+        if self.result_cache is None:
+            return execute()
+        return self.result_cache.get_or_execute(database, sql, execute, max_rows=max_rows)
+    
     def generate_sql(self, question: str, allow_introspection=False, **kwargs) -> str:
         """
         Generate SQL for a given question using the LLM and vector context.
@@ -41,9 +293,10 @@ class Talk2SQLBase(ABC):
         initial_prompt = self.config.get("initial_prompt", None)
         
         # Get context from vector store
-        similar_questions = self.get_similar_questions(question)
-        schema_info = self.get_related_schema(question)
-        documentation = self.get_related_documentation(question)
+        context = self.get_related_context(question)
+        similar_questions = context["similar_questions"]
+        schema_info = context["schema"]
+        documentation = context["documentation"]
         
         # Build prompt with context
         prompt = self.get_sql_prompt(
@@ -56,8 +309,11 @@ class Talk2SQLBase(ABC):
         
         self.log(prompt, "SQL Prompt")
         
-        # Submit to LLM
-        llm_response = self.submit_prompt(prompt)
+        # Submit to LLM, stopping as soon as the SQL is complete
+        if self.stream_sql_generation:
+            llm_response = self.submit_prompt_until(prompt, "</sql>")
+        else:
+            llm_response = self.submit_prompt(prompt)
         self.log(llm_response, "LLM Response")
         
         # Check if introspection is needed and allowed
@@ -106,9 +362,10 @@ class Talk2SQLBase(ABC):
         initial_prompt = self.config.get("initial_prompt", None)
         
         # Get context from vector store
-        similar_questions = self.get_similar_questions(question)
-        schema_info = self.get_related_schema(question)
-        documentation = self.get_related_documentation(question)
+        context = self.get_related_context(question)
+        similar_questions = context["similar_questions"]
+        schema_info = context["schema"]
+        documentation = context["documentation"]
         
         # Build prompt with context and error information
         prompt = self.get_sql_correction_prompt(
@@ -561,6 +818,44 @@ class Talk2SQLBase(ABC):
         """Submit a prompt to the LLM and get response."""
         pass
     
+    def submit_prompt_stream(self, prompt, **kwargs) -> Iterator[str]:
+        """Submit a prompt and yield the response as it arrives (default: all at once)."""
+        yield self.submit_prompt(prompt, **kwargs)
+    
+    def submit_prompt_until(self, prompt, stop_marker: str, **kwargs) -> str:
+        """
+        Stream a response and stop reading as soon as a marker has been received.
+        
+        Args:
+            prompt: List of message dictionaries
+            stop_marker: Text that ends the useful part of the response (e.g. "</sql>")
+            
+        Returns:
+            Response text up to and including the marker
+        """
+        text = ""
+        stream = self.submit_prompt_stream(prompt, **kwargs)
+        try:
+            for chunk in stream:
+                text += chunk
+                # Only the tail can contain a marker that just completed
+                if stop_marker in text[-(len(chunk) + len(stop_marker)):]:
+                    break
+        except Exception as e:
+            # The marker wasn't seen yet (we stop reading once it is), so the partial
+            # text may be cut mid-statement; ask again without streaming
+            print(f"Error streaming response, retrying without streaming: {e}")
+            text = None
+        finally:
+            # Closing the generator closes the HTTP stream so the rest isn't read
+            stream.close()
+        
+        if text is None:
+            return self.submit_prompt(prompt, **kwargs)
+        
+        end = text.find(stop_marker)
+        return text[:end + len(stop_marker)] if end != -1 else text
+    
     @abstractmethod
     def generate_plotly_code(self, question, sql, df_metadata) -> str:
         """Generate Plotly visualization code."""
@@ -571,21 +866,33 @@ class Talk2SQLBase(ABC):
         """Generate embedding vector for text."""
         pass
     
+    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Generate embedding vectors for several texts (default: one call per text)."""
+        return [self.generate_embedding(text) for text in texts]
+    
     @abstractmethod
-    def get_similar_questions(self, question: str) -> list:
+    def get_similar_questions(self, question: str, embedding: List[float] = None) -> list:
         """Get similar questions with their SQL from vector store."""
         pass
     
     @abstractmethod
-    def get_related_schema(self, question: str) -> list:
+    def get_related_schema(self, question: str, embedding: List[float] = None) -> list:
         """Get related schema information from vector store."""
         pass
     
     @abstractmethod
-    def get_related_documentation(self, question: str) -> list:
+    def get_related_documentation(self, question: str, embedding: List[float] = None) -> list:
         """Get related documentation from vector store."""
         pass
     
+    def get_related_context(self, question: str, embedding: List[float] = None) -> dict:
+        """Get similar questions, schema and documentation together (default: three lookups)."""
+        return {
+            "similar_questions": self.get_similar_questions(question, embedding=embedding),
+            "schema": self.get_related_schema(question, embedding=embedding),
+            "documentation": self.get_related_documentation(question, embedding=embedding),
+        }
+    
     @abstractmethod
     def add_question_sql(self, question: str, sql: str) -> str:
         """Add question-SQL pair to vector store."""
@@ -596,6 +903,10 @@ class Talk2SQLBase(ABC):
         """Add database schema to vector store."""
         pass
     
+    def add_table_schemas(self, tables: List[dict]) -> List[str]:
+        """Add per-table schema entries (default: one add_schema call per table, neighbours ignored)."""
+        return [self.add_schema(table["schema"]) for table in tables]
+    
     @abstractmethod
     def add_documentation(self, documentation: str) -> str:
         """Add documentation to vector store."""
@@ -0,0 +1,151 @@
+"""
+Content-addressed, compressed blob storage for query history.
+
+Result data and figures are stored once per distinct content in the
+``history_blobs`` table, keyed by the SHA-256 of their uncompressed bytes, and
+history rows only hold that key. A question answered with the same rows a
+hundred times stores its result once, and history scans that don't ask for
+results read only small rows.
+
+Blobs are compressed with zlib, or with zstd when configured and the
+``zstandard`` package is installed; the codec is stored per blob so both can
+be read back.
+"""
+
+import hashlib
+import sqlite3
+import zlib
+from typing import Dict, Iterable, Optional
+
+CODECS = ("zlib", "zstd", "none")
+
+# Blobs smaller than this are stored uncompressed
+MIN_COMPRESS_SIZE = 256
+
+# Hashes looked up per query (below SQLite's variable limit)
+_LOOKUP_CHUNK = 500
+
+
+def _zstd():
+    """Import zstandard lazily (optional dependency)."""
+    import zstandard
+    return zstandard
+
+
+class BlobStore:
+    """Deduplicating, compressing blob table in the history database."""
+
+    def __init__(self, codec: str = "zlib", level: int = 6):
+        """
+        Initialize the blob store.
+
+        Args:
+            codec: Compression for new blobs: "zlib", "zstd" or "none" (default: "zlib");
+                zstd falls back to zlib if zstandard isn't installed
+            level: Compression level (default: 6)
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown blob codec {codec!r}; expected one of {CODECS}")
+        if codec == "zstd":
+            try:
+                _zstd()
+            except ImportError:
+                print("zstandard is not installed; compressing history blobs with zlib")
+                codec = "zlib"
+        self.codec = codec
+        self.level = level
+
+    @staticmethod
+    def create_tables(conn: sqlite3.Connection):
+        """Create the blob table."""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS history_blobs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT,
+                size INTEGER,
+                data BLOB
+            )
+        ''')
+
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        """Key of a blob: SHA-256 of its uncompressed bytes."""
+        return hashlib.sha256(data).hexdigest()
+
+    def _compress(self, data: bytes):
+        """Compress with the configured codec; returns (codec, bytes)."""
+        if self.codec == "none" or len(data) < MIN_COMPRESS_SIZE:
+            return "none", data
+        if self.codec == "zstd":
+            return "zstd", _zstd().ZstdCompressor(level=self.level).compress(data)
+        return "zlib", zlib.compress(data, self.level)
+
+    @staticmethod
+    def _decompress(codec: str, data: bytes) -> bytes:
+        """Decompress a stored blob."""
+        if codec == "zlib":
+            return zlib.decompress(data)
+        if codec == "zstd":
+            return _zstd().ZstdDecompressor().decompress(data)
+        return bytes(data)
+
+    def put(self, conn: sqlite3.Connection, data: Optional[bytes]) -> Optional[str]:
+        """
+        Store a blob unless identical content is already stored.
+
+        Args:
+            conn: Connection inside the writing transaction
+            data: Uncompressed bytes (None = nothing to store)
+
+        Returns:
+            The blob's hash, or None for no data
+        """
+        if data is None:
+            return None
+        key = self.content_hash(data)
+        # Skip compressing content that is already stored
+        if conn.execute("SELECT 1 FROM history_blobs WHERE hash = ?", (key,)).fetchone() is None:
+            codec, stored = self._compress(data)
+            conn.execute(
+                "INSERT OR IGNORE INTO history_blobs (hash, codec, size, data) VALUES (?, ?, ?, ?)",
+                (key, codec, len(data), stored)
+            )
+        return key
+
+    def get_many(self, conn: sqlite3.Connection, hashes: Iterable[str]) -> Dict[str, bytes]:
+        """
+        Load and decompress blobs.
+
+        Args:
+            conn: Connection to the history database
+            hashes: Blob hashes (duplicates and None are ignored)
+
+        Returns:
+            Hash -> uncompressed bytes for the blobs found
+        """
+        wanted = list({key for key in hashes if key})
+        blobs = {}
+        for i in range(0, len(wanted), _LOOKUP_CHUNK):
+            chunk = wanted[i:i + _LOOKUP_CHUNK]
+            rows = conn.execute(
+                f"SELECT hash, codec, data FROM history_blobs WHERE hash IN ({', '.join('?' * len(chunk))})",
+                chunk
+            )
+            for key, codec, data in rows:
+                try:
+                    blobs[key] = self._decompress(codec, data)
+                except Exception as e:
+                    print(f"Error reading history blob {key}: {e}")
+        return blobs
+
+    def stats(self, conn: sqlite3.Connection) -> Dict[str, int]:
+        """
+        Get blob counts and sizes.
+
+        Returns:
+            Dictionary with blobs, bytes (uncompressed) and stored_bytes
+        """
+        blobs, size, stored = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM history_blobs"
+        ).fetchone()
+        return {"blobs": blobs, "bytes": size, "stored_bytes": stored}
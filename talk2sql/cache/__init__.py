@@ -0,0 +1,5 @@
+from talk2sql.cache.embedding import EmbeddingCache
+from talk2sql.cache.result import QueryResultCache
+from talk2sql.cache.sql import SQLAnswerCache
+
+__all__ = ['EmbeddingCache', 'QueryResultCache', 'SQLAnswerCache']
@@ -0,0 +1,214 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for embedding vectors.
+
+    Entries are keyed by embedding model/deployment plus a SHA-256 hash of the
+    text. The first tier is an in-process LRU bounded by bytes; the optional
+    second tier is a SQLite file storing vectors as float16 blobs, also bounded
+    by bytes and evicted least-recently-used first.
+    """
+
+    def __init__(self, path: str = None, max_memory_bytes: int = 64 * 1024 * 1024,
+                 max_disk_bytes: int = 256 * 1024 * 1024):
+        """
+        Initialize the embedding cache.
+
+        Args:
+            path: Path to the SQLite file for the on-disk tier (None = memory only)
+            max_memory_bytes: Maximum bytes of vectors kept in memory (default: 64 MB)
+            max_disk_bytes: Maximum bytes of vectors kept on disk (default: 256 MB)
+        """
+        self.path = path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._conn = None
+
+        # Hit/miss counters
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path:
+            self._init_disk_tier()
+
+    def _init_disk_tier(self):
+        """Open (or create) the SQLite file backing the on-disk tier."""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    dim INTEGER,
+                    vector BLOB,
+                    nbytes INTEGER,
+                    last_access REAL
+                )
+            ''')
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+            self._conn.commit()
+
+            row = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()
+            self._disk_bytes = row[0]
+        except Exception as e:
+            print(f"Error opening embedding cache at {self.path}, using memory only: {e}")
+            self._conn = None
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """Build the cache key for a model/text pair."""
+        return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """
+        Look up an embedding.
+
+        Args:
+            model: Embedding model or deployment name
+            text: Embedded text
+
+        Returns:
+            Embedding vector, or None on a miss
+        """
+        key = self.make_key(model, text)
+
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector.tolist()
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        self._conn.execute(
+                            "UPDATE embeddings SET last_access = ? WHERE key = ?", (time.time(), key)
+                        )
+                        self._conn.commit()
+                        vector = np.frombuffer(row[0], dtype=np.float16).astype(np.float32)
+                        self._remember(key, vector)
+                        self.disk_hits += 1
+                        return vector.tolist()
+                except sqlite3.Error as e:
+                    print(f"Error reading embedding cache: {e}")
+
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, embedding: List[float]):
+        """
+        Store an embedding in both tiers.
+
+        Args:
+            model: Embedding model or deployment name
+            text: Embedded text
+            embedding: Embedding vector
+        """
+        key = self.make_key(model, text)
+        vector = np.asarray(embedding, dtype=np.float32)
+
+        with self._lock:
+            self._remember(key, vector)
+
+            if self._conn is not None:
+                blob = vector.astype(np.float16).tobytes()
+                try:
+                    existing = self._conn.execute(
+                        "SELECT nbytes FROM embeddings WHERE key = ?", (key,)
+                    ).fetchone()
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, nbytes, last_access) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, model, len(vector), blob, len(blob), time.time())
+                    )
+                    self._disk_bytes += len(blob) - (existing[0] if existing else 0)
+                    self._evict_disk()
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    print(f"Error writing embedding cache: {e}")
+
+    def _remember(self, key: str, vector: np.ndarray):
+        """Insert a vector into the memory tier and evict LRU entries over budget."""
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous.nbytes
+
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes
+
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def _evict_disk(self):
+        """Delete least-recently-used disk entries until the tier fits its budget."""
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+
+        # Evict down to 90% of the budget so we don't evict on every insert
+        target = int(self.max_disk_bytes * 0.9)
+        rows = self._conn.execute(
+            "SELECT key, nbytes FROM embeddings ORDER BY last_access ASC"
+        )
+        evict_keys = []
+        remaining = self._disk_bytes
+        for key, nbytes in rows:
+            if remaining <= target:
+                break
+            evict_keys.append((key,))
+            remaining -= nbytes
+
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evict_keys)
+        self._disk_bytes = remaining
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get cache counters and sizes.
+
+        Returns:
+            Dictionary with hit/miss counts and tier sizes
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def close(self):
+        """Close the on-disk tier."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,219 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import pandas as pd
+
+
+class QueryResultCache:
+    """
+    Cache of query results, keyed by database, database version and normalized SQL.
+
+    The database version is taken from the file's size and modification time
+    (and those of its WAL file), so any committed write makes older entries
+    unreachable; they are dropped as soon as a new version is seen. Entries are
+    evicted least recently used first once their total size exceeds max_bytes.
+    Results are copied in and out, so callers can modify what they get back.
+    Queries that read the clock or random numbers (e.g. date('now'), random())
+    always run, since their results change without a write.
+    """
+
+    # Only plain reads are cached
+    _CACHEABLE = re.compile(r"^\s*(SELECT|WITH|VALUES)\b", re.IGNORECASE)
+    # Reads whose result can change without a write (clock, randomness, connection state)
+    _NONDETERMINISTIC = re.compile(
+        r"\b(?:random|randomblob|changes|total_changes|last_insert_rowid)\s*\("
+        r"|\bCURRENT_(?:TIMESTAMP|DATE|TIME)\b"
+        r"|'now'"
+        r"|\b(?:date|time|datetime|julianday|unixepoch)\s*\(\s*\)"
+        r"|\bstrftime\s*\(\s*'(?:[^']|'')*'\s*\)",
+        re.IGNORECASE
+    )
+    # Quoted strings/identifiers, kept verbatim during normalization
+    _QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\])")
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Initialize the result cache.
+
+        Args:
+            max_bytes: Maximum total size of cached DataFrames (default: 64 MB)
+        """
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        # (database, version, normalized sql, max_rows) -> (DataFrame, size in bytes)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Current version per database, used to drop stale entries
+        self._versions = {}
+
+        # Hit/miss counters
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def normalize_sql(cls, sql: str) -> str:
+        """Collapse whitespace outside quoted text and strip trailing semicolons."""
+        parts = cls._QUOTED.split(sql.strip().rstrip(";").strip())
+        # Odd indices are the quoted parts captured by split
+        return "".join(
+            part if i % 2 else re.sub(r"\s+", " ", part)
+            for i, part in enumerate(parts)
+        )
+
+    @classmethod
+    def is_cacheable(cls, sql: str) -> bool:
+        """Whether a query is a plain read whose result only changes when the database does."""
+        return bool(cls._CACHEABLE.match(sql)) and not cls._NONDETERMINISTIC.search(sql)
+
+    @staticmethod
+    def database_version(path: str) -> Optional[Tuple[int, ...]]:
+        """
+        Get a token that changes whenever the database file is written.
+
+        Args:
+            path: Path to the SQLite database file
+
+        Returns:
+            (size, mtime_ns) of the database and its WAL file, or None if it can't be read
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        version = (stat.st_size, stat.st_mtime_ns)
+        try:
+            wal = os.stat(path + "-wal")
+            version += (wal.st_size, wal.st_mtime_ns)
+        except OSError:
+            pass
+        return version
+
+    def _drop(self, key):
+        """Remove one entry (lock held)."""
+        _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _check_version(self, database: str, version: Tuple[int, ...]):
+        """Drop entries for a database whose version changed (lock held)."""
+        previous = self._versions.get(database)
+        if previous == version:
+            return
+
+        self._versions[database] = version
+        if previous is not None:
+            stale = [key for key in self._entries if key[0] == database and key[1] != version]
+            for key in stale:
+                self._drop(key)
+
+    def get_or_execute(self, database: str, sql: str, execute: Callable[[], pd.DataFrame],
+                       max_rows: int = None) -> pd.DataFrame:
+        """
+        Return a cached result for a query, or run it and cache the result.
+
+        A hit is marked with ``df.attrs["result_cache_hit"] = True``.
+
+        Args:
+            database: Path to the SQLite database file
+            sql: SQL query
+            execute: Function that runs the query and returns a DataFrame
+            max_rows: Row cap the query runs with (part of the key)
+
+        Returns:
+            Query result
+        """
+        if not database or not self.is_cacheable(sql):
+            return execute()
+
+        version = self.database_version(database)
+        if version is None:
+            return execute()
+
+        key = (os.path.abspath(database), version, self.normalize_sql(sql), max_rows)
+
+        with self._lock:
+            self._check_version(key[0], version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is not None:
+            df = entry[0].copy()
+            df.attrs["result_cache_hit"] = True
+            return df
+
+        # Run outside the lock so concurrent queries don't wait on each other
+        df = execute()
+        if isinstance(df, pd.DataFrame):
+            self.put(key, df)
+        return df
+
+    def put(self, key: Tuple[Any, ...], df: pd.DataFrame):
+        """
+        Store a query result.
+
+        Args:
+            key: (database, version, normalized sql, max_rows)
+            df: Query result
+        """
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+
+        df = df.copy()
+        with self._lock:
+            # The database may have changed while the query ran
+            if self._versions.get(key[0]) != key[1]:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (df, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, database: str = None):
+        """
+        Drop cached results.
+
+        Args:
+            database: Only drop results for this database (None = everything)
+        """
+        with self._lock:
+            if database is None:
+                self._entries.clear()
+                self._versions.clear()
+                self._bytes = 0
+                return
+
+            database = os.path.abspath(database)
+            self._versions.pop(database, None)
+            stale = [key for key in self._entries if key[0] == database]
+            for key in stale:
+                self._drop(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache counters and size.
+
+        Returns:
+            Dictionary with hit/miss counts, number of entries and bytes used
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
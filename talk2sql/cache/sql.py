@@ -0,0 +1,197 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class SQLAnswerCache:
+    """
+    Cache of previously successful SQL, keyed by question and schema fingerprint.
+
+    The exact tier matches on the normalized question text. The optional similarity
+    tier compares the question embedding against cached questions for the same
+    schema fingerprint that mention the same numbers and quoted values, and returns
+    the best match above a cosine threshold. Entries
+    recorded under a different fingerprint are dropped as soon as a new
+    fingerprint is seen for the same database, so schema changes invalidate them.
+    """
+
+    def __init__(self, similarity_threshold: Optional[float] = None, max_entries: int = 1000):
+        """
+        Initialize the SQL answer cache.
+
+        Args:
+            similarity_threshold: Minimum cosine similarity for a near-duplicate hit
+                (default: None = exact tier only)
+            max_entries: Maximum cached questions across all schemas (default: 1000)
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        # (fingerprint, normalized question) -> {"question", "sql", "embedding", "literals"}
+        self._entries = OrderedDict()
+        # Current fingerprint per database, used to invalidate stale entries
+        self._fingerprints = {}
+
+        # Hit/miss counters
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """Lower-case, collapse whitespace and strip trailing punctuation."""
+        question = re.sub(r"\s+", " ", question.strip().lower())
+        return question.rstrip(" ?.!")
+
+    @staticmethod
+    def question_literals(question: str) -> Tuple[str, ...]:
+        """Numbers and quoted values in a question, which near-duplicates must share."""
+        return tuple(
+            quoted_double or quoted_single or number
+            for quoted_double, quoted_single, number
+            in re.findall(r'"([^"]*)"|(?<!\w)\'([^\']*)\'(?!\w)|(\d+(?:\.\d+)?)', question)
+        )
+
+    def _check_fingerprint(self, database: str, fingerprint: str):
+        """Drop entries for a database whose schema fingerprint changed."""
+        previous = self._fingerprints.get(database)
+        if previous == fingerprint:
+            return
+
+        self._fingerprints[database] = fingerprint
+        if previous is not None:
+            stale = [key for key in self._entries if key[0] == previous]
+            for key in stale:
+                del self._entries[key]
+
+    def get(self, database: str, fingerprint: str, question: str,
+            embed: Callable[[], List[float]] = None) -> Optional[Tuple[str, str]]:
+        """
+        Look up cached SQL for a question.
+
+        Args:
+            database: Identifier of the connected database (e.g. its path)
+            fingerprint: Schema fingerprint of that database
+            question: Natural language question
+            embed: Function returning the question embedding, only called when
+                the exact tier misses and the similarity tier is enabled
+
+        Returns:
+            (sql, tier) where tier is "exact" or "similar", or None on a miss
+        """
+        key = (fingerprint, self.normalize_question(question))
+
+        with self._lock:
+            self._check_fingerprint(database, fingerprint)
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry["sql"], "exact"
+
+            candidates = []
+            if self.similarity_threshold is not None:
+                # Questions differing in a number or quoted value need different SQL
+                literals = self.question_literals(question)
+                candidates = [
+                    (candidate_key, entry) for candidate_key, entry in self._entries.items()
+                    if candidate_key[0] == fingerprint and entry["embedding"] is not None
+                    and entry["literals"] == literals
+                ]
+
+        # Embed outside the lock; this may call the embeddings API
+        if embed is not None and candidates:
+            embedding = embed()
+            if embedding is not None:
+                with self._lock:
+                    query = np.asarray(embedding, dtype=np.float32)
+                    norm = np.linalg.norm(query)
+                    if norm:
+                        query = query / norm
+                    matrix = np.stack([entry["embedding"] for _, entry in candidates])
+                    scores = matrix @ query
+                    best = int(np.argmax(scores))
+                    best_key, best_entry = candidates[best]
+                    if scores[best] >= self.similarity_threshold and best_key in self._entries:
+                        self._entries.move_to_end(best_key)
+                        self.similar_hits += 1
+                        return best_entry["sql"], "similar"
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, database: str, fingerprint: str, question: str, sql: str,
+            embedding: List[float] = None):
+        """
+        Store SQL that answered a question successfully.
+
+        Args:
+            database: Identifier of the connected database
+            fingerprint: Schema fingerprint of that database
+            question: Natural language question
+            sql: SQL that executed successfully
+            embedding: Question embedding for the similarity tier (optional)
+        """
+        vector = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector = vector / norm
+
+        key = (fingerprint, self.normalize_question(question))
+
+        with self._lock:
+            self._check_fingerprint(database, fingerprint)
+            self._entries[key] = {
+                "question": question,
+                "sql": sql,
+                "embedding": vector,
+                "literals": self.question_literals(question),
+            }
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, database: str = None):
+        """
+        Drop cached entries.
+
+        Args:
+            database: Only drop entries for this database (None = everything)
+        """
+        with self._lock:
+            if database is None:
+                self._entries.clear()
+                self._fingerprints.clear()
+                return
+
+            fingerprint = self._fingerprints.pop(database, None)
+            if fingerprint is not None:
+                stale = [key for key in self._entries if key[0] == fingerprint]
+                for key in stale:
+                    del self._entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get cache counters and size.
+
+        Returns:
+            Dictionary with hit/miss counts and number of entries
+        """
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0,
+                "entries": len(self._entries),
+            }
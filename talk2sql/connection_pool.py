@@ -0,0 +1,344 @@
+"""
+Read-only SQLite connection pool keyed by database path, and deadline-bounded query execution.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from typing import Any, Dict
+
+import pandas as pd
+
+from talk2sql.exceptions import QueryTimeoutError
+
+# SQLite VM instructions between deadline checks
+PROGRESS_HANDLER_STEPS = 10000
+
+# Rows fetched from the cursor per fetchmany call
+FETCH_SIZE = 1000
+
+
+def _timeout_error(timeout: float, sql: str) -> QueryTimeoutError:
+    """Build the error raised for a query cancelled at its deadline."""
+    return QueryTimeoutError(
+        f"Query timeout: cancelled after exceeding the {timeout:g}s time limit. "
+        f"The query is too slow; rewrite it to do less work (filter early, avoid cross joins "
+        f"and correlated subqueries, aggregate before joining, add a LIMIT).",
+        timeout=timeout,
+        sql=sql
+    )
+
+
+def read_sql_with_deadline(conn: sqlite3.Connection, sql: str, timeout: float = None,
+                           max_rows: int = None, count_budget: float = 2.0) -> pd.DataFrame:
+    """
+    Run a query into a DataFrame, cancelling it if it runs past a deadline.
+
+    The deadline is enforced with a progress handler, which makes SQLite abort
+    the statement from inside its VM loop (the same path as Connection.interrupt).
+
+    With max_rows set, rows are pulled with fetchmany and only the first
+    max_rows are kept, so memory stays bounded however large the result is.
+    Rows past the cap are counted without being kept, for at most count_budget
+    seconds. The outcome is stored in ``df.attrs``:
+    ``total_rows`` (exact count, or a lower bound if counting stopped early),
+    ``row_count_exact`` and ``truncated``.
+
+    Args:
+        conn: SQLite connection
+        sql: SQL query
+        timeout: Seconds the query may run (None or 0 = no limit)
+        max_rows: Maximum rows to return (None or 0 = no limit)
+        count_budget: Seconds to spend counting rows past max_rows (default: 2)
+
+    Returns:
+        Query result
+
+    Raises:
+        QueryTimeoutError: If the query was cancelled at its deadline
+    """
+    if not timeout and not max_rows:
+        return pd.read_sql_query(sql, conn)
+
+    # The handler checks whichever deadline is current; counting uses a shorter one
+    state = {"deadline": time.monotonic() + timeout if timeout else None, "expired": False}
+
+    def check_deadline():
+        if state["deadline"] is not None and time.monotonic() > state["deadline"]:
+            state["expired"] = True
+            return 1
+        return 0
+
+    conn.set_progress_handler(check_deadline, PROGRESS_HANDLER_STEPS)
+    try:
+        if not max_rows:
+            return pd.read_sql_query(sql, conn)
+
+        # Closed before the connection goes back to the pool, however the fetch ends
+        with closing(conn.execute(sql)) as cursor:
+            columns = [column[0] for column in cursor.description] if cursor.description else []
+            rows = []
+            while len(rows) < max_rows:
+                batch = cursor.fetchmany(min(FETCH_SIZE, max_rows - len(rows)))
+                if not batch:
+                    break
+                rows.extend(batch)
+
+            # Count what's left without keeping it
+            total_rows, exact, truncated = len(rows), True, False
+            if len(rows) == max_rows:
+                count_deadline = time.monotonic() + count_budget
+                if state["deadline"] is None or count_deadline < state["deadline"]:
+                    state["deadline"] = count_deadline
+                try:
+                    while True:
+                        batch = cursor.fetchmany(FETCH_SIZE)
+                        if not batch:
+                            break
+                        total_rows += len(batch)
+                        truncated = True
+                        if time.monotonic() > state["deadline"]:
+                            exact = False
+                            break
+                except sqlite3.OperationalError:
+                    if not state["expired"]:
+                        raise
+                    exact, truncated = False, True
+
+        df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        df.attrs.update(total_rows=total_rows, row_count_exact=exact, truncated=truncated)
+        return df
+    except Exception as e:
+        if state["expired"]:
+            raise _timeout_error(timeout, sql) from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+class _DatabasePool:
+    """Idle connections and usage counters for a single database file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.idle = []  # list of (connection, released_at)
+        self.in_use = 0
+
+
+class SQLiteConnectionPool:
+    """
+    Pool of read-only SQLite connections, keyed by database path.
+
+    Connections are opened with a ``mode=ro`` URI and ``PRAGMA query_only`` so
+    generated SQL can never modify the database. Each database keeps at most
+    ``max_connections_per_database`` connections; at most ``max_databases``
+    databases stay open, and the least recently used idle database is closed
+    when a new one is needed. Connections idle for longer than
+    ``health_check_after`` seconds are checked before being handed out.
+    """
+
+    def __init__(self, max_databases: int = 8, max_connections_per_database: int = 4,
+                 idle_timeout: float = 600.0, health_check_after: float = 30.0,
+                 acquire_timeout: float = 30.0):
+        """
+        Initialize the connection pool.
+
+        Args:
+            max_databases: Maximum databases with open connections (default: 8)
+            max_connections_per_database: Maximum connections per database (default: 4)
+            idle_timeout: Seconds after which idle connections are closed (default: 600)
+            health_check_after: Seconds of idleness before a connection is re-checked (default: 30)
+            acquire_timeout: Seconds to wait for a free connection (default: 30)
+        """
+        self.max_databases = max_databases
+        self.max_connections_per_database = max_connections_per_database
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._databases = OrderedDict()  # path -> _DatabasePool, least recently used first
+
+    @staticmethod
+    def _open(path: str) -> sqlite3.Connection:
+        """Open a read-only connection to a database file."""
+        uri = f"file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        """Check that a connection still works."""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @staticmethod
+    def _close(conn: sqlite3.Connection):
+        """Close a connection, ignoring errors."""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _close_idle(self, now: float):
+        """Close connections idle past the timeout and evict databases over the limit (lock held)."""
+        for path in list(self._databases):
+            pool = self._databases[path]
+            keep = []
+            for conn, released_at in pool.idle:
+                if now - released_at > self.idle_timeout:
+                    self._close(conn)
+                else:
+                    keep.append((conn, released_at))
+            pool.idle = keep
+
+        # Close least recently used databases that have nothing checked out
+        for path in list(self._databases):
+            if len(self._databases) <= self.max_databases:
+                break
+            pool = self._databases[path]
+            if pool.in_use == 0:
+                for conn, _ in pool.idle:
+                    self._close(conn)
+                del self._databases[path]
+
+    def acquire(self, path: str) -> sqlite3.Connection:
+        """
+        Check out a connection to a database.
+
+        Args:
+            path: Path to the SQLite database file
+
+        Returns:
+            Read-only connection; give it back with release()
+
+        Raises:
+            TimeoutError: If no connection became free within acquire_timeout
+        """
+        path = os.path.abspath(path)
+        deadline = time.time() + self.acquire_timeout
+
+        with self._available:
+            while True:
+                pool = self._databases.get(path)
+                if pool is None:
+                    pool = _DatabasePool(path)
+                    self._databases[path] = pool
+                self._databases.move_to_end(path)
+
+                # Reuse an idle connection, re-checking it if it has been idle a while
+                while pool.idle:
+                    conn, released_at = pool.idle.pop()
+                    if time.time() - released_at < self.health_check_after or self._is_healthy(conn):
+                        pool.in_use += 1
+                        return conn
+                    self._close(conn)
+
+                if pool.in_use < self.max_connections_per_database:
+                    pool.in_use += 1
+                    break
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError(f"No free connection to {path} within {self.acquire_timeout}s")
+                self._available.wait(remaining)
+
+            self._close_idle(time.time())
+
+        # Open outside the lock; the slot is already reserved
+        try:
+            return self._open(path)
+        except Exception:
+            with self._available:
+                pool.in_use -= 1
+                # Waiters for every database share this condition; wake them all so
+                # the one waiting on this database isn't skipped
+                self._available.notify_all()
+            raise
+
+    def release(self, path: str, conn: sqlite3.Connection):
+        """
+        Return a connection to the pool.
+
+        Args:
+            path: Path the connection was acquired for
+            conn: Connection returned by acquire()
+        """
+        path = os.path.abspath(path)
+
+        with self._available:
+            pool = self._databases.get(path)
+            if pool is None:
+                self._close(conn)
+                return
+
+            pool.in_use -= 1
+            if conn.in_transaction:
+                conn.rollback()
+            pool.idle.append((conn, time.time()))
+            # notify() could wake a waiter for another database that goes straight back to sleep
+            self._available.notify_all()
+
+            if len(self._databases) > self.max_databases:
+                self._close_idle(time.time())
+
+    @contextmanager
+    def connection(self, path: str):
+        """
+        Borrow a connection for the duration of a block.
+
+        Args:
+            path: Path to the SQLite database file
+        """
+        conn = self.acquire(path)
+        try:
+            yield conn
+        finally:
+            self.release(path, conn)
+
+    def close_database(self, path: str):
+        """
+        Close the idle connections of one database (checked-out ones close on release).
+
+        Args:
+            path: Path to the SQLite database file
+        """
+        path = os.path.abspath(path)
+        with self._available:
+            pool = self._databases.pop(path, None)
+            if pool is not None:
+                for conn, _ in pool.idle:
+                    self._close(conn)
+
+    def close_all(self):
+        """Close every idle connection and forget all databases."""
+        with self._available:
+            for pool in self._databases.values():
+                for conn, _ in pool.idle:
+                    self._close(conn)
+            self._databases.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get pool usage per database.
+
+        Returns:
+            Dictionary with open database count and per-database idle/in-use counts
+        """
+        with self._lock:
+            return {
+                "databases": len(self._databases),
+                "connections": {
+                    path: {"idle": len(pool.idle), "in_use": pool.in_use}
+                    for path, pool in self._databases.items()
+                }
+            }
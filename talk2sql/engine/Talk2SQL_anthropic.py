@@ -8,8 +8,11 @@ from qdrant_client.http.models import Distance, VectorParams
 import os
 
 from talk2sql.vector_store.qdrant import QdrantVectorStore
+from talk2sql.session import QuerySession
+from talk2sql.connection_pool import read_sql_with_deadline
 from talk2sql.llm.anthropic import AnthropicLLM
-from talk2sql.llm.azure_openai import AzureOpenAILLM
+from talk2sql.llm.azure_openai import AzureOpenAILLM, create_embedding_cache, embed_texts_batched
+from talk2sql.utils import FallbackEmbedding, fallback_payload
 
 class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
     """
@@ -31,6 +34,7 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
               - azure_endpoint: Azure OpenAI endpoint for embeddings (or use AZURE_ENDPOINT env var)
               - azure_api_version: Azure API version (or use AZURE_API_VERSION env var)
               - azure_embedding_deployment: Embedding model name (default: "text-embedding-ada-002")
+              - embedding_cache / embedding_cache_path: Embedding cache settings (see AzureOpenAILLM)
         """
         config = config or {}
         
@@ -82,6 +86,11 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
             azure_endpoint=self.azure_endpoint,
             api_version=self.azure_api_version
         )
+        
+        # Cache embeddings across requests and restarts
+        self.embedding_cache = create_embedding_cache(config)
+        self.embedding_batch_size = config.get("embedding_batch_size", 256)
+        self.embedding_batch_tokens = config.get("embedding_batch_tokens", 100000)
     
     def connect_to_sqlite(self, db_path: str):
         """
@@ -113,13 +122,21 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
             if self.debug_mode:
                 print(f"Database info: {db_info}")
             
-            # Define the run_sql function to use this connection
+            # Define the run_sql function to use this connection, cancelling runaway queries,
+            # keeping at most max_result_rows rows in memory and reusing cached results
             def run_sql(sql_query):
-                return pd.read_sql_query(sql_query, self.conn)
+                max_rows = self.max_result_rows
+                return self.run_sql_cached(
+                    db_path, sql_query,
+                    lambda: read_sql_with_deadline(self.conn, sql_query, self.query_timeout, max_rows=max_rows),
+                    max_rows=max_rows
+                )
             
             # Set the run_sql function
             self.run_sql = run_sql
             self.run_sql_is_set = True
+            self.database_path = os.path.abspath(db_path)
+            self._database_path_run_sql = run_sql
             
             # Check for tables
             tables_cursor = self.conn.cursor()
@@ -153,21 +170,51 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
         Returns:
             List of floats representing the embedding vector
         """
+        # Check the cache first
+        if self.embedding_cache is not None:
+            cached = self.embedding_cache.get(self.azure_embedding_deployment, text)
+            if cached is not None:
+                return cached
+        
         try:
             # Create an embedding with Azure OpenAI
             response = self.azure_client.embeddings.create(
                 model=self.azure_embedding_deployment,
                 input=text
             )
+            embedding = response.data[0].embedding
+            
+            if self.embedding_cache is not None:
+                self.embedding_cache.put(self.azure_embedding_deployment, text, embedding)
             
             # Return the embedding
-            return response.data[0].embedding
+            return embedding
             
         except Exception as e:
             print(f"Error generating Azure OpenAI embedding: {e}")
             # Fallback to simple embedding
             return self._simple_embedding(text)
     
+    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generate embedding vectors for several texts using batched Azure OpenAI requests.
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            List of embedding vectors in the same order as texts
+        """
+        return embed_texts_batched(
+            self.azure_client,
+            self.azure_embedding_deployment,
+            texts,
+            cache=self.embedding_cache,
+            max_items=self.embedding_batch_size,
+            max_tokens=self.embedding_batch_tokens,
+            fallback=self.generate_embedding
+        )
+    
     def _simple_embedding(self, text: str) -> List[float]:
         """
         Simple fallback embedding function.
@@ -176,7 +223,7 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
             text: Text to embed
             
         Returns:
-            Simple hash-based embedding (not for production use)
+            Simple hash-based embedding (not for production use), marked as a FallbackEmbedding
         """
         import hashlib
         import numpy as np
@@ -188,7 +235,7 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
         
         # Convert hash to list of floats
         np.random.seed(int.from_bytes(hash_bytes[:4], byteorder='little'))
-        return np.random.normal(0, 1, 1536).tolist()
+        return FallbackEmbedding(np.random.normal(0, 1, 1536).tolist())
     
     # Override vector store methods to ensure they work correctly
     def add_question_sql(self, question: str, sql: str) -> str:
@@ -218,10 +265,10 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
                 models.PointStruct(
                     id=point_id,
                     vector=embedding,
-                    payload={
+                    payload=fallback_payload({
                         "question": question,
                         "sql": sql
-                    }
+                    }, embedding)
                 )
             ]
         )
@@ -313,7 +360,9 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
                 "retry_count": retry_count,
             })
     
-    def get_query_history(self, successful_only: bool = False, with_errors_only: bool = False, limit: int = None):
+    def get_query_history(self, successful_only: bool = False, with_errors_only: bool = False, limit: int = None,
+                          columns: List[str] = None, failed_only: bool = False, since=None, until=None,
+                          query_id: str = None):
         """
         Get the query history.
         
@@ -321,6 +370,11 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
             successful_only: Only return successful queries
             with_errors_only: Only return queries that had errors
             limit: Maximum number of queries to return
+            columns: Fields to return (default: all)
+            failed_only: Only return failed queries
+            since: Only return queries at or after this datetime/ISO timestamp
+            until: Only return queries before this datetime/ISO timestamp
+            query_id: Accepted for compatibility; in-memory entries have no id
             
         Returns:
             List of query history entries
@@ -330,12 +384,29 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
         if successful_only:
             result = [q for q in result if q["success"]]
             
+        if failed_only:
+            result = [q for q in result if not q["success"]]
+            
         if with_errors_only:
             result = [q for q in result if q["error_message"] is not None]
             
+        if since is not None:
+            since = since.isoformat() if hasattr(since, "isoformat") else str(since)
+            result = [q for q in result if q["timestamp"] >= since]
+            
+        if until is not None:
+            until = until.isoformat() if hasattr(until, "isoformat") else str(until)
+            result = [q for q in result if q["timestamp"] < until]
+            
+        if query_id is not None:
+            result = [q for q in result if q.get("id") == query_id]
+            
         if limit:
             result = result[-limit:]
             
+        if columns:
+            result = [{key: q[key] for key in columns if key in q} for q in result]
+            
         return result
     
     def analyze_error_patterns(self):
@@ -399,15 +470,11 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
             tables = re.findall(r'FROM\s+([a-zA-Z0-9_]+)|JOIN\s+([a-zA-Z0-9_]+)', sql, re.IGNORECASE)
             tables = [t[0] if t[0] else t[1] for t in tables]
             
-            if tables and self.conn:
-                for table in tables:
-                    try:
-                        # Get schema for this table
-                        schema_df = self.run_sql(f"PRAGMA table_info({table})")
-                        if not schema_df.empty:
-                            schema_info += f"\nTable '{table}' columns: {', '.join(schema_df['name'].tolist())}\n"
-                    except:
-                        pass
+            catalog = self.get_schema_catalog() if tables else None
+            if catalog is not None:
+                schema_info = catalog.describe_tables(tables)
+                if schema_info:
+                    schema_info = "\n" + schema_info
         except:
             pass
 
@@ -448,32 +515,15 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
         # Get database schema info to enhance follow-up relevance
         schema_info = ""
         try:
-            if self.conn:
-                # Get list of all tables
-                tables_df = self.run_sql("""
-                    SELECT name 
-                    FROM sqlite_master 
-                    WHERE type='table' AND name NOT LIKE 'sqlite_%'
-                """)
+            catalog = self.get_schema_catalog()
+            if catalog is not None and catalog.tables:
+                schema_info = f"Available tables: {', '.join(catalog.table_names())}\n\n"
                 
-                if not tables_df.empty:
-                    table_list = tables_df['name'].tolist()
-                    schema_info = f"Available tables: {', '.join(table_list)}\n\n"
-                    
-                    # Also include tables extracted from the current query
-                    import re
-                    current_tables = re.findall(r'FROM\s+([a-zA-Z0-9_]+)|JOIN\s+([a-zA-Z0-9_]+)', sql, re.IGNORECASE)
-                    current_tables = [t[0] if t[0] else t[1] for t in current_tables]
-                    
-                    for table in current_tables:
-                        if table in table_list:
-                            try:
-                                # Get column info for this table
-                                columns_df = self.run_sql(f"PRAGMA table_info({table})")
-                                if not columns_df.empty:
-                                    schema_info += f"Table '{table}' columns: {', '.join(columns_df['name'].tolist())}\n"
-                            except:
-                                pass
+                # Also include tables extracted from the current query
+                import re
+                current_tables = re.findall(r'FROM\s+([a-zA-Z0-9_]+)|JOIN\s+([a-zA-Z0-9_]+)', sql, re.IGNORECASE)
+                current_tables = [t[0] if t[0] else t[1] for t in current_tables]
+                schema_info += catalog.describe_tables(current_tables)
         except:
             pass
             
@@ -506,7 +556,8 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
         # Limit to n questions
         return questions[:n]
     
-    def smart_query(self, question: str, print_results: bool = True, visualize: bool = True):
+    def smart_query(self, question: str, print_results: bool = True, visualize: bool = True,
+                    session: QuerySession = None):
         """
         Execute a query with automatic retry mechanism and detailed reporting.
         
@@ -514,10 +565,17 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
             question: Natural language question
             print_results: Whether to print results
             visualize: Whether to generate visualization
+            session: Request-scoped connection, collections and options (optional)
             
         Returns:
             Dictionary with query results and metadata
         """
+        # Embed the question once and share it with generation and every retry
+        with self.query_session(session), self.retrieval_context(question):
+            return self._smart_query(question, print_results=print_results, visualize=visualize)
+    
+    def _smart_query(self, question: str, print_results: bool = True, visualize: bool = True):
+        """Run the smart_query pipeline inside an active retrieval context."""
         # Track query metadata
         metadata = {
             "question": question,
@@ -527,11 +585,18 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
             "error_message": None,
             "original_sql": None,
             "final_sql": None,
+            "sql_cache": None,
+            "result_cache_hit": False
         }
         
         # Generate initial SQL
         try:
-            sql = self.generate_sql(question)
+            cached = self.get_cached_sql(question)
+            if cached:
+                # Previously successful SQL for this question and schema, skip the LLM
+                sql, metadata["sql_cache"] = cached
+            else:
+                sql = self.generate_sql(question)
             metadata["original_sql"] = sql
         except Exception as e:
             error_message = str(e)
@@ -593,6 +658,7 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
                 metadata["success"] = True
                 metadata["final_sql"] = current_sql
                 metadata["retry_count"] = retry_count
+                metadata["result_cache_hit"] = bool(df is not None and df.attrs.get("result_cache_hit"))
                 
                 self.record_query_attempt(
                     question=question,
@@ -658,6 +724,9 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
             except ImportError:
                 print(df)
         
+        # Remember the working SQL for repeats of this question
+        self.cache_sql(question, metadata["final_sql"])
+        
         # Add to training if successful
         if df is not None and len(df) > 0:
             self.add_question_sql(question, metadata["final_sql"])
@@ -705,6 +774,7 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
             "final_sql": metadata["final_sql"] if metadata["final_sql"] != metadata["original_sql"] else None,
             "retry_count": metadata["retry_count"],
             "data": df,
+            **self.get_result_size(df),
             "visualization": fig,
             "metadata": metadata
         }
@@ -858,17 +928,18 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
                 )
             )
 
-    def get_similar_questions(self, question: str) -> list:
+    def get_similar_questions(self, question: str, embedding: List[float] = None) -> list:
         """
         Get similar questions with their SQL from vector store.
         
         Args:
             question: Natural language question
+            embedding: Precomputed question embedding (optional)
             
         Returns:
             List of question-SQL pairs
         """
-        embedding = self.generate_embedding(question)
+        embedding = self._get_query_embedding(question, embedding)
         
         results = self.qdrant_client.search(
             collection_name=self.questions_collection,
@@ -878,17 +949,18 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
         
         return [point.payload for point in results]
     
-    def get_related_schema(self, question: str) -> list:
+    def get_related_schema(self, question: str, embedding: List[float] = None) -> list:
         """
         Get related schema information from vector store.
         
         Args:
             question: Natural language question
+            embedding: Precomputed question embedding (optional)
             
         Returns:
             List of schema strings
         """
-        embedding = self.generate_embedding(question)
+        embedding = self._get_query_embedding(question, embedding)
         
         results = self.qdrant_client.search(
             collection_name=self.schema_collection,
@@ -896,19 +968,20 @@ class Talk2SQLAnthropic(QdrantVectorStore, AnthropicLLM):
             limit=self.n_results
         )
         
-        return [point.payload["schema"] for point in results]
+        return self._schema_with_neighbors([point.payload for point in results])
     
-    def get_related_documentation(self, question: str) -> list:
+    def get_related_documentation(self, question: str, embedding: List[float] = None) -> list:
         """
         Get related documentation from vector store.
         
         Args:
             question: Natural language question
+            embedding: Precomputed question embedding (optional)
             
         Returns:
             List of documentation strings
         """
-        embedding = self.generate_embedding(question)
+        embedding = self._get_query_embedding(question, embedding)
         
         results = self.qdrant_client.search(
             collection_name=self.docs_collection,
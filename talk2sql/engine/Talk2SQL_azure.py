@@ -6,10 +6,20 @@ import sqlite3
 from qdrant_client import models
 from qdrant_client.http.models import Distance, VectorParams
 import os
+import atexit
 import base64
 
 from talk2sql.vector_store.qdrant import QdrantVectorStore
+from talk2sql.session import QuerySession
+from talk2sql.connection_pool import read_sql_with_deadline
+from talk2sql.json_encoding import dumps_str, records_json
+from talk2sql.history import HISTORY_COLUMNS, HistoryWriter
+from talk2sql.blob_store import BlobStore
+from talk2sql.metrics import MetricsRollup
+from talk2sql.sketch import LatencySketches
+from talk2sql.stages import StageScheduler
 from talk2sql.llm.azure_openai import AzureOpenAILLM
+from talk2sql.utils import fallback_payload
 
 class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
     """
@@ -31,6 +41,19 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
               - azure_deployment: GPT deployment name (or use AZURE_DEPLOYMENT env var)
               - azure_embedding_deployment: Embedding model name (default: "text-embedding-ada-002")
               - history_db_path: Path to SQLite database for storing query history (default: "query_history.db")
+              - history_queue_size: History writes that may wait for the background writer (default: 1000)
+              - history_batch_size: History writes committed per transaction (default: 100)
+              - history_flush_interval: Seconds the writer gathers writes before committing (default: 0.2)
+              - history_blob_codec: Compression of stored results and figures: "zlib", "zstd" or "none" (default: "zlib")
+              - embedding_cache_path: SQLite file for the persistent embedding cache (default: memory only)
+              - query_timeout: Seconds a SQL query may run before it is cancelled (default: 30, 0 = no limit)
+              - max_result_rows: Rows kept from each query result; the full count is still reported (default: 10000, 0 = no limit)
+              - result_cache: Reuse results of identical SQL until the database changes (default: True)
+              - result_cache_max_bytes: Memory budget of the result cache (default: 64 MB)
+              - stage_workers: Threads for concurrent visualization/summary/training stages (default: 3)
+              - latency_sketch_accuracy: Relative error of latency quantiles (default: 0.01)
+              - latency_sketch_bucket_seconds: Time bucket of latency sketches (default: 3600)
+              - latency_sketch_checkpoint_interval: Seconds between sketch checkpoints (default: 60)
         """
         config = config or {}
         
@@ -53,8 +76,31 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
         self.save_query_history = config.get("save_query_history", True)
         self.history_db_path = config.get("history_db_path", "query_history.db")
         
-        # Initialize query history DB
+        # Runs visualization, summary and training concurrently after execution
+        self.stage_scheduler = StageScheduler(config.get("stage_workers", 3))
+        
+        # Initialize query history DB, its metrics rollups and its background writer
+        self.history_writer = None
+        self.metrics_rollup = MetricsRollup(self.history_db_path)
+        self.blob_store = BlobStore(codec=config.get("history_blob_codec", "zlib"))
+        self.latency_sketches = LatencySketches(
+            db_path=self.history_db_path if self.save_query_history else None,
+            relative_accuracy=config.get("latency_sketch_accuracy", 0.01),
+            bucket_seconds=config.get("latency_sketch_bucket_seconds", 3600),
+            checkpoint_interval=config.get("latency_sketch_checkpoint_interval", 60)
+        )
         self._init_history_db()
+        if self.save_query_history:
+            self.history_writer = HistoryWriter(
+                self.history_db_path,
+                max_queue=config.get("history_queue_size", 1000),
+                batch_size=config.get("history_batch_size", 100),
+                flush_interval=config.get("history_flush_interval", 0.2)
+            )
+            # Commit queued history before the interpreter exits (atexit runs in reverse
+            # order, so the last sketch checkpoint is queued before the writer closes)
+            atexit.register(self.history_writer.close)
+            atexit.register(self.checkpoint_latency_sketches)
         
         # SQLite connection for querying databases
         self.conn = None
@@ -89,13 +135,21 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             if self.debug_mode:
                 print(f"Database info: {db_info}")
             
-            # Define the run_sql function to use this connection
+            # Define the run_sql function to use this connection, cancelling runaway queries,
+            # keeping at most max_result_rows rows in memory and reusing cached results
             def run_sql(sql_query):
-                return pd.read_sql_query(sql_query, self.conn)
+                max_rows = self.max_result_rows
+                return self.run_sql_cached(
+                    db_path, sql_query,
+                    lambda: read_sql_with_deadline(self.conn, sql_query, self.query_timeout, max_rows=max_rows),
+                    max_rows=max_rows
+                )
             
             # Set the run_sql function
             self.run_sql = run_sql
             self.run_sql_is_set = True
+            self.database_path = os.path.abspath(db_path)
+            self._database_path_run_sql = run_sql
             
             # Check for tables
             tables_cursor = self.conn.cursor()
@@ -146,10 +200,10 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
                 models.PointStruct(
                     id=point_id,
                     vector=embedding,
-                    payload={
+                    payload=fallback_payload({
                         "question": question,
                         "sql": sql
-                    }
+                    }, embedding)
                 )
             ]
         )
@@ -230,8 +284,9 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
         try:
             import sqlite3
             
-            # Connect to the history database
+            # Connect to the history database; WAL lets readers run while the writer commits
             history_conn = sqlite3.connect(self.history_db_path)
+            history_conn.execute("PRAGMA journal_mode=WAL")
             cursor = history_conn.cursor()
             
             # Create table if it doesn't exist
@@ -267,6 +322,23 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
                 if self.debug_mode:
                     print("Added used_memory column to query_history table")
             
+            # Results and figures live in the blob table; rows reference them by hash
+            existing_columns = {row[1] for row in cursor.execute("PRAGMA table_info(query_history)")}
+            for column in ("data_hash", "visualization_hash"):
+                if column not in existing_columns:
+                    cursor.execute(f"ALTER TABLE query_history ADD COLUMN {column} TEXT")
+            BlobStore.create_tables(history_conn)
+            self._move_history_blobs(history_conn)
+            
+            # Time-range and status filters, and newest-first ordering, use these
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_query_history_timestamp ON query_history(timestamp)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_query_history_success ON query_history(success, timestamp)")
+            
+            # Rollups are maintained as queries are recorded; backfill them for existing history
+            if self.metrics_rollup.create_tables(history_conn):
+                self.metrics_rollup.rebuild(history_conn)
+            LatencySketches.create_tables(history_conn)
+            
             history_conn.commit()
             history_conn.close()
             
@@ -281,6 +353,43 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             self.query_history = []
             self.save_query_history = False
     
+    def _move_history_blobs(self, conn: sqlite3.Connection, chunk_size: int = 500):
+        """
+        Move results and figures stored inline in older history rows into the blob table.
+        
+        Runs once per database; afterwards the file is vacuumed so the space
+        the inline copies took is returned to the filesystem.
+        """
+        moved = 0
+        while True:
+            rows = conn.execute(
+                "SELECT id, data, visualization FROM query_history "
+                "WHERE data IS NOT NULL OR visualization IS NOT NULL LIMIT ?",
+                (chunk_size,)
+            ).fetchall()
+            if not rows:
+                break
+            for entry_id, data, visualization in rows:
+                if isinstance(data, str):
+                    data = data.encode("utf-8")
+                conn.execute(
+                    "UPDATE query_history SET data = NULL, visualization = NULL, "
+                    "data_hash = COALESCE(?, data_hash), visualization_hash = COALESCE(?, visualization_hash) "
+                    "WHERE id = ?",
+                    (self.blob_store.put(conn, data), self.blob_store.put(conn, visualization), entry_id)
+                )
+            conn.commit()
+            moved += len(rows)
+        
+        if not moved:
+            return
+        
+        # Rebuild the file without the freed pages (the WAL must be checkpointed to shrink it)
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if self.debug_mode:
+            print(f"Moved results and figures of {moved} history entries into the blob store")
+    
     def record_query_attempt(self, question: str, sql: str, success: bool, error_message: str = None, 
                            retry_count: int = 0, data: pd.DataFrame = None, columns: List[str] = None,
                            visualization = None, summary: str = None, total_time_ms: float = None,
@@ -308,107 +417,318 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             timing_details: Detailed timing information as a dictionary
             used_memory: Whether memory/context was used in generating the SQL
         """
-        if not self.save_query_history:
+        self.record_latencies({
+            "total": total_time_ms,
+            "generation": sql_generation_time_ms,
+            "execution": sql_execution_time_ms,
+            "visualization": visualization_time_ms,
+            "explanation": explanation_time_ms
+        })
+        
+        if not self.save_query_history or self.history_writer is None:
             return
-            
-        try:
-            import sqlite3
+        
+        # Generate a unique ID
+        entry_id = str(hash(f"{question}_{datetime.datetime.now().isoformat()}"))
+        timestamp = datetime.datetime.now().isoformat()
+        
+        # Use the class attribute if used_memory parameter is not provided
+        if used_memory is None:
+            used_memory = getattr(self, 'last_query_used_memory', False)
+        
+        def prepare():
+            """Serialize the record; runs on the history writer thread."""
             import pickle
             import json
             
-            # Generate a unique ID
-            entry_id = str(hash(f"{question}_{datetime.datetime.now().isoformat()}"))
-            timestamp = datetime.datetime.now().isoformat()
-            
-            # Use the class attribute if used_memory parameter is not provided
-            if used_memory is None:
-                used_memory = getattr(self, 'last_query_used_memory', False)
-                
-            # Connect to the history database
-            history_conn = sqlite3.connect(self.history_db_path)
-            cursor = history_conn.cursor()
-            
-            # Convert DataFrame to JSON string if it exists (instead of pickle)
+            # Convert DataFrame to JSON if it exists (instead of pickle)
             data_json = None
             if success and data is not None:
                 try:
-                    if hasattr(data, 'to_json'):
-                        # Convert DataFrame to JSON string
-                        data_json = data.to_json(orient='records')
+                    if isinstance(data, pd.DataFrame):
+                        # Shared with the HTTP response, so the result is only encoded once
+                        data_json = records_json(data)
                     else:
                         # If not a DataFrame, try basic JSON serialization
-                        data_json = json.dumps(str(data))
+                        data_json = json.dumps(str(data)).encode("utf-8")
                 except Exception as e:
                     if self.debug_mode:
                         print(f"Error converting DataFrame to JSON: {e}")
                     # Fallback to string representation
-                    data_json = json.dumps(str(data))
-                
+                    data_json = json.dumps(str(data)).encode("utf-8")
+            
             # Store columns as JSON
-            columns_json = None
-            if columns:
-                columns_json = json.dumps(columns)
-                
+            columns_json = dumps_str(columns) if columns else None
+            
             # Continue using pickle for visualization (it's complex to convert)
             vis_blob = None
             if success and visualization is not None:
                 vis_blob = pickle.dumps(visualization)
-                
+            
             # Convert timing details to JSON if it exists
-            timing_details_json = None
-            if timing_details:
-                timing_details_json = json.dumps(timing_details)
+            timing_details_json = dumps_str(timing_details) if timing_details else None
+            
+            return data_json, columns_json, vis_blob, timing_details_json
+        
+        def write(conn):
+            """Insert the row and update the blob store and metrics rollups in the same transaction."""
+            data_json, columns_json, vis_blob, timing_details_json = prepare()
+            conn.execute(
+                '''
+                INSERT INTO query_history 
+                (id, timestamp, question, sql, success, error_message, retry_count, data_hash, columns, 
+                visualization_hash, summary, total_time_ms, sql_generation_time_ms, sql_execution_time_ms,
+                visualization_time_ms, explanation_time_ms, timing_details, used_memory) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                (entry_id, timestamp, question, sql, 1 if success else 0, error_message, retry_count,
+                 self.blob_store.put(conn, data_json), columns_json, self.blob_store.put(conn, vis_blob),
+                 summary, total_time_ms, sql_generation_time_ms, sql_execution_time_ms,
+                 visualization_time_ms, explanation_time_ms, timing_details_json, 1 if used_memory else 0)
+            )
+            self.metrics_rollup.record(
+                conn, timestamp, success=success, retry_count=retry_count, used_memory=used_memory,
+                error_message=error_message,
+                latencies={
+                    "total": total_time_ms,
+                    "generation": sql_generation_time_ms,
+                    "execution": sql_execution_time_ms,
+                    "visualization": visualization_time_ms,
+                    "explanation": explanation_time_ms
+                }
+            )
+        
+        # Queue the write; the writer commits it in the background
+        self.history_writer.submit_write(write)
+    
+    def update_query_summary(self, question: str, summary: str, explanation_time_ms: float = None):
+        """
+        Attach a summary to the latest successful history entry for a question.
+        
+        Args:
+            question: The natural language question
+            summary: Natural language summary of the results
+            explanation_time_ms: Time to generate the summary in milliseconds
+        """
+        if not self.save_query_history or self.history_writer is None:
+            # No history row to attach to; the latency only goes to the sketches
+            if explanation_time_ms is not None:
+                self.record_latencies({"explanation": explanation_time_ms})
+            return
+        
+        # Resolved here: the write runs on the writer thread, which can't use self.conn
+        try:
+            database = self.get_database_path()
+        except Exception:
+            database = None
+        
+        def write(conn):
+            """Set the summary and move the row's explanation latency in the rollups and sketches."""
+            row = conn.execute(
+                '''
+                SELECT id, timestamp, explanation_time_ms FROM query_history
+                WHERE question = ? AND success = 1 AND summary IS NULL
+                ORDER BY timestamp DESC LIMIT 1
+                ''',
+                (question,)
+            ).fetchone()
+            if row is None:
+                return
+            
+            entry_id, timestamp, previous_ms = row
+            conn.execute(
+                "UPDATE query_history SET summary = ?, explanation_time_ms = COALESCE(?, explanation_time_ms) WHERE id = ?",
+                (summary, explanation_time_ms, entry_id)
+            )
+            if explanation_time_ms is not None:
+                day = timestamp[:10]
+                self.metrics_rollup.record_stage(conn, day, "explanation", previous_ms, count=-1)
+                self.metrics_rollup.record_stage(conn, day, "explanation", explanation_time_ms)
                 
-            # Insert the record
+                # Same move in the sketches, in the bucket of the query itself
+                try:
+                    recorded_at = datetime.datetime.fromisoformat(timestamp).timestamp()
+                except (TypeError, ValueError):
+                    recorded_at = None
+                self.latency_sketches.record(database, {"explanation": previous_ms}, recorded_at, count=-1)
+                self.latency_sketches.record(database, {"explanation": explanation_time_ms}, recorded_at)
+        
+        self.history_writer.submit_write(write)
+    
+    def record_latencies(self, latencies: Dict[str, Optional[float]]):
+        """
+        Add stage latencies to the latency sketches of the current database.
+        
+        Args:
+            latencies: Stage (total, generation, execution, visualization,
+                explanation) -> latency in milliseconds
+        """
+        try:
+            database = self.get_database_path()
+        except Exception:
+            database = None
+        self.latency_sketches.record(database, latencies)
+        
+        if self.latency_sketches.checkpoint_due():
+            self.checkpoint_latency_sketches()
+    
+    def checkpoint_latency_sketches(self):
+        """Queue the latencies recorded since the last checkpoint for merging into the history database."""
+        # Without a history database this only compacts the in-memory sketches
+        write = self.latency_sketches.take_checkpoint()
+        if write is not None and self.history_writer is not None:
+            self.history_writer.submit_write(write)
+    
+    def get_latency_quantiles(self, since=None, until=None, database: str = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Get latency quantiles per stage, merged across worker processes.
+        
+        Args:
+            since: Window start as a datetime or Unix time (None = unbounded)
+            until: Window end as a datetime or Unix time (None = unbounded)
+            database: Only queries against this database file (None = all)
+            
+        Returns:
+            Stage -> {"count", "mean_ms", "p50_ms", "p95_ms", "p99_ms"}
+        """
+        def unix_time(value):
+            return value.timestamp() if hasattr(value, "timestamp") else value
+        
+        return self.latency_sketches.quantiles(unix_time(since), unix_time(until), database)
+    
+    def _history_conditions(self, successful_only: bool = False, failed_only: bool = False,
+                            with_errors_only: bool = False, since=None, until=None,
+                            query_id: str = None) -> Tuple[str, list]:
+        """
+        Build the WHERE clause shared by history reads and counts.
+        
+        Returns:
+            (clause, parameters); the clause is empty when nothing is filtered
+        """
+        conditions = []
+        params = []
+        
+        if successful_only:
+            conditions.append("success = 1")
+        if failed_only:
+            conditions.append("success = 0")
+        if with_errors_only:
+            conditions.append("error_message IS NOT NULL")
+        
+        # Timestamps are stored as ISO strings, so they compare correctly as text
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(since.isoformat() if hasattr(since, "isoformat") else str(since))
+        if until is not None:
+            conditions.append("timestamp < ?")
+            params.append(until.isoformat() if hasattr(until, "isoformat") else str(until))
+        if query_id is not None:
+            conditions.append("id = ?")
+            params.append(query_id)
+        
+        clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return clause, params
+    
+    def _deserialize_history_entry(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Decode the serialized columns present in a history row, in place."""
+        import pickle
+        import json
+        
+        # Convert success to boolean
+        if "success" in entry:
+            entry["success"] = bool(entry.get("success", 0))
+        
+        # Convert used_memory to boolean (older entries have none)
+        if "used_memory" in entry:
+            entry["used_memory"] = bool(entry.get("used_memory") or 0)
+        
+        # Deserialize data if it exists - now expects JSON string
+        if entry.get("data"):
             try:
-                cursor.execute(
-                    '''
-                    INSERT INTO query_history 
-                    (id, timestamp, question, sql, success, error_message, retry_count, data, columns, 
-                    visualization, summary, total_time_ms, sql_generation_time_ms, sql_execution_time_ms,
-                    visualization_time_ms, explanation_time_ms, timing_details, used_memory) 
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''',
-                    (entry_id, timestamp, question, sql, 1 if success else 0, error_message, retry_count,
-                     data_json, columns_json, vis_blob, summary, total_time_ms, sql_generation_time_ms,
-                     sql_execution_time_ms, visualization_time_ms, explanation_time_ms, timing_details_json,
-                     1 if used_memory else 0)
-                )
-            except sqlite3.OperationalError as e:
-                # If the column doesn't exist yet (older DB), try without used_memory
-                if "used_memory" in str(e):
-                    cursor.execute(
-                        '''
-                        INSERT INTO query_history 
-                        (id, timestamp, question, sql, success, error_message, retry_count, data, columns, 
-                        visualization, summary, total_time_ms, sql_generation_time_ms, sql_execution_time_ms,
-                        visualization_time_ms, explanation_time_ms, timing_details) 
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''',
-                        (entry_id, timestamp, question, sql, 1 if success else 0, error_message, retry_count,
-                         data_json, columns_json, vis_blob, summary, total_time_ms, sql_generation_time_ms,
-                         sql_execution_time_ms, visualization_time_ms, explanation_time_ms, timing_details_json)
-                    )
+                # First try to parse as JSON (for newer entries)
+                if isinstance(entry["data"], str):
+                    try:
+                        # Try to parse as JSON array of records
+                        data_list = json.loads(entry["data"])
+                        # Convert back to DataFrame if it's a list of records
+                        if isinstance(data_list, list):
+                            entry["data"] = pd.DataFrame(data_list)
+                        else:
+                            entry["data"] = data_list
+                    except json.JSONDecodeError:
+                        # If not valid JSON, keep as string
+                        entry["data"] = entry["data"]
+                # For backward compatibility - try pickle for older entries
+                elif isinstance(entry["data"], bytes):
+                    try:
+                        entry["data"] = pickle.loads(entry["data"])
+                    except Exception as e:
+                        # If pickle fails, convert bytes to base64 string
+                        try:
+                            entry["data"] = base64.b64encode(entry["data"]).decode('utf-8')
+                        except:
+                            entry["data"] = str(entry["data"])
+            except Exception as e:
+                if self.debug_mode:
+                    print(f"Error deserializing data: {e}")
+                entry["data"] = str(entry["data"])
+        
+        # Deserialize columns if they exist
+        if entry.get("columns"):
+            try:
+                if isinstance(entry["columns"], bytes):
+                    entry["columns"] = json.loads(entry["columns"].decode('utf-8'))
                 else:
-                    raise e
-            
-            history_conn.commit()
-            history_conn.close()
-            
-        except Exception as e:
-            if self.debug_mode:
-                print(f"Error recording query history to database: {e}")
-                import traceback
-                traceback.print_exc()
+                    entry["columns"] = json.loads(entry["columns"])
+            except:
+                entry["columns"] = None
+        
+        # Deserialize visualization if it exists
+        if entry.get("visualization"):
+            try:
+                entry["visualization"] = pickle.loads(entry["visualization"])
+            except Exception as e:
+                # If pickle fails, handle bytes by converting to base64 string
+                if isinstance(entry["visualization"], bytes):
+                    try:
+                        entry["visualization"] = base64.b64encode(entry["visualization"]).decode('utf-8')
+                    except:
+                        entry["visualization"] = None
+                else:
+                    entry["visualization"] = None
+        
+        # Deserialize timing details if they exist
+        if entry.get("timing_details"):
+            try:
+                if isinstance(entry["timing_details"], bytes):
+                    entry["timing_details"] = json.loads(entry["timing_details"].decode('utf-8'))
+                else:
+                    entry["timing_details"] = json.loads(entry["timing_details"])
+            except:
+                entry["timing_details"] = None
+        
+        return entry
     
-    def get_query_history(self, successful_only: bool = False, with_errors_only: bool = False, limit: int = None):
+    def get_query_history(self, successful_only: bool = False, with_errors_only: bool = False, limit: int = None,
+                          columns: List[str] = None, failed_only: bool = False, since=None, until=None,
+                          query_id: str = None):
         """
-        Get the query history.
+        Get the query history, newest first.
+        
+        Filtering, ordering and the limit run in SQL (on the timestamp and
+        success indexes). Only the requested columns are read, so callers that
+        leave out the heavy ones (data, columns, visualization) never load or
+        decode stored results and figures.
         
         Args:
             successful_only: Only return successful queries
             with_errors_only: Only return queries that had errors
             limit: Maximum number of queries to return
+            columns: Columns to return (default: all; see history.HISTORY_COLUMNS)
+            failed_only: Only return failed queries
+            since: Only return queries at or after this datetime/ISO timestamp
+            until: Only return queries before this datetime/ISO timestamp
+            query_id: Only return the query with this id
             
         Returns:
             List of query history entries
@@ -417,125 +737,54 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             return []
             
         try:
-            import sqlite3
-            import pickle
-            import json
+            # Let queued writes land so recent queries show up
+            if self.history_writer is not None:
+                self.history_writer.flush(timeout=1.0)
             
-            # Connect to the history database
-            history_conn = sqlite3.connect(self.history_db_path)
-            cursor = history_conn.cursor()
-            
-            # Build the query
-            query = "SELECT * FROM query_history"
-            conditions = []
+            # Only known column names reach the SQL text
+            if columns:
+                selected = [column for column in HISTORY_COLUMNS if column in set(columns)]
+            else:
+                selected = list(HISTORY_COLUMNS)
+            if not selected:
+                return []
             
-            if successful_only:
-                conditions.append("success = 1")
-                
-            if with_errors_only:
-                conditions.append("error_message IS NOT NULL")
-                
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
-                
-            query += " ORDER BY timestamp DESC"
+            where, params = self._history_conditions(
+                successful_only=successful_only, failed_only=failed_only,
+                with_errors_only=with_errors_only, since=since, until=until, query_id=query_id
+            )
+            # Results and figures are read from the blob store by hash
+            blob_columns = [column for column in ("data", "visualization") if column in selected]
+            sql_columns = selected + [f"{column}_hash" for column in blob_columns]
             
+            query = f"SELECT {', '.join(sql_columns)} FROM query_history{where} ORDER BY timestamp DESC"
             if limit:
-                query += f" LIMIT {limit}"
-                
-            # Execute the query
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            
-            # Get column names
-            column_names = [description[0] for description in cursor.description]
-            
-            # Convert rows to dictionaries
-            result = []
-            for row in rows:
-                # Create a dict with all columns
-                entry = dict(zip(column_names, row))
-                
-                # Convert success to boolean
-                entry["success"] = bool(entry.get("success", 0))
-                
-                # Convert used_memory to boolean if it exists
-                if "used_memory" in entry:
-                    entry["used_memory"] = bool(entry.get("used_memory", 0))
-                else:
-                    entry["used_memory"] = False  # Default for older entries
-                
-                # Deserialize data if it exists - now expects JSON string
-                if entry.get("data"):
-                    try:
-                        # First try to parse as JSON (for newer entries)
-                        if isinstance(entry["data"], str):
-                            try:
-                                # Try to parse as JSON array of records
-                                data_list = json.loads(entry["data"])
-                                # Convert back to DataFrame if it's a list of records
-                                if isinstance(data_list, list):
-                                    entry["data"] = pd.DataFrame(data_list)
-                                else:
-                                    entry["data"] = data_list
-                            except json.JSONDecodeError:
-                                # If not valid JSON, keep as string
-                                entry["data"] = entry["data"]
-                        # For backward compatibility - try pickle for older entries
-                        elif isinstance(entry["data"], bytes):
-                            try:
-                                entry["data"] = pickle.loads(entry["data"])
-                            except Exception as e:
-                                # If pickle fails, convert bytes to base64 string
-                                try:
-                                    import base64
-                                    entry["data"] = base64.b64encode(entry["data"]).decode('utf-8')
-                                except:
-                                    entry["data"] = str(entry["data"])
-                    except Exception as e:
-                        if self.debug_mode:
-                            print(f"Error deserializing data: {e}")
-                        entry["data"] = str(entry["data"])
-                
-                # Deserialize columns if they exist
-                if entry.get("columns"):
-                    try:
-                        if isinstance(entry["columns"], bytes):
-                            entry["columns"] = json.loads(entry["columns"].decode('utf-8'))
-                        else:
-                            entry["columns"] = json.loads(entry["columns"])
-                    except:
-                        entry["columns"] = None
-                
-                # Deserialize visualization if it exists
-                if entry.get("visualization"):
-                    try:
-                        entry["visualization"] = pickle.loads(entry["visualization"])
-                    except Exception as e:
-                        # If pickle fails, handle bytes by converting to base64 string
-                        if isinstance(entry["visualization"], bytes):
+                query += " LIMIT ?"
+                params.append(int(limit))
+            
+            history_conn = sqlite3.connect(self.history_db_path)
+            try:
+                entries = [dict(zip(sql_columns, row)) for row in history_conn.execute(query, params).fetchall()]
+                blobs = self.blob_store.get_many(
+                    history_conn, (entry[f"{column}_hash"] for entry in entries for column in blob_columns)
+                )
+            finally:
+                history_conn.close()
+            
+            for entry in entries:
+                for column in blob_columns:
+                    blob = blobs.get(entry.pop(f"{column}_hash"))
+                    if entry[column] is None and blob is not None:
+                        entry[column] = blob
+                        if column == "data":
+                            # Results are stored as JSON text; results moved from older rows
+                            # may be pickles, left as bytes for _deserialize_history_entry
                             try:
-                                import base64
-                                entry["visualization"] = base64.b64encode(entry["visualization"]).decode('utf-8')
-                            except:
-                                entry["visualization"] = None
-                        else:
-                            entry["visualization"] = None
-                
-                # Deserialize timing details if they exist
-                if entry.get("timing_details"):
-                    try:
-                        if isinstance(entry["timing_details"], bytes):
-                            entry["timing_details"] = json.loads(entry["timing_details"].decode('utf-8'))
-                        else:
-                            entry["timing_details"] = json.loads(entry["timing_details"])
-                    except:
-                        entry["timing_details"] = None
-                
-                result.append(entry)
+                                entry[column] = blob.decode("utf-8")
+                            except UnicodeDecodeError:
+                                pass
             
-            history_conn.close()
-            return result
+            return [self._deserialize_history_entry(entry) for entry in entries]
             
         except Exception as e:
             if self.debug_mode:
@@ -544,6 +793,75 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
                 traceback.print_exc()
             return []
     
+    def get_history_storage_stats(self) -> Dict[str, int]:
+        """
+        Get the size of the history blob store.
+        
+        Returns:
+            Dictionary with blobs, bytes (uncompressed) and stored_bytes
+        """
+        if not self.save_query_history:
+            return {"blobs": 0, "bytes": 0, "stored_bytes": 0}
+        
+        if self.history_writer is not None:
+            self.history_writer.flush(timeout=1.0)
+        
+        history_conn = sqlite3.connect(self.history_db_path)
+        try:
+            return self.blob_store.stats(history_conn)
+        finally:
+            history_conn.close()
+    
+    def count_query_history(self, successful_only: bool = False, failed_only: bool = False,
+                            since=None, until=None) -> int:
+        """
+        Count history entries without reading them.
+        
+        Args:
+            successful_only: Only count successful queries
+            failed_only: Only count failed queries
+            since: Only count queries at or after this datetime/ISO timestamp
+            until: Only count queries before this datetime/ISO timestamp
+            
+        Returns:
+            Number of matching entries
+        """
+        if not self.save_query_history:
+            return 0
+        
+        if self.history_writer is not None:
+            self.history_writer.flush(timeout=1.0)
+        
+        where, params = self._history_conditions(
+            successful_only=successful_only, failed_only=failed_only, since=since, until=until
+        )
+        history_conn = sqlite3.connect(self.history_db_path)
+        try:
+            return history_conn.execute(f"SELECT COUNT(*) FROM query_history{where}", params).fetchone()[0]
+        finally:
+            history_conn.close()
+    
+    def get_query_metrics(self, since=None) -> Dict[str, Any]:
+        """
+        Get aggregated query metrics from the rollup tables.
+        
+        Args:
+            since: Only include queries from this datetime, date or ISO string on (None = all history)
+            
+        Returns:
+            Dictionary with days, totals, errors and stages (see MetricsRollup.summary)
+        """
+        if not self.save_query_history:
+            return {"days": [], "totals": {}, "errors": {"class": {}, "type": {}}, "stages": {}}
+        
+        # Let queued writes land so recent queries are counted
+        if self.history_writer is not None:
+            self.history_writer.flush(timeout=1.0)
+        
+        if since is not None:
+            since = since.isoformat() if hasattr(since, "isoformat") else str(since)
+        return self.metrics_rollup.summary(since)
+    
     def analyze_error_patterns(self):
         """
         Analyze error patterns in query history.
@@ -551,30 +869,21 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
         Returns:
             Dictionary with error analysis
         """
-        history = self.get_query_history()
+        try:
+            metrics = self.get_query_metrics()
+        except Exception as e:
+            print(f"Error reading query metrics: {e}")
+            return {"message": "No query history available for analysis"}
         
-        if not history:
+        totals = metrics["totals"]
+        total_queries = totals.get("total", 0)
+        if not total_queries:
             return {"message": "No query history available for analysis"}
         
         # Count total queries and errors
-        total_queries = len(history)
-        error_queries = len([q for q in history if not q["success"]])
-        retried_queries = len([q for q in history if q["retry_count"] > 0])
-        successful_retries = len([q for q in history if q["retry_count"] > 0 and q["success"]])
-        
-        # Group errors by type
-        error_types = {}
-        for query in history:
-            if query["error_message"]:
-                # Extract error type (first line or up to first colon)
-                error_type = query["error_message"].split('\n')[0]
-                if ':' in error_type:
-                    error_type = error_type.split(':', 1)[0]
-                
-                if error_type in error_types:
-                    error_types[error_type] += 1
-                else:
-                    error_types[error_type] = 1
+        error_queries = total_queries - totals["success"]
+        retried_queries = totals["retried"]
+        successful_retries = totals["retry_success"]
         
         # Calculate retry effectiveness
         retry_success_rate = (successful_retries / retried_queries) if retried_queries > 0 else 0
@@ -586,10 +895,11 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             "retried_queries": retried_queries,
             "successful_retries": successful_retries,
             "retry_success_rate": retry_success_rate,
-            "common_error_types": sorted(error_types.items(), key=lambda x: x[1], reverse=True)
+            "common_error_types": sorted(metrics["errors"]["type"].items(), key=lambda x: x[1], reverse=True)
         }
     
-    def smart_query(self, question: str, print_results: bool = True, visualize: bool = True):
+    def smart_query(self, question: str, print_results: bool = True, visualize: bool = True,
+                    session: QuerySession = None):
         """
         Execute a query with automatic retry mechanism and detailed reporting.
         
@@ -597,10 +907,17 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             question: Natural language question
             print_results: Whether to print results
             visualize: Whether to generate visualization
+            session: Request-scoped connection, collections and options (optional)
             
         Returns:
             Dictionary with query results and metadata
         """
+        # Embed the question once and share it with generation and every retry
+        with self.query_session(session), self.retrieval_context(question):
+            return self._smart_query(question, print_results=print_results, visualize=visualize)
+    
+    def _smart_query(self, question: str, print_results: bool = True, visualize: bool = True):
+        """Run the smart_query pipeline inside an active retrieval context."""
         # Track query metadata and timing
         metadata = {
             "question": question,
@@ -610,7 +927,8 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             "error_message": None,
             "original_sql": None,
             "final_sql": None,
-            "used_memory": False
+            "used_memory": False,
+            "sql_cache": None
         }
         
         timing = {
@@ -623,6 +941,10 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             "visualization_end": None,
             "explanation_start": None,
             "explanation_end": None,
+            "training_start": None,
+            "training_end": None,
+            "post_processing_start": None,
+            "post_processing_end": None,
             "end_time": None
         }
         
@@ -638,8 +960,14 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
         # Generate initial SQL
         try:
             timing["sql_generation_start"] = datetime.datetime.now()
-            sql_response = self.generate_sql(question)
-            sql = self.extract_sql(sql_response)
+            cached = self.get_cached_sql(question)
+            if cached:
+                # Previously successful SQL for this question and schema, skip the LLM;
+                # no vector-store retrieval runs, so used_memory stays False
+                sql, metadata["sql_cache"] = cached
+            else:
+                sql_response = self.generate_sql(question)
+                sql = self.extract_sql(sql_response)
             timing["sql_generation_end"] = datetime.datetime.now()
             metadata["original_sql"] = sql
             metadata["used_memory"] = getattr(self, 'last_query_used_memory', False)
@@ -756,62 +1084,74 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
                 metadata["final_sql"] = current_sql
                 metadata["retry_count"] = retry_count
                 
-                # Generate visualization if requested
+                # Visualization, summary and training are independent, so run them concurrently
+                def visualization_stage():
+                    print(f"Attempting to generate visualization for query: '{question}'")
+                    print(f"DataFrame shape: {df.shape}")
+                    print(f"DataFrame columns: {df.columns.tolist()}")
+                    
+                    plotly_code = self.generate_plotly_code(
+                        question=question,
+                        sql=current_sql,
+                        df_metadata=f"DataFrame info: {df.dtypes}"
+                    )
+                    print(f"Generated Plotly code:\n{plotly_code}")
+                    return self.get_plotly_figure(plotly_code, df)
+                
+                def summary_stage():
+                    return self.generate_data_summary(question, {"sql": current_sql, "data": df})
+                
+                def training_stage():
+                    return self.add_question_sql(question, current_sql)
+                
+                stages = {}
                 if visualize and df is not None and self.should_generate_visualization(df):
-                    try:
-                        print(f"Attempting to generate visualization for query: '{question}'")
-                        print(f"DataFrame shape: {df.shape}")
-                        print(f"DataFrame columns: {df.columns.tolist()}")
-                        print(f"DataFrame sample:\n{df.head(3)}")
-                        
-                        print("Generating Plotly code...")
-                        timing["visualization_start"] = datetime.datetime.now()
-                        plotly_code = self.generate_plotly_code(
-                            question=question,
-                            sql=current_sql,
-                            df_metadata=f"DataFrame info: {df.dtypes}"
-                        )
-                        print(f"Generated Plotly code:\n{plotly_code}")
-                        
-                        print("Creating Plotly figure...")
-                        fig = self.get_plotly_figure(plotly_code, df)
-                        timing["visualization_end"] = datetime.datetime.now()
+                    stages["visualization"] = visualization_stage
+                elif not visualize:
+                    print("Visualization is disabled")
+                elif df is None:
+                    print("DataFrame is None, cannot visualize")
+                else:
+                    print(f"should_generate_visualization returned False - Shape: {df.shape}, Empty: {df.empty}")
+                
+                if df is not None and len(df) > 0:
+                    stages["summary"] = summary_stage
+                    # Add to training if successful
+                    stages["training"] = training_stage
+                
+                timing["post_processing_start"] = datetime.datetime.now()
+                stage_results = self.stage_scheduler.run(stages)
+                timing["post_processing_end"] = datetime.datetime.now()
+                
+                if "visualization" in stage_results:
+                    stage = stage_results["visualization"]
+                    timing["visualization_start"], timing["visualization_end"] = stage["start"], stage["end"]
+                    if stage["error"] is not None:
+                        print(f"Visualization error: {stage['error']}")
+                    else:
+                        fig = stage["result"]
                         print(f"Figure created: {fig is not None}")
-                        
-                        if print_results:
+                        if print_results and fig is not None:
                             try:
-                                from IPython.display import Image
+                                from IPython.display import display, Image
                                 img_bytes = fig.to_image(format="png", scale=2)
                                 display(Image(img_bytes))
                             except ImportError:
-                                # Prevent opening in a new browser tab by setting auto_open to False
-                                # fig.show(config={'displayModeBar': True, 'showLink': False}, auto_open=False)
                                 pass
-                    except Exception as e:
-                        print(f"Visualization error: {e}")
-                        import traceback
-                        traceback.print_exc()
-                else:
-                    if not visualize:
-                        print("Visualization is disabled")
-                    elif df is None:
-                        print("DataFrame is None, cannot visualize")
+                
+                if "summary" in stage_results:
+                    stage = stage_results["summary"]
+                    timing["explanation_start"], timing["explanation_end"] = stage["start"], stage["end"]
+                    if stage["error"] is not None:
+                        print(f"Summary generation error: {stage['error']}")
                     else:
-                        should_vis = self.should_generate_visualization(df)
-                        print(f"should_generate_visualization returned: {should_vis}")
-                        print(f"DataFrame details - Shape: {df.shape}, Empty: {df.empty}")
-                        if not df.empty:
-                            numeric_cols = [col for col in df.columns if df[col].dtype.kind in 'ifc']
-                            print(f"Numeric columns: {numeric_cols}")
+                        summary = stage["result"]
                 
-                # Generate summary
-                if df is not None and len(df) > 0:
-                    try:
-                        timing["explanation_start"] = datetime.datetime.now()
-                        summary = self.generate_data_summary(question, {"sql": current_sql, "data": df})
-                        timing["explanation_end"] = datetime.datetime.now()
-                    except Exception as e:
-                        print(f"Summary generation error: {e}")
+                if "training" in stage_results:
+                    stage = stage_results["training"]
+                    timing["training_start"], timing["training_end"] = stage["start"], stage["end"]
+                    if stage["error"] is not None:
+                        print(f"Error adding question to training data: {stage['error']}")
                 
                 # Calculate timing information
                 timing["end_time"] = datetime.datetime.now()
@@ -826,7 +1166,10 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
                     "sql_generation_ms": sql_generation_time_ms,
                     "sql_execution_ms": sql_execution_time_ms,
                     "visualization_ms": visualization_time_ms,
-                    "explanation_ms": explanation_time_ms
+                    "explanation_ms": explanation_time_ms,
+                    "training_ms": elapsed_ms(timing["training_start"], timing["training_end"]),
+                    "post_processing_ms": elapsed_ms(timing["post_processing_start"], timing["post_processing_end"]),
+                    "result_cache_hit": bool(df is not None and df.attrs.get("result_cache_hit"))
                 }
                 
                 # Record the successful attempt with all data
@@ -932,9 +1275,11 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             except ImportError:
                 print(df)
         
-        # Add to training if successful
-        if df is not None and len(df) > 0:
-            self.add_question_sql(question, metadata["final_sql"])
+        # Remember the working SQL for repeats of this question, unless it is another
+        # question's SQL served unchanged by the similarity tier (re-storing it under
+        # this question would let near-duplicate matches drift from question to question)
+        if not (metadata["sql_cache"] == "similar" and metadata["final_sql"] == metadata["original_sql"]):
+            self.cache_sql(question, metadata["final_sql"])
         
         # Calculate final timing information
         timing["end_time"] = datetime.datetime.now()
@@ -949,7 +1294,10 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             "sql_generation_ms": sql_generation_time_ms,
             "sql_execution_ms": sql_execution_time_ms,
             "visualization_ms": visualization_time_ms,
-            "explanation_ms": explanation_time_ms
+            "explanation_ms": explanation_time_ms,
+            "training_ms": elapsed_ms(timing["training_start"], timing["training_end"]),
+            "post_processing_ms": elapsed_ms(timing["post_processing_start"], timing["post_processing_end"]),
+            "result_cache_hit": bool(df is not None and df.attrs.get("result_cache_hit"))
         }
         
         # Return successful result with timing information
@@ -959,6 +1307,7 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             "final_sql": metadata["final_sql"] if metadata["final_sql"] != metadata["original_sql"] else None,
             "retry_count": metadata["retry_count"],
             "data": df,
+            **self.get_result_size(df),
             "visualization": fig,
             "summary": summary,
             "metadata": metadata,
@@ -1115,17 +1464,18 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
                 )
             )
 
-    def get_similar_questions(self, question: str) -> list:
+    def get_similar_questions(self, question: str, embedding: List[float] = None) -> list:
         """
         Get similar questions with their SQL from vector store.
         
         Args:
             question: Natural language question
+            embedding: Precomputed question embedding (optional)
             
         Returns:
             List of question-SQL pairs
         """
-        embedding = self.generate_embedding(question)
+        embedding = self._get_query_embedding(question, embedding)
         
         results = self.qdrant_client.search(
             collection_name=self.questions_collection,
@@ -1135,17 +1485,18 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
         
         return [point.payload for point in results]
     
-    def get_related_schema(self, question: str) -> list:
+    def get_related_schema(self, question: str, embedding: List[float] = None) -> list:
         """
         Get related schema information from vector store.
         
         Args:
             question: Natural language question
+            embedding: Precomputed question embedding (optional)
             
         Returns:
             List of schema strings
         """
-        embedding = self.generate_embedding(question)
+        embedding = self._get_query_embedding(question, embedding)
         
         results = self.qdrant_client.search(
             collection_name=self.schema_collection,
@@ -1153,19 +1504,20 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             limit=self.n_results
         )
         
-        return [point.payload["schema"] for point in results]
+        return self._schema_with_neighbors([point.payload for point in results])
     
-    def get_related_documentation(self, question: str) -> list:
+    def get_related_documentation(self, question: str, embedding: List[float] = None) -> list:
         """
         Get related documentation from vector store.
         
         Args:
             question: Natural language question
+            embedding: Precomputed question embedding (optional)
             
         Returns:
             List of documentation strings
         """
-        embedding = self.generate_embedding(question)
+        embedding = self._get_query_embedding(question, embedding)
         
         results = self.qdrant_client.search(
             collection_name=self.docs_collection,
@@ -1306,8 +1658,11 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
         Returns:
             SQL query with configuration metadata
         """
+        # Fetch examples, schema and documentation together with a single embedding
+        context = self.get_related_context(question)
+        
         # Get similar questions
-        similar_questions = self.get_similar_questions(question)
+        similar_questions = context["similar_questions"]
         similar_questions_text = ""
         
         # Track if memory/context was used
@@ -1318,13 +1673,13 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             used_memory = True  # Mark as true if we have similar questions
             
         # Get schema information
-        schema_info = self.get_related_schema(question)
+        schema_info = context["schema"]
         schema_text = "\n".join(schema_info)
         if schema_info:
             used_memory = True  # Mark as true if we have schema info
         
         # Get documentation
-        docs = self.get_related_documentation(question)
+        docs = context["documentation"]
         docs_text = "\n".join(docs)
         if docs:
             used_memory = True  # Mark as true if we have documentation
@@ -1360,8 +1715,11 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             )
         ]
         
-        # Get response from Azure OpenAI
-        response = self.submit_prompt(prompt)
+        # Get response from Azure OpenAI, stopping as soon as the SQL is complete
+        if self.stream_sql_generation:
+            response = self.submit_prompt_until(prompt, "</sql>")
+        else:
+            response = self.submit_prompt(prompt)
         
         # If the LLM didn't include the config section, add it manually
         if "<config>" not in response:
@@ -1593,7 +1951,7 @@ class Talk2SQLAzure(QdrantVectorStore, AzureOpenAILLM):
             
             I ran the following SQL query: ${sql}
             
-            The query returned a dataframe with ${len(df)} rows and ${len(df.columns)} columns.
+            The query returned a dataframe with ${self.get_result_size(df)["row_count"]} rows and ${len(df.columns)} columns.
             Column names: ${', '.join(df.columns)}
             
             Here's the dataframe:
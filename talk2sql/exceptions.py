@@ -14,6 +14,13 @@ class SQLExecutionError(Talk2SQLException):
     """Exception raised when SQL execution fails."""
     pass
 
+class QueryTimeoutError(SQLExecutionError):
+    """Exception raised when a query runs past its deadline and is cancelled."""
+    def __init__(self, message, timeout=None, sql=None):
+        super().__init__(message)
+        self.timeout = timeout
+        self.sql = sql
+
 class SQLParsingError(Talk2SQLException):
     """Exception raised when SQL parsing fails."""
     def __init__(self, message, response_text=None):
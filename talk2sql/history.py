@@ -0,0 +1,237 @@
+"""
+Query history storage: table columns and the background writer.
+
+Request threads hand history writes to a bounded queue and return immediately.
+A single background thread owns one long-lived WAL-mode connection and commits
+queued writes in batches (group commit), so requests neither wait for the disk
+nor contend for the SQLite write lock.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence
+
+# Columns of the query_history table
+HISTORY_COLUMNS = (
+    "id", "timestamp", "question", "sql", "success", "error_message", "retry_count",
+    "data", "columns", "visualization", "summary", "total_time_ms",
+    "sql_generation_time_ms", "sql_execution_time_ms", "visualization_time_ms",
+    "explanation_time_ms", "timing_details", "used_memory"
+)
+
+# Large serialized columns, only read (and decoded) when a caller asks for them
+HISTORY_HEAVY_COLUMNS = ("data", "columns", "visualization")
+
+# Counts and timings, enough for metrics and error analysis
+HISTORY_METRIC_COLUMNS = (
+    "id", "timestamp", "success", "error_message", "retry_count", "total_time_ms",
+    "sql_generation_time_ms", "sql_execution_time_ms", "visualization_time_ms",
+    "explanation_time_ms", "used_memory"
+)
+
+# Queue item telling the writer thread to exit
+_STOP = object()
+
+
+class HistoryWriter:
+    """Group-committing writer with one persistent WAL connection."""
+
+    def __init__(self, db_path: str, max_queue: int = 1000, batch_size: int = 100,
+                 flush_interval: float = 0.2, enqueue_timeout: float = 1.0):
+        """
+        Initialize the writer and start its thread.
+
+        Args:
+            db_path: Path to the history SQLite database
+            max_queue: Maximum writes waiting to be committed (default: 1000)
+            batch_size: Maximum writes per transaction (default: 100)
+            flush_interval: Seconds to wait for more writes before committing a batch (default: 0.2)
+            enqueue_timeout: Seconds to wait for queue space before dropping a write (default: 1)
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run, name="talk2sql-history-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the writer's connection in WAL mode."""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL with NORMAL sync stays consistent on crash and only fsyncs at checkpoints
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def submit(self, sql: str, params: Sequence[Any] = None,
+               prepare: Callable[[], Sequence[Any]] = None) -> bool:
+        """
+        Queue a write.
+
+        Args:
+            sql: INSERT/UPDATE statement
+            params: Statement parameters
+            prepare: Function returning the parameters, called on the writer
+                thread (use it to move serialization off the request thread)
+
+        Returns:
+            True if queued, False if the writer is closed or the queue stayed full
+        """
+        if self._closed:
+            return False
+        try:
+            self._queue.put((sql, params, prepare), timeout=self.enqueue_timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            print(f"History queue full, dropped a write to {self.db_path}")
+            return False
+
+    def submit_write(self, write: Callable[[sqlite3.Connection], None]) -> bool:
+        """
+        Queue a function that writes through the writer's connection.
+
+        Use it for writes spanning several statements; they commit together.
+
+        Args:
+            write: Function taking the connection, called on the writer thread
+                inside the batch transaction (it must not commit)
+
+        Returns:
+            True if queued, False if the writer is closed or the queue stayed full
+        """
+        return self.submit(None, prepare=write)
+
+    def _write_batch(self, conn: sqlite3.Connection, batch):
+        """Commit a batch in one transaction, falling back to one write at a time on error."""
+        def execute(item):
+            sql, params, prepare = item
+            if sql is None:
+                prepare(conn)
+            else:
+                conn.execute(sql, prepare() if prepare is not None else (params or ()))
+
+        try:
+            with conn:
+                for item in batch:
+                    execute(item)
+            self.written += len(batch)
+            self.batches += 1
+            return
+        except Exception as e:
+            print(f"Error writing history batch, retrying individually: {e}")
+
+        # Isolate the bad write so the rest of the batch still lands
+        for item in batch:
+            try:
+                with conn:
+                    execute(item)
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error writing query history: {e}")
+
+    def _run(self):
+        """Writer loop: take a write, gather whatever else arrives shortly after, commit."""
+        conn = None
+        try:
+            conn = self._connect()
+        except Exception as e:
+            print(f"Error opening history database {self.db_path}: {e}")
+
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+
+            if conn is not None:
+                self._write_batch(conn, batch)
+            else:
+                self.failed += len(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+        if conn is not None:
+            conn.close()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued write is committed.
+
+        Args:
+            timeout: Maximum seconds to wait (None = no limit)
+
+        Returns:
+            True if the queue drained in time
+        """
+        if not self._thread.is_alive():
+            return self._queue.unfinished_tasks == 0
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 10.0):
+        """
+        Commit pending writes and stop the writer thread.
+
+        Args:
+            timeout: Maximum seconds to wait for pending writes
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            print(f"History queue still full at shutdown; pending writes to {self.db_path} may be lost")
+            return
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get writer counters.
+
+        Returns:
+            Dictionary with queued, written, batch, dropped and failed counts
+        """
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
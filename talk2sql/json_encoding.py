@@ -0,0 +1,145 @@
+"""
+Shared JSON encoding for query results, figures and history rows.
+
+Everything is encoded with orjson, which serializes NumPy arrays and scalars
+and datetimes natively and writes NaN/inf as null. DataFrames are encoded
+column by column (see result_format.to_records) and the encoded records are
+kept on the DataFrame, so history, the HTTP response and SSE events reuse the
+same bytes instead of serializing the result again. dumps_with_raw splices
+such pre-encoded values into a larger document.
+"""
+
+import base64
+import datetime
+import decimal
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import orjson
+import pandas as pd
+
+from talk2sql.result_format import encode_result, to_records
+
+OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+# df.attrs key holding (id(df), encoded records); the id check keeps copies
+# and derived frames, which inherit attrs, from reusing stale bytes
+_RECORDS_ATTR = "_records_json"
+
+
+def _default(obj: Any) -> Any:
+    """Convert types orjson doesn't handle natively."""
+    if isinstance(obj, pd.DataFrame):
+        return orjson.Fragment(records_json(obj)) if hasattr(orjson, "Fragment") else to_records(obj)
+    if isinstance(obj, pd.Series):
+        return obj.astype(object).where(obj.notna(), None).tolist()
+    if isinstance(obj, pd.Timestamp):
+        return None if pd.isna(obj) else obj.isoformat()
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(obj)).decode("utf-8")
+    if isinstance(obj, np.ndarray):
+        # Object or non-native dtypes that OPT_SERIALIZE_NUMPY rejects
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.timedelta, pd.Timedelta)):
+        return obj.total_seconds()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "to_plotly_json"):
+        # Plotly figures and graph objects
+        return obj.to_plotly_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Encode an object as JSON.
+
+    Args:
+        obj: Object to encode (may contain DataFrames, NumPy values, figures, bytes, ...)
+
+    Returns:
+        UTF-8 JSON bytes
+    """
+    return orjson.dumps(obj, default=_default, option=OPTIONS)
+
+
+def dumps_str(obj: Any) -> str:
+    """Encode an object as a JSON string (for TEXT columns and SSE lines)."""
+    return dumps(obj).decode("utf-8")
+
+
+def loads(data) -> Any:
+    """Decode JSON from bytes or str."""
+    return orjson.loads(data)
+
+
+def records_json(df: pd.DataFrame) -> bytes:
+    """
+    Encode a DataFrame as a list of row objects, reusing earlier encodings of it.
+
+    Args:
+        df: Query result
+
+    Returns:
+        UTF-8 JSON bytes of the records
+    """
+    cached = df.attrs.get(_RECORDS_ATTR)
+    if cached is not None and cached[0] == id(df):
+        return cached[1]
+
+    encoded = orjson.dumps(to_records(df), default=_default, option=OPTIONS)
+    df.attrs[_RECORDS_ATTR] = (id(df), encoded)
+    return encoded
+
+
+def dumps_with_raw(obj: Dict[str, Any], raw: Dict[str, bytes]) -> bytes:
+    """
+    Encode a dict and splice already-encoded JSON values into it.
+
+    Args:
+        obj: Dictionary to encode
+        raw: Mapping of key to pre-encoded JSON value (e.g. from records_json)
+
+    Returns:
+        UTF-8 JSON bytes of obj with the raw fields added
+    """
+    encoded = dumps(obj)
+    if not raw:
+        return encoded
+
+    parts = [encoded[:-1]]
+    separator = b"," if obj else b""
+    for key, value in raw.items():
+        parts.append(separator + orjson.dumps(key) + b":" + value)
+        separator = b","
+    parts.append(b"}")
+    return b"".join(parts)
+
+
+def result_fields(df: pd.DataFrame, fmt: str = "records",
+                  dictionary_encode: bool = True) -> Tuple[Dict[str, Any], Dict[str, bytes]]:
+    """
+    Build the response fields for a query result in a negotiated format.
+
+    Records reuse the DataFrame's cached encoding, so they are returned as a
+    raw field for dumps_with_raw rather than as Python objects.
+
+    Args:
+        df: Query result
+        fmt: One of result_format.RESULT_FORMATS
+        dictionary_encode: Whether columnar/arrow output dictionary-encodes strings
+
+    Returns:
+        (fields, raw fields)
+    """
+    if fmt != "records" or df is None or not hasattr(df, "columns"):
+        return encode_result(df, fmt, dictionary_encode=dictionary_encode), {}
+
+    fields = {"format": "records", "columns": [str(column) for column in df.columns]}
+    return fields, {"data": records_json(df)}
@@ -1,6 +1,6 @@
 import os
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
 
 from openai import OpenAI
 
@@ -94,6 +94,40 @@ class AnthropicLLM(Talk2SQLBase):
             print(f"Error submitting prompt to Anthropic: {e}")
             return f"Error generating response: {str(e)}"
     
+    def submit_prompt_stream(self, prompt, **kwargs) -> Iterator[str]:
+        """
+        Submit a prompt to Anthropic and yield response text as it arrives.
+        
+        Closing the generator early closes the underlying HTTP stream.
+        
+        Args:
+            prompt: List of message dictionaries
+            
+        Returns:
+            Iterator of response text chunks
+        """
+        if not prompt:
+            raise ValueError("Prompt cannot be empty")
+        
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=prompt,
+            temperature=kwargs.get("temperature", self.temperature),
+            max_tokens=kwargs.get("max_tokens", self.max_tokens),
+            stream=True
+        )
+        
+        try:
+            for chunk in stream:
+                # Some chunks (e.g. content filter results) carry no choices
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield content
+        finally:
+            stream.close()
+    
     def generate_embedding(self, text: str) -> List[float]:
         """
         Generate embedding vector for text.
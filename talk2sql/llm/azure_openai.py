@@ -1,11 +1,87 @@
 import os
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
 
 import openai
 from openai import AzureOpenAI
 
 from talk2sql.base import Talk2SQLBase
+from talk2sql.cache.embedding import EmbeddingCache
+from talk2sql.utils import FallbackEmbedding, chunk_texts
+
+def create_embedding_cache(config: Dict[str, Any]):
+    """
+    Create an embedding cache from configuration.
+    
+    Args:
+        config: Configuration dictionary (see AzureOpenAILLM)
+        
+    Returns:
+        EmbeddingCache instance, or None if caching is disabled
+    """
+    if not config.get("embedding_cache", True):
+        return None
+    
+    return EmbeddingCache(
+        path=config.get("embedding_cache_path"),
+        max_memory_bytes=config.get("embedding_cache_memory_bytes", 64 * 1024 * 1024),
+        max_disk_bytes=config.get("embedding_cache_disk_bytes", 256 * 1024 * 1024)
+    )
+
+def embed_texts_batched(client, model: str, texts: List[str], cache: EmbeddingCache = None,
+                        max_items: int = 256, max_tokens: int = 100000, fallback=None) -> List[List[float]]:
+    """
+    Embed several texts with as few embeddings API calls as possible.
+    
+    Cached texts are served from the cache; the rest are sent in batches bounded
+    by item count and estimated tokens. A batch that fails falls back to
+    embedding its texts one at a time.
+    
+    Args:
+        client: OpenAI/AzureOpenAI client
+        model: Embedding model or deployment name
+        texts: Texts to embed
+        cache: Optional embedding cache
+        max_items: Maximum texts per API call
+        max_tokens: Maximum estimated tokens per API call
+        fallback: Single-text embedding function used when a batch fails
+        
+    Returns:
+        List of embedding vectors in the same order as texts
+    """
+    embeddings = [None] * len(texts)
+    
+    # Serve what we can from the cache, embedding each distinct text once
+    pending = {}
+    for i, text in enumerate(texts):
+        cached = cache.get(model, text) if cache is not None else None
+        if cached is not None:
+            embeddings[i] = cached
+        else:
+            pending.setdefault(text, []).append(i)
+    
+    missing = list(pending.keys())
+    for batch in chunk_texts(missing, max_items, max_tokens):
+        batch_texts = [missing[i] for i in batch]
+        try:
+            response = client.embeddings.create(model=model, input=batch_texts)
+            batch_embeddings = [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+            store = cache is not None
+        except Exception as e:
+            if fallback is None:
+                raise
+            print(f"Error generating batch embeddings ({len(batch_texts)} texts), falling back to single requests: {e}")
+            # The fallback caches its own successes (and must not cache hash-based placeholders)
+            batch_embeddings = [fallback(text) for text in batch_texts]
+            store = False
+        
+        for text, embedding in zip(batch_texts, batch_embeddings):
+            if store:
+                cache.put(model, text, embedding)
+            for i in pending[text]:
+                embeddings[i] = embedding
+    
+    return embeddings
 
 class AzureOpenAILLM(Talk2SQLBase):
     """LLM implementation using Azure OpenAI's GPT models and text-embedding models."""
@@ -23,6 +99,13 @@ class AzureOpenAILLM(Talk2SQLBase):
                 - azure_embedding_deployment: Embedding deployment name (default: "text-embedding-ada-002")
                 - temperature: Sampling temperature (default: 0.0)
                 - max_tokens: Maximum tokens in response (default: 4000)
+                - stream_sql_generation: Stream SQL generation and stop at </sql> (default: True)
+                - embedding_batch_size: Maximum texts per embeddings request (default: 256)
+                - embedding_batch_tokens: Maximum estimated tokens per embeddings request (default: 100000)
+                - embedding_cache: Whether to cache embeddings (default: True)
+                - embedding_cache_path: SQLite file for the on-disk embedding cache (default: memory only)
+                - embedding_cache_memory_bytes: In-process embedding cache budget (default: 64 MB)
+                - embedding_cache_disk_bytes: On-disk embedding cache budget (default: 256 MB)
         """
         super().__init__(config)
         
@@ -51,6 +134,14 @@ class AzureOpenAILLM(Talk2SQLBase):
             azure_endpoint=self.endpoint,
             api_version=self.api_version
         )
+        
+        # Embedding batch limits
+        self.embedding_batch_size = config.get("embedding_batch_size", 256)
+        self.embedding_batch_tokens = config.get("embedding_batch_tokens", 100000)
+        
+        # Embedding cache (keep the existing one if __init__ runs twice via the engine MRO)
+        if getattr(self, "embedding_cache", None) is None:
+            self.embedding_cache = create_embedding_cache(config)
     
     def system_message(self, message: str) -> Dict[str, str]:
         """Create a system message for Azure OpenAI."""
@@ -97,6 +188,40 @@ class AzureOpenAILLM(Talk2SQLBase):
             print(f"Error submitting prompt to Azure OpenAI: {e}")
             return f"Error generating response: {str(e)}"
     
+    def submit_prompt_stream(self, prompt, **kwargs) -> Iterator[str]:
+        """
+        Submit a prompt to Azure OpenAI and yield response text as it arrives.
+        
+        Closing the generator early closes the underlying HTTP stream.
+        
+        Args:
+            prompt: List of message dictionaries
+            
+        Returns:
+            Iterator of response text chunks
+        """
+        if not prompt:
+            raise ValueError("Prompt cannot be empty")
+        
+        stream = self.client.chat.completions.create(
+            model=self.deployment,
+            messages=prompt,
+            temperature=kwargs.get("temperature", self.temperature),
+            max_tokens=kwargs.get("max_tokens", self.max_tokens),
+            stream=True
+        )
+        
+        try:
+            for chunk in stream:
+                # Some chunks (e.g. content filter results) carry no choices
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield content
+        finally:
+            stream.close()
+    
     def generate_embedding(self, text: str) -> List[float]:
         """
         Generate embedding vector for text using Azure OpenAI.
@@ -107,21 +232,51 @@ class AzureOpenAILLM(Talk2SQLBase):
         Returns:
             List of floats representing the embedding vector
         """
+        # Check the cache first
+        if self.embedding_cache is not None:
+            cached = self.embedding_cache.get(self.embedding_deployment, text)
+            if cached is not None:
+                return cached
+        
         try:
             # Create an embedding with Azure OpenAI
             response = self.client.embeddings.create(
                 model=self.embedding_deployment,
                 input=text
             )
+            embedding = response.data[0].embedding
+            
+            if self.embedding_cache is not None:
+                self.embedding_cache.put(self.embedding_deployment, text, embedding)
             
             # Return the embedding
-            return response.data[0].embedding
+            return embedding
             
         except Exception as e:
             print(f"Error generating Azure OpenAI embedding: {e}")
             # Fallback to simple embedding
             return self._simple_embedding(text)
     
+    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generate embedding vectors for several texts using batched Azure OpenAI requests.
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            List of embedding vectors in the same order as texts
+        """
+        return embed_texts_batched(
+            self.client,
+            self.embedding_deployment,
+            texts,
+            cache=self.embedding_cache,
+            max_items=self.embedding_batch_size,
+            max_tokens=self.embedding_batch_tokens,
+            fallback=self.generate_embedding
+        )
+    
     def _simple_embedding(self, text: str) -> List[float]:
         """
         Simple fallback embedding function.
@@ -130,7 +285,7 @@ class AzureOpenAILLM(Talk2SQLBase):
             text: Text to embed
             
         Returns:
-            Simple hash-based embedding (not for production use)
+            Simple hash-based embedding (not for production use), marked as a FallbackEmbedding
         """
         import hashlib
         import numpy as np
@@ -142,7 +297,7 @@ class AzureOpenAILLM(Talk2SQLBase):
         
         # Convert hash to list of floats
         np.random.seed(int.from_bytes(hash_bytes[:4], byteorder='little'))
-        return np.random.normal(0, 1, 1536).tolist()
+        return FallbackEmbedding(np.random.normal(0, 1, 1536).tolist())
     
     def generate_plotly_code(self, question: str = None, sql: str = None, df_metadata: str = None) -> str:
         """
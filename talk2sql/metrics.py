@@ -0,0 +1,381 @@
+"""
+Incrementally maintained query metrics.
+
+Every recorded query updates small rollup tables in the history database,
+in the same transaction as its history row:
+
+- ``metrics_daily``: per-day query, success, retry and memory counters
+- ``metrics_errors``: per-day counters by error class (/metrics) and error
+  type (/analyze)
+- ``metrics_stages``: per-day latency count and sum per pipeline stage
+- ``metrics_latency``: per-day latency histograms per stage
+
+Histogram buckets are logarithmic with a fixed growth factor, so histograms
+from different days (or processes) merge by adding bucket counts and any
+quantile is read back within ``RELATIVE_ACCURACY``. Reading metrics costs one
+row per day (and per used bucket), however many queries were recorded, plus
+the history rows of the first day when a range starts mid-day.
+"""
+
+import datetime
+import math
+import sqlite3
+from typing import Any, Dict, Optional
+
+# Pipeline stages and the query_history column holding each one's latency
+STAGE_COLUMNS = {
+    "total": "total_time_ms",
+    "generation": "sql_generation_time_ms",
+    "execution": "sql_execution_time_ms",
+    "visualization": "visualization_time_ms",
+    "explanation": "explanation_time_ms"
+}
+
+# Quantiles read from the histograms are within this relative error
+RELATIVE_ACCURACY = 0.02
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+# Rows read per chunk when rebuilding rollups from existing history
+_REBUILD_CHUNK = 5000
+
+# Per-day counters of metrics_daily
+_COUNTERS = ("total", "success", "retried", "retries", "retry_success", "with_memory", "memory_success")
+
+
+def bucket_index(ms: float) -> int:
+    """Histogram bucket holding a positive latency."""
+    return math.ceil(math.log(ms) / _LOG_GAMMA)
+
+
+def bucket_value(index: int) -> float:
+    """Representative latency of a bucket (within RELATIVE_ACCURACY of every value in it)."""
+    return 2 * _GAMMA ** index / (_GAMMA + 1)
+
+
+def histogram_quantile(histogram: Dict[int, int], q: float) -> float:
+    """
+    Read a quantile from a bucket histogram.
+
+    Args:
+        histogram: Bucket index -> count
+        q: Quantile in percent (0-100)
+
+    Returns:
+        Latency at the quantile, or 0 for an empty histogram
+    """
+    total = sum(count for count in histogram.values() if count > 0)
+    if total == 0:
+        return 0
+    rank = q / 100 * (total - 1)
+    seen = 0
+    for index in sorted(histogram):
+        count = histogram[index]
+        if count <= 0:
+            continue
+        seen += count
+        if seen > rank:
+            return bucket_value(index)
+    return bucket_value(max(histogram))
+
+
+def classify_error(message: Optional[str]) -> str:
+    """Coarse error class used by /metrics."""
+    msg = (message or "").lower()
+    if "syntax" in msg:
+        return "syntax_error"
+    if "timeout" in msg:
+        return "timeout"
+    if any(t in msg for t in ["permission", "access"]):
+        return "permission"
+    if "connection" in msg:
+        return "connection"
+    if any(t in msg for t in ["not exist", "not found", "no such"]):
+        if "table" in msg:
+            return "table_not_found"
+        if "column" in msg:
+            return "column_not_found"
+        return "schema_error"
+    return "other"
+
+
+def error_type(message: str) -> str:
+    """Error type used by error analysis: the first line, up to its first colon."""
+    first_line = message.split('\n')[0]
+    if ':' in first_line:
+        first_line = first_line.split(':', 1)[0]
+    return first_line
+
+
+class MetricsRollup:
+    """Rollup tables kept next to query_history."""
+
+    def __init__(self, db_path: str):
+        """
+        Initialize the rollup.
+
+        Args:
+            db_path: Path to the history SQLite database
+        """
+        self.db_path = db_path
+
+    @staticmethod
+    def create_tables(conn: sqlite3.Connection) -> bool:
+        """
+        Create the rollup tables.
+
+        Returns:
+            True if the tables were just created (and may need a rebuild)
+        """
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'metrics_daily'"
+        ).fetchone()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metrics_daily (
+                day TEXT PRIMARY KEY,
+                total INTEGER DEFAULT 0,
+                success INTEGER DEFAULT 0,
+                retried INTEGER DEFAULT 0,
+                retries INTEGER DEFAULT 0,
+                retry_success INTEGER DEFAULT 0,
+                with_memory INTEGER DEFAULT 0,
+                memory_success INTEGER DEFAULT 0
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metrics_errors (
+                day TEXT,
+                kind TEXT,
+                name TEXT,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (day, kind, name)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metrics_stages (
+                day TEXT,
+                stage TEXT,
+                count INTEGER DEFAULT 0,
+                sum_ms REAL DEFAULT 0,
+                PRIMARY KEY (day, stage)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metrics_latency (
+                day TEXT,
+                stage TEXT,
+                bucket INTEGER,
+                count INTEGER DEFAULT 0,
+                PRIMARY KEY (day, stage, bucket)
+            )
+        ''')
+        return exists is None
+
+    @staticmethod
+    def record_stage(conn: sqlite3.Connection, day: str, stage: str, ms: Optional[float], count: int = 1):
+        """
+        Add (or with count=-1, remove) one stage latency.
+
+        Args:
+            conn: Connection inside the recording transaction
+            day: Day (YYYY-MM-DD) the query ran
+            stage: Key of STAGE_COLUMNS
+            ms: Latency in milliseconds; missing and non-positive values are ignored
+            count: Occurrences to add
+        """
+        if not ms or ms <= 0:
+            return
+        conn.execute(
+            '''
+            INSERT INTO metrics_stages (day, stage, count, sum_ms) VALUES (?, ?, ?, ?)
+            ON CONFLICT(day, stage) DO UPDATE SET
+                count = count + excluded.count, sum_ms = sum_ms + excluded.sum_ms
+            ''',
+            (day, stage, count, ms * count)
+        )
+        conn.execute(
+            '''
+            INSERT INTO metrics_latency (day, stage, bucket, count) VALUES (?, ?, ?, ?)
+            ON CONFLICT(day, stage, bucket) DO UPDATE SET count = count + excluded.count
+            ''',
+            (day, stage, bucket_index(ms), count)
+        )
+
+    def record(self, conn: sqlite3.Connection, timestamp: str, success: bool, retry_count: int = 0,
+               used_memory: bool = False, error_message: str = None,
+               latencies: Dict[str, Optional[float]] = None):
+        """
+        Add one query to the rollups.
+
+        Args:
+            conn: Connection inside the transaction that writes the history row
+            timestamp: ISO timestamp of the query
+            success: Whether the query succeeded
+            retry_count: Number of retries performed
+            used_memory: Whether memory/context was used
+            error_message: Error message if the query failed
+            latencies: Stage (key of STAGE_COLUMNS) -> latency in milliseconds
+        """
+        day = timestamp[:10]
+        retry_count = retry_count or 0
+        conn.execute(
+            '''
+            INSERT INTO metrics_daily
+                (day, total, success, retried, retries, retry_success, with_memory, memory_success)
+            VALUES (?, 1, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(day) DO UPDATE SET
+                total = total + 1,
+                success = success + excluded.success,
+                retried = retried + excluded.retried,
+                retries = retries + excluded.retries,
+                retry_success = retry_success + excluded.retry_success,
+                with_memory = with_memory + excluded.with_memory,
+                memory_success = memory_success + excluded.memory_success
+            ''',
+            (day, int(bool(success)), int(retry_count > 0), retry_count,
+             int(retry_count > 0 and bool(success)), int(bool(used_memory)),
+             int(bool(used_memory) and bool(success)))
+        )
+
+        errors = []
+        if not success:
+            errors.append(("class", classify_error(error_message)))
+        if error_message:
+            errors.append(("type", error_type(error_message)))
+        for kind, name in errors:
+            conn.execute(
+                '''
+                INSERT INTO metrics_errors (day, kind, name, count) VALUES (?, ?, ?, 1)
+                ON CONFLICT(day, kind, name) DO UPDATE SET count = count + 1
+                ''',
+                (day, kind, name)
+            )
+
+        for stage, ms in (latencies or {}).items():
+            self.record_stage(conn, day, stage, ms)
+
+    def rebuild(self, conn: sqlite3.Connection):
+        """
+        Recompute the rollups from query_history (for databases recorded before them).
+
+        Args:
+            conn: Connection to the history database; the caller commits
+        """
+        for table in ("metrics_daily", "metrics_errors", "metrics_stages", "metrics_latency"):
+            conn.execute(f"DELETE FROM {table}")
+
+        cursor = conn.execute(
+            "SELECT timestamp, success, retry_count, used_memory, error_message, "
+            + ", ".join(STAGE_COLUMNS.values()) + " FROM query_history WHERE timestamp IS NOT NULL"
+        )
+        while True:
+            rows = cursor.fetchmany(_REBUILD_CHUNK)
+            if not rows:
+                break
+            for row in rows:
+                self.record(
+                    conn, row[0], success=bool(row[1]), retry_count=row[2], used_memory=bool(row[3]),
+                    error_message=row[4], latencies=dict(zip(STAGE_COLUMNS, row[5:]))
+                )
+
+    @staticmethod
+    def _read(conn: sqlite3.Connection, where: str = "", params: tuple = ()) -> Dict[str, Any]:
+        """Read days, errors and stages from the rollup tables of one connection."""
+        days = [
+            dict(zip(("day",) + _COUNTERS, row))
+            for row in conn.execute(
+                f"SELECT day, {', '.join(_COUNTERS)} FROM metrics_daily{where} ORDER BY day", params
+            )
+        ]
+
+        errors = {"class": {}, "type": {}}
+        for kind, name, count in conn.execute(
+            f"SELECT kind, name, SUM(count) FROM metrics_errors{where} GROUP BY kind, name", params
+        ):
+            if count:
+                errors.setdefault(kind, {})[name] = count
+
+        stages = {stage: {"count": 0, "sum_ms": 0.0, "histogram": {}} for stage in STAGE_COLUMNS}
+        for stage, count, sum_ms in conn.execute(
+            f"SELECT stage, SUM(count), SUM(sum_ms) FROM metrics_stages{where} GROUP BY stage", params
+        ):
+            if stage in stages:
+                stages[stage].update(count=count, sum_ms=sum_ms)
+        for stage, bucket, count in conn.execute(
+            f"SELECT stage, bucket, SUM(count) FROM metrics_latency{where} GROUP BY stage, bucket", params
+        ):
+            if stage in stages and count:
+                stages[stage]["histogram"][bucket] = count
+
+        return {"days": days, "errors": errors, "stages": stages}
+
+    def _read_partial_day(self, conn: sqlite3.Connection, since: str) -> Dict[str, Any]:
+        """Rollups of the queries from since to the end of its day, built from query_history."""
+        day = since[:10]
+        next_day = (datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat()
+
+        partial = sqlite3.connect(":memory:")
+        try:
+            self.create_tables(partial)
+            rows = conn.execute(
+                "SELECT timestamp, success, retry_count, used_memory, error_message, "
+                + ", ".join(STAGE_COLUMNS.values())
+                + " FROM query_history WHERE timestamp >= ? AND timestamp < ?",
+                (since, next_day)
+            )
+            for row in rows:
+                self.record(
+                    partial, row[0], success=bool(row[1]), retry_count=row[2], used_memory=bool(row[3]),
+                    error_message=row[4], latencies=dict(zip(STAGE_COLUMNS, row[5:]))
+                )
+            return self._read(partial)
+        finally:
+            partial.close()
+
+    def summary(self, since: str = None) -> Dict[str, Any]:
+        """
+        Merge the rollups of a time range.
+
+        Whole days are read from the rollup tables. When since falls inside a
+        day, the rest of that day is rebuilt from its query_history rows, so the
+        range starts exactly at since and costs at most one day of history.
+
+        Args:
+            since: ISO timestamp or day (YYYY-MM-DD) to start from (None = all history)
+
+        Returns:
+            Dictionary with days (per-day counters, oldest first), totals,
+            errors ({"class": {...}, "type": {...}}) and stages (stage ->
+            {"count", "sum_ms", "histogram"})
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            if not since:
+                parts = [self._read(conn)]
+            elif len(since) <= 10:
+                parts = [self._read(conn, " WHERE day >= ?", (since,))]
+            else:
+                parts = [
+                    self._read_partial_day(conn, since),
+                    self._read(conn, " WHERE day > ?", (since[:10],))
+                ]
+        finally:
+            conn.close()
+
+        days = [day for part in parts for day in part["days"]]
+        errors = {"class": {}, "type": {}}
+        stages = {stage: {"count": 0, "sum_ms": 0.0, "histogram": {}} for stage in STAGE_COLUMNS}
+        for part in parts:
+            for kind, counts in part["errors"].items():
+                merged_counts = errors.setdefault(kind, {})
+                for name, count in counts.items():
+                    merged_counts[name] = merged_counts.get(name, 0) + count
+            for stage, values in part["stages"].items():
+                merged = stages[stage]
+                merged["count"] += values["count"]
+                merged["sum_ms"] += values["sum_ms"]
+                for bucket, count in values["histogram"].items():
+                    merged["histogram"][bucket] = merged["histogram"].get(bucket, 0) + count
+
+        totals = {counter: sum(day[counter] for day in days) for counter in _COUNTERS}
+        return {"days": days, "totals": totals, "errors": errors, "stages": stages}
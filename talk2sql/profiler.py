@@ -0,0 +1,215 @@
+"""
+Single-pass table profiling.
+
+Each table is read in one streaming scan, fetched in chunks, that also counts
+its rows (a SQLite function in the WHERE clause sees every scanned row). Large
+tables are sampled inside the scan: the rowid range, read with two B-tree
+seeks, sets a Bernoulli rate that lets about ``sample_size`` rows through, and
+a reservoir caps what is kept, so memory stays bounded whatever the table
+size. All column statistics are computed from the kept rows with vectorized
+pandas operations: the number of distinct values (exact for whole tables,
+estimated for samples) and the value set of low-cardinality columns. Tables
+are profiled in parallel, each on its own connection.
+"""
+
+import math
+import random
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# Rows kept per table; larger tables are sampled down to this many
+SAMPLE_SIZE = 100000
+
+# Rows fetched from the scan at a time
+FETCH_SIZE = 5000
+
+# Name of the row-counting function registered on the profiling connection
+_COUNT_FUNCTION = "talk2sql_profile_count"
+
+
+def _quote_identifier(name: str) -> str:
+    """Quote a table or column name for SQLite."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _json_value(value: Any) -> Any:
+    """Keep JSON-native values, stringify anything else (e.g. blobs)."""
+    if isinstance(value, (str, int, float)):
+        return value
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def estimate_distinct(counts: pd.Series, sample_rows: int, total_rows: int) -> int:
+    """
+    Estimate a column's distinct values from value frequencies in a uniform sample.
+
+    Uses the bias-corrected Chao1 estimator, which adds the unseen values
+    implied by how many values were seen exactly once and exactly twice,
+    capped at the estimated number of non-null rows.
+
+    Args:
+        counts: Frequency of each distinct value in the sample
+        sample_rows: Rows in the sample
+        total_rows: Rows in the table
+
+    Returns:
+        Estimated number of distinct values
+    """
+    distinct = len(counts)
+    if sample_rows == 0 or sample_rows >= total_rows:
+        return distinct
+
+    singletons = int((counts == 1).sum())
+    doubletons = int((counts == 2).sum())
+    estimate = distinct + singletons * (singletons - 1) / (2 * (doubletons + 1))
+    non_null_rows = total_rows * int(counts.sum()) / sample_rows
+    return int(max(distinct, min(round(estimate), round(non_null_rows))))
+
+
+class _RowSampler:
+    """Counts the rows of a scan and keeps a uniform sample of those that reach Python."""
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.rows = []
+        self.seen = 0
+        self.fetched = 0
+        self._random = random.Random()
+
+    def count(self, keep: int) -> int:
+        """SQL function wrapping the WHERE clause: count the scanned row, pass its filter through."""
+        self.seen += 1
+        return keep
+
+    def add(self, rows: List[tuple]):
+        """Reservoir-sample fetched rows (Algorithm R)."""
+        for row in rows:
+            self.fetched += 1
+            if len(self.rows) < self.size:
+                self.rows.append(row)
+            else:
+                slot = self._random.randrange(self.fetched)
+                if slot < self.size:
+                    self.rows[slot] = row
+
+
+class TableProfiler:
+    """Profiles every column of a table from one streaming, counting, sampling scan."""
+
+    def __init__(self, sample_size: int = SAMPLE_SIZE, distinct_value_limit: int = 10,
+                 max_workers: int = 4):
+        """
+        Initialize the profiler.
+
+        Args:
+            sample_size: Rows kept per table; larger tables are sampled (default: 100000)
+            distinct_value_limit: List the values of columns with fewer distinct values than this (default: 10)
+            max_workers: Tables profiled at once (default: 4)
+        """
+        self.sample_size = sample_size
+        self.distinct_value_limit = distinct_value_limit
+        self.max_workers = max_workers
+
+    @staticmethod
+    def _rowid_span(conn: sqlite3.Connection, quoted: str) -> Optional[int]:
+        """Upper bound on a table's rows from its rowid range (None for WITHOUT ROWID or empty tables)."""
+        try:
+            # Separate queries: SQLite only answers a lone min() or max() with a B-tree seek
+            high = conn.execute(f"SELECT max(rowid) FROM {quoted}").fetchone()[0]
+            low = conn.execute(f"SELECT min(rowid) FROM {quoted}").fetchone()[0]
+        except sqlite3.OperationalError:
+            return None
+        if not isinstance(high, int) or not isinstance(low, int):
+            return None
+        return high - low + 1
+
+    def _scan(self, conn: sqlite3.Connection, quoted: str, modulus: int) -> Tuple[List[str], _RowSampler]:
+        """Stream a table once, counting every row and sampling about one in modulus."""
+        sampler = _RowSampler(self.sample_size)
+        keep = f"abs(random() % {modulus}) = 0" if modulus > 1 else "1"
+        conn.create_function(_COUNT_FUNCTION, 1, sampler.count)
+        try:
+            cursor = conn.execute(f"SELECT * FROM {quoted} WHERE {_COUNT_FUNCTION}({keep})")
+            columns = [description[0] for description in cursor.description]
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                sampler.add(rows)
+        finally:
+            conn.create_function(_COUNT_FUNCTION, 1, None)
+        return columns, sampler
+
+    def profile_table(self, conn: sqlite3.Connection, table: str) -> Dict[str, Any]:
+        """
+        Profile one table.
+
+        Args:
+            conn: Connection to the database
+            table: Table name
+
+        Returns:
+            Dictionary with row_count, sampled, column_values (low-cardinality
+            columns only) and column_stats (column -> {"distinct", "exact"})
+        """
+        quoted = _quote_identifier(table)
+        span = self._rowid_span(conn, quoted)
+        modulus = math.ceil(span / self.sample_size) if span and span > 0 else 1
+        columns, sampler = self._scan(conn, quoted, modulus)
+
+        # Sparse rowids overstated the size and the sample came up short: rescan at the true rate
+        if modulus > 1 and sampler.fetched < min(sampler.seen, self.sample_size) // 2:
+            columns, sampler = self._scan(conn, quoted, math.ceil(sampler.seen / self.sample_size))
+
+        row_count = sampler.seen
+        sampled = len(sampler.rows) < row_count
+        df = pd.DataFrame.from_records(sampler.rows, columns=columns)
+
+        column_values = {}
+        column_stats = {}
+        for i, column in enumerate(df.columns):
+            counts = df.iloc[:, i].dropna().value_counts(sort=False)
+            distinct = estimate_distinct(counts, len(df), row_count) if sampled else len(counts)
+            column_stats[column] = {"distinct": distinct, "exact": not sampled}
+
+            if len(counts) < self.distinct_value_limit and distinct < self.distinct_value_limit:
+                column_values[column] = sorted((_json_value(value) for value in counts.index), key=str)
+
+        return {
+            "row_count": row_count,
+            "sampled": sampled,
+            "column_values": column_values,
+            "column_stats": column_stats
+        }
+
+    def profile_tables(self, connect: Callable[[], ContextManager[sqlite3.Connection]],
+                       tables: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Profile several tables in parallel, each on its own connection.
+
+        Args:
+            connect: Function returning a context manager that yields a connection
+            tables: Table names
+
+        Returns:
+            Table name -> profile (see profile_table); tables that fail are left out
+        """
+        def run(table):
+            with connect() as conn:
+                return self.profile_table(conn, table)
+
+        profiles = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(tables))),
+                                thread_name_prefix="talk2sql-profiler") as executor:
+            futures = {table: executor.submit(run, table) for table in tables}
+            for table, future in futures.items():
+                try:
+                    profiles[table] = future.result()
+                except Exception as e:
+                    print(f"Error profiling table {table}: {e}")
+        return profiles
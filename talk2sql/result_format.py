@@ -0,0 +1,254 @@
+"""
+Wire formats for query results.
+
+Three formats are supported, chosen per request by the client:
+
+- ``records``: a list of row objects (the original format, one dict per row)
+- ``columnar``: column names and types once, then one value array per column;
+  low-cardinality string columns are optionally dictionary-encoded
+- ``arrow``: an Arrow IPC stream, base64-encoded (requires pyarrow)
+"""
+
+import base64
+import datetime
+import decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api import types as pdtypes
+
+RESULT_FORMATS = ("records", "columnar", "arrow")
+
+# Media type clients can send in Accept to ask for the Arrow format
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# String columns are dictionary-encoded when distinct values are at most this share of rows
+DICTIONARY_MAX_RATIO = 0.5
+
+
+def arrow_available() -> bool:
+    """Check whether pyarrow can be imported."""
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def negotiate_result_format(requested: Optional[str] = None, accept: Optional[str] = None,
+                            default: str = "records") -> str:
+    """
+    Pick the result format for a request.
+
+    An explicit ``format`` parameter wins over the Accept header. Arrow falls
+    back to columnar when pyarrow isn't installed, and unknown formats fall
+    back to the default.
+
+    Args:
+        requested: Format named by the client (e.g. the ``format`` request parameter)
+        accept: Value of the Accept header
+        default: Format used when the client doesn't ask for one
+
+    Returns:
+        One of RESULT_FORMATS
+    """
+    fmt = (requested or "").strip().lower()
+    if not fmt and accept and ARROW_STREAM_MEDIA_TYPE in accept:
+        fmt = "arrow"
+    if fmt not in RESULT_FORMATS:
+        fmt = default
+
+    if fmt == "arrow" and not arrow_available():
+        return "columnar"
+    return fmt
+
+
+def _json_value(value: Any) -> Any:
+    """Convert a single value that JSON can't represent natively."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode("utf-8")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+
+def _column_values(series: pd.Series) -> Tuple[str, List[Any]]:
+    """
+    Convert a column to a JSON-ready list, vectorized where the dtype allows.
+
+    Returns:
+        (type name, values) with missing values as None
+    """
+    missing = series.isna()
+    has_missing = bool(missing.any())
+
+    if pdtypes.is_bool_dtype(series):
+        type_name = "boolean"
+    elif pdtypes.is_integer_dtype(series):
+        type_name = "integer"
+    elif pdtypes.is_float_dtype(series):
+        type_name = "float"
+    elif pdtypes.is_datetime64_any_dtype(series):
+        values = series.dt.strftime("%Y-%m-%dT%H:%M:%S.%f").astype(object)
+        return "datetime", values.where(~missing, None).tolist()
+    elif pdtypes.is_string_dtype(series) and not pdtypes.is_object_dtype(series):
+        type_name = "string"
+    else:
+        # Object columns: SQLite allows mixed types, so check cell by cell
+        values = series.where(~missing, None).tolist() if has_missing else series.tolist()
+        kinds = set()
+        for i, value in enumerate(values):
+            if value is None or isinstance(value, (str, bool, int, float)):
+                kinds.add(type(value).__name__ if value is not None else None)
+            else:
+                kinds.add("binary" if isinstance(value, (bytes, bytearray, memoryview)) else "other")
+                values[i] = _json_value(value)
+        kinds.discard(None)
+        if kinds == {"str"}:
+            return "string", values
+        if kinds == {"binary"}:
+            return "binary", values
+        return "mixed", values
+
+    # astype(object) turns numpy scalars into Python ones in a single pass
+    values = series.astype(object)
+    if has_missing:
+        values = values.where(~missing, None)
+    if type_name == "float":
+        # NaN/inf aren't valid JSON
+        values = values.where(~values.isin([np.inf, -np.inf]), None)
+    return type_name, values.tolist()
+
+
+def _dictionary_encode(series: pd.Series) -> Optional[Tuple[List[Optional[int]], List[str]]]:
+    """Dictionary-encode a string column if it repeats enough; None if it isn't worth it."""
+    if len(series) == 0:
+        return None
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    if len(uniques) > len(series) * DICTIONARY_MAX_RATIO:
+        return None
+    codes = codes.astype(object)
+    codes[codes == -1] = None
+    return codes.tolist(), [str(value) for value in uniques]
+
+
+def to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Convert a DataFrame to a list of JSON-ready row dicts.
+
+    Args:
+        df: Query result
+
+    Returns:
+        One dict per row
+    """
+    columns = [str(column) for column in df.columns]
+    arrays = [_column_values(df.iloc[:, i])[1] for i in range(len(columns))]
+    return [dict(zip(columns, row)) for row in zip(*arrays)]
+
+
+def to_columnar(df: pd.DataFrame, dictionary_encode: bool = True) -> Dict[str, Any]:
+    """
+    Convert a DataFrame to the columnar format.
+
+    Args:
+        df: Query result
+        dictionary_encode: Whether to dictionary-encode repetitive string columns
+
+    Returns:
+        Dictionary with columns, types, data (one array per column) and
+        dictionaries (per column, the value list codes index into, or None)
+    """
+    types, data, dictionaries = [], [], []
+    for i in range(len(df.columns)):
+        type_name, values = _column_values(df.iloc[:, i])
+        dictionary = None
+        if dictionary_encode and type_name == "string":
+            encoded = _dictionary_encode(df.iloc[:, i])
+            if encoded is not None:
+                values, dictionary = encoded
+        types.append(type_name)
+        data.append(values)
+        dictionaries.append(dictionary)
+
+    return {
+        "columns": [str(column) for column in df.columns],
+        "types": types,
+        "data": data,
+        "dictionaries": dictionaries
+    }
+
+
+def to_arrow_base64(df: pd.DataFrame, dictionary_encode: bool = True) -> str:
+    """
+    Serialize a DataFrame as a base64-encoded Arrow IPC stream.
+
+    Args:
+        df: Query result
+        dictionary_encode: Whether to dictionary-encode repetitive string columns
+
+    Returns:
+        Base64 text of the IPC stream
+
+    Raises:
+        ImportError: If pyarrow is not installed
+    """
+    import pyarrow as pa
+
+    df = df.copy()
+    df.columns = [str(column) for column in df.columns]
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    if dictionary_encode:
+        for i, field in enumerate(table.schema):
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+                column = table.column(i)
+                if len(column) and column.unique().length <= len(column) * DICTIONARY_MAX_RATIO:
+                    table = table.set_column(i, field.name, column.dictionary_encode())
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue().to_pybytes()).decode("ascii")
+
+
+def encode_result(df: Optional[pd.DataFrame], fmt: str = "records",
+                  dictionary_encode: bool = True) -> Dict[str, Any]:
+    """
+    Encode a query result for a response body.
+
+    Args:
+        df: Query result (None = empty)
+        fmt: One of RESULT_FORMATS (see negotiate_result_format)
+        dictionary_encode: Whether columnar/arrow output dictionary-encodes strings
+
+    Returns:
+        Dictionary with "format" and "columns", plus "data" in the chosen format
+        (a list of rows, a columnar payload, or base64 Arrow IPC)
+    """
+    if df is None or not hasattr(df, "columns"):
+        df = pd.DataFrame()
+
+    if fmt == "arrow":
+        return {
+            "format": "arrow",
+            "encoding": "base64",
+            "media_type": ARROW_STREAM_MEDIA_TYPE,
+            "columns": [str(column) for column in df.columns],
+            "data": to_arrow_base64(df, dictionary_encode=dictionary_encode)
+        }
+
+    if fmt == "columnar":
+        payload = to_columnar(df, dictionary_encode=dictionary_encode)
+        return {"format": "columnar", **payload}
+
+    return {
+        "format": "records",
+        "columns": [str(column) for column in df.columns],
+        "data": to_records(df)
+    }
@@ -0,0 +1,453 @@
+"""
+Cached schema introspection for SQLite databases.
+
+A catalog (SchemaCatalog) describes every table of a database: its CREATE
+statement, typed columns, keys, foreign keys, row count, per-column distinct
+counts and the values of low-cardinality columns (see profiler.TableProfiler),
+and renders them as DDL, plain text or a tree. Building it
+scans the database, so catalogs are cached in memory and persisted in a JSON
+file next to the database. Both caches are keyed by the database fingerprint
+(path, size, mtime, PRAGMA schema_version), so any change to the file
+rebuilds the catalog, and reconnecting or restarting doesn't.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from talk2sql.connection_pool import SQLiteConnectionPool
+from talk2sql.profiler import TableProfiler, _quote_identifier
+
+# Bump when the catalog layout changes so old sidecar files are rebuilt
+CATALOG_FORMAT_VERSION = 2
+
+
+def introspect_schema(conn: sqlite3.Connection) -> Dict[str, Any]:
+    """
+    Read the table definitions of a SQLite database (no data is scanned).
+
+    Args:
+        conn: Connection to the database
+
+    Returns:
+        Dictionary with "tables": table name -> {"sql", "columns", "foreign_keys"}
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT name, sql
+        FROM sqlite_master
+        WHERE type='table' AND name NOT LIKE 'sqlite_%'
+        ORDER BY name
+    """)
+    table_rows = cursor.fetchall()
+
+    tables = {}
+    for table, create_sql in table_rows:
+        quoted = _quote_identifier(table)
+        try:
+            columns = [
+                {"name": row[1], "type": row[2], "notnull": row[3], "default": row[4], "pk": row[5]}
+                for row in cursor.execute(f"PRAGMA table_info({quoted})").fetchall()
+            ]
+            foreign_keys = [
+                {"column": row[3], "table": row[2], "to": row[4]}
+                for row in cursor.execute(f"PRAGMA foreign_key_list({quoted})").fetchall()
+            ]
+        except sqlite3.Error as e:
+            print(f"Error reading schema for table {table}: {e}")
+            continue
+
+        tables[table] = {"sql": create_sql, "columns": columns, "foreign_keys": foreign_keys}
+
+    return {"tables": tables}
+
+
+class Column:
+    """A table column with its declared type, key flags and profile."""
+
+    __slots__ = ("name", "type", "notnull", "default", "pk", "distinct", "distinct_exact", "values")
+
+    def __init__(self, name: str, type: str = "", notnull: bool = False, default: Any = None, pk: int = 0,
+                 distinct: Optional[int] = None, distinct_exact: bool = False, values: Optional[List[Any]] = None):
+        self.name = name
+        self.type = type or ""
+        self.notnull = bool(notnull)
+        self.default = default
+        # Position in the primary key (0 = not part of it)
+        self.pk = pk
+        self.distinct = distinct
+        self.distinct_exact = distinct_exact
+        # All values, for low-cardinality columns only
+        self.values = values
+
+    @property
+    def is_primary_key(self) -> bool:
+        return self.pk > 0
+
+
+class ForeignKey:
+    """A foreign key from a column to a column of another table."""
+
+    __slots__ = ("column", "table", "to")
+
+    def __init__(self, column: str, table: str, to: Optional[str] = None):
+        self.column = column
+        self.table = table
+        self.to = to
+
+    @property
+    def reference(self) -> str:
+        return f"{self.table}.{self.to}" if self.to else self.table
+
+
+class Table:
+    """A table with its CREATE statement, columns, foreign keys and row count."""
+
+    def __init__(self, name: str, sql: Optional[str], columns: List[Column], foreign_keys: List[ForeignKey],
+                 row_count: Optional[int] = None, sampled: bool = False):
+        self.name = name
+        self.sql = sql
+        self.columns = columns
+        self.foreign_keys = foreign_keys
+        self.row_count = row_count
+        self.sampled = sampled
+
+    @property
+    def column_names(self) -> List[str]:
+        return [column.name for column in self.columns]
+
+    @property
+    def primary_key(self) -> List[str]:
+        return [column.name for column in sorted(self.columns, key=lambda c: c.pk) if column.pk]
+
+    def ddl(self) -> str:
+        """CREATE statement followed by comments listing the columns and low-cardinality values."""
+        lines = [self.sql, f"-- Table {self.name} columns: {', '.join(self.column_names)}"]
+        for column in self.columns:
+            if column.values:
+                lines.append(f"-- Column {column.name} possible values: {', '.join(map(str, column.values))}")
+        return "\n\n".join(lines)
+
+
+class SchemaCatalog:
+    """
+    Typed schema of one database, rendered on demand into the formats consumers need.
+
+    Renderings are computed once per catalog; a changed database gets a new catalog.
+    """
+
+    def __init__(self, tables: Dict[str, Table], fingerprint: Tuple[Any, ...] = None):
+        """
+        Initialize a catalog.
+
+        Args:
+            tables: Table name -> Table, in display order
+            fingerprint: Database fingerprint the catalog was built for
+        """
+        self.tables = tables
+        self.fingerprint = fingerprint
+        self._rendered = {}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], fingerprint: Tuple[Any, ...] = None) -> "SchemaCatalog":
+        """
+        Build a catalog from introspect_schema output with profiles merged in.
+
+        Args:
+            data: Dictionary with "tables"
+            fingerprint: Database fingerprint the data was read at
+
+        Returns:
+            SchemaCatalog
+        """
+        tables = {}
+        for name, info in data["tables"].items():
+            stats = info.get("column_stats", {})
+            values = info.get("column_values", {})
+            columns = [
+                Column(
+                    column["name"], column.get("type"), column.get("notnull"), column.get("default"), column.get("pk", 0),
+                    distinct=stats.get(column["name"], {}).get("distinct"),
+                    distinct_exact=stats.get(column["name"], {}).get("exact", False),
+                    values=values.get(column["name"])
+                )
+                for column in info["columns"]
+            ]
+            foreign_keys = [ForeignKey(fk["column"], fk["table"], fk.get("to")) for fk in info["foreign_keys"]]
+            tables[name] = Table(name, info.get("sql"), columns, foreign_keys,
+                                 row_count=info.get("row_count"), sampled=info.get("sampled", False))
+        return cls(tables, fingerprint)
+
+    def _memoize(self, key, build):
+        """Return a rendering, building it on first use."""
+        if key not in self._rendered:
+            self._rendered[key] = build()
+        return self._rendered[key]
+
+    def table_names(self) -> List[str]:
+        """Get the table names in order."""
+        return list(self.tables)
+
+    def columns_by_table(self) -> Dict[str, List[str]]:
+        """Get the column names of every table."""
+        return self._memoize("columns", lambda: {name: table.column_names for name, table in self.tables.items()})
+
+    def neighbors(self) -> Dict[str, List[str]]:
+        """Get the tables joined to each table by a foreign key, in either direction."""
+        def build():
+            linked = {name: set() for name in self.tables}
+            for name, table in self.tables.items():
+                for fk in table.foreign_keys:
+                    if fk.table in linked and fk.table != name:
+                        linked[name].add(fk.table)
+                        linked[fk.table].add(name)
+            return {name: sorted(tables) for name, tables in linked.items()}
+
+        return self._memoize("neighbors", build)
+
+    def to_ddl(self) -> str:
+        """Render every table as its CREATE statement with column notes (used in prompts)."""
+        return self._memoize("ddl", lambda: "\n\n".join(
+            table.ddl() for table in self.tables.values() if table.sql is not None
+        ))
+
+    def table_chunks(self) -> List[Dict[str, Any]]:
+        """Get one {"table", "schema", "neighbors"} entry per table, for add_table_schemas."""
+        neighbors = self.neighbors()
+        return self._memoize("chunks", lambda: [
+            {"table": name, "schema": table.ddl(), "neighbors": neighbors[name]}
+            for name, table in self.tables.items() if table.sql is not None
+        ])
+
+    def to_text(self, count_tables: int = 3) -> str:
+        """
+        Render tables and typed columns as plain text.
+
+        Args:
+            count_tables: Number of leading tables to include row counts for
+        """
+        def build():
+            text = ""
+            for index, (name, table) in enumerate(self.tables.items()):
+                text += f"Table: {name}\n"
+                for column in table.columns:
+                    text += f"  - {column.name} ({column.type})\n"
+                text += "\n"
+                if index < count_tables and table.row_count is not None:
+                    text += f"  Count: {table.row_count} rows\n\n"
+            return text
+
+        return self._memoize(("text", count_tables), build)
+
+    def describe_tables(self, names: List[str]) -> str:
+        """
+        Render the columns of some tables, one line per table (unknown tables are skipped).
+
+        Args:
+            names: Table names
+        """
+        return "".join(
+            f"Table '{name}' columns: {', '.join(self.tables[name].column_names)}\n"
+            for name in dict.fromkeys(names) if name in self.tables
+        )
+
+    def to_tree(self) -> List[Dict[str, Any]]:
+        """Render tables and columns as a tree of nodes for the schema visualization."""
+        def build():
+            tree = []
+            for name, table in self.tables.items():
+                references = {fk.column: fk.reference for fk in table.foreign_keys}
+                children = []
+                for column in table.columns:
+                    node = {
+                        "id": f"column-{name}-{column.name}",
+                        "name": column.name,
+                        "type": "column",
+                        "dataType": column.type,
+                        "isPrimaryKey": column.is_primary_key,
+                        "isNullable": not column.notnull
+                    }
+                    if column.name in references:
+                        node["isForeignKey"] = True
+                        node["references"] = references[column.name]
+                    children.append(node)
+                tree.append({"id": f"table-{name}", "name": name, "type": "table", "children": children})
+            return tree
+
+        return self._memoize("tree", build)
+
+
+class SchemaCatalogCache:
+    """
+    Schema catalogs per database, cached in memory and in a sidecar JSON file.
+
+    The sidecar is written next to the database as ``<database>.catalog.json``;
+    if that directory isn't writable the catalog is only kept in memory.
+    """
+
+    def __init__(self, pool: SQLiteConnectionPool = None, persist: bool = True,
+                 profiler: TableProfiler = None):
+        """
+        Initialize the catalog cache.
+
+        Args:
+            pool: Connection pool to read databases through (default: open read-only connections directly)
+            persist: Whether to save catalogs next to their databases (default: True)
+            profiler: Table profiler for row counts and column statistics (default: TableProfiler())
+        """
+        self.pool = pool
+        self.persist = persist
+        self.profiler = profiler or TableProfiler()
+
+        self._lock = threading.Lock()
+        # One lock per database so a slow build doesn't block other databases
+        self._build_locks = {}
+        # path -> (fingerprint, catalog)
+        self._catalogs = {}
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.builds = 0
+
+    @staticmethod
+    def sidecar_path(path: str) -> str:
+        """Get the file a database's catalog is persisted to."""
+        return os.path.abspath(path) + ".catalog.json"
+
+    @contextmanager
+    def _connect(self, path: str):
+        """Borrow a read-only connection, from the pool if there is one."""
+        if self.pool is not None:
+            with self.pool.connection(path) as conn:
+                yield conn
+            return
+
+        conn = SQLiteConnectionPool._open(path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def fingerprint(self, path: str, conn: sqlite3.Connection = None) -> Tuple[Any, ...]:
+        """
+        Identify the current state of a database file.
+
+        Args:
+            path: Path to the SQLite database file
+            conn: Open connection to read the schema version with (optional)
+
+        Returns:
+            (path, size, mtime_ns, schema_version)
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        if conn is None:
+            with self._connect(path) as conn:
+                schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        else:
+            schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        return (path, stat.st_size, stat.st_mtime_ns, schema_version)
+
+    def _load(self, path: str, fingerprint: Tuple[Any, ...]) -> Optional[Dict[str, Any]]:
+        """Read a persisted catalog if it matches the fingerprint."""
+        try:
+            with open(self.sidecar_path(path), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if stored.get("format") != CATALOG_FORMAT_VERSION or tuple(stored.get("fingerprint", ())) != fingerprint:
+            return None
+        return stored.get("catalog")
+
+    def _save(self, path: str, fingerprint: Tuple[Any, ...], catalog: Dict[str, Any]):
+        """Persist a catalog next to its database (best effort)."""
+        target = self.sidecar_path(path)
+        temp = f"{target}.{os.getpid()}.tmp"
+        try:
+            with open(temp, "w", encoding="utf-8") as f:
+                json.dump({"format": CATALOG_FORMAT_VERSION, "fingerprint": list(fingerprint), "catalog": catalog}, f)
+            os.replace(temp, target)
+        except OSError as e:
+            print(f"Could not persist schema catalog for {path}: {e}")
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+    def get(self, path: str) -> SchemaCatalog:
+        """
+        Get the schema catalog of a database, building it only if the database changed.
+
+        Args:
+            path: Path to the SQLite database file
+
+        Returns:
+            SchemaCatalog
+        """
+        path = os.path.abspath(path)
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(path, threading.Lock())
+
+        with build_lock:
+            with self._connect(path) as conn:
+                fingerprint = self.fingerprint(path, conn)
+
+                cached = self._catalogs.get(path)
+                if cached is not None and cached[0] == fingerprint:
+                    self.memory_hits += 1
+                    return cached[1]
+
+                catalog = self._load(path, fingerprint) if self.persist else None
+                loaded = catalog is not None
+                if not loaded:
+                    catalog = introspect_schema(conn)
+
+            if loaded:
+                self.disk_hits += 1
+            else:
+                # Profile after giving the connection back; each table borrows its own
+                profiles = self.profiler.profile_tables(lambda: self._connect(path), list(catalog["tables"]))
+                for table, table_info in catalog["tables"].items():
+                    table_info.update(profiles.get(table, {
+                        "row_count": None, "sampled": False, "column_values": {}, "column_stats": {}
+                    }))
+                self.builds += 1
+                if self.persist:
+                    self._save(path, fingerprint, catalog)
+
+            schema = SchemaCatalog.from_dict(catalog, fingerprint)
+            self._catalogs[path] = (fingerprint, schema)
+            return schema
+
+    def invalidate(self, path: str = None):
+        """
+        Forget cached catalogs (persisted files are revalidated by fingerprint on next use).
+
+        Args:
+            path: Only forget this database (None = all)
+        """
+        with self._lock:
+            if path is None:
+                self._catalogs.clear()
+            else:
+                self._catalogs.pop(os.path.abspath(path), None)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get cache counters.
+
+        Returns:
+            Dictionary with memory hits, disk hits, builds and cached databases
+        """
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "builds": self.builds,
+                "databases": len(self._catalogs)
+            }
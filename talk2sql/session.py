@@ -0,0 +1,121 @@
+"""
+Request-scoped query sessions.
+
+A QuerySession carries the per-request state that used to be patched onto a
+shared Talk2SQL instance (the SQL runner, the vector collections and the
+history flag). While a session is active, the engine reads those settings from
+the session instead of its own attributes, so concurrent requests on one
+instance don't see each other's connection or options.
+"""
+
+import contextvars
+from typing import Callable, Optional
+
+import pandas as pd
+
+# The session active in the current thread/context (None = use engine defaults)
+_current_session = contextvars.ContextVar("talk2sql_query_session", default=None)
+
+
+class QuerySession:
+    """Per-request connection, collection names and options for smart_query."""
+
+    def __init__(self,
+                 run_sql: Callable[[str], pd.DataFrame] = None,
+                 connection=None,
+                 questions_collection: str = None,
+                 schema_collection: str = None,
+                 docs_collection: str = None,
+                 save_query_history: bool = None,
+                 query_timeout: float = None,
+                 max_result_rows: int = None,
+                 database_path: str = None):
+        """
+        Initialize a query session. Settings left as None fall back to the engine's.
+
+        Args:
+            run_sql: Function that runs SQL and returns a DataFrame
+            connection: DB-API connection to run SQL on (used if run_sql is not given)
+            questions_collection: Name of the questions collection
+            schema_collection: Name of the schema collection
+            docs_collection: Name of the documentation collection
+            save_query_history: Whether to record this request in the query history
+            query_timeout: Seconds each SQL query may run before it is cancelled
+            max_result_rows: Maximum rows kept from each query result
+            database_path: File of the database run_sql queries (looked up once if not given)
+        """
+        if run_sql is None and connection is not None:
+            def run_sql(sql_query):
+                return pd.read_sql_query(sql_query, connection)
+
+        self.run_sql = run_sql
+        self.connection = connection
+        self.questions_collection = questions_collection
+        self.schema_collection = schema_collection
+        self.docs_collection = docs_collection
+        self.save_query_history = save_query_history
+        self.query_timeout = query_timeout
+        self.max_result_rows = max_result_rows
+        self.database_path = database_path
+
+    def activate(self):
+        """Make this the current session; returns a token for deactivate()."""
+        return _current_session.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        """Restore the session that was current before activate()."""
+        _current_session.reset(token)
+
+
+def get_current_session() -> Optional[QuerySession]:
+    """Get the session active in the current context, if any."""
+    return _current_session.get()
+
+
+def _session_property(name: str):
+    """
+    Build a property that reads a setting from the active session, falling back to the engine.
+
+    Assignments always set the engine-wide default.
+    """
+    default_name = f"_default_{name}"
+
+    def getter(self):
+        session = _current_session.get()
+        if session is not None:
+            value = getattr(session, name)
+            if value is not None:
+                return value
+        try:
+            return self.__dict__[default_name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def setter(self, value):
+        self.__dict__[default_name] = value
+
+    return property(getter, setter)
+
+
+class SessionAwareMixin:
+    """Routes session-overridable engine attributes through the active QuerySession."""
+
+    run_sql = _session_property("run_sql")
+    questions_collection = _session_property("questions_collection")
+    schema_collection = _session_property("schema_collection")
+    docs_collection = _session_property("docs_collection")
+    save_query_history = _session_property("save_query_history")
+    query_timeout = _session_property("query_timeout")
+    max_result_rows = _session_property("max_result_rows")
+
+    @property
+    def run_sql_is_set(self) -> bool:
+        session = _current_session.get()
+        if session is not None and session.run_sql is not None:
+            return True
+        return self.__dict__.get("_default_run_sql_is_set", False)
+
+    @run_sql_is_set.setter
+    def run_sql_is_set(self, value: bool):
+        self.__dict__["_default_run_sql_is_set"] = value
@@ -0,0 +1,455 @@
+"""
+Streaming latency quantiles.
+
+Stage latencies are added to DDSketches, one per database, stage and time
+bucket. A DDSketch keeps counts in logarithmic bins, so every quantile it
+reports is within ``relative_accuracy`` of the true value. Two sketches merge
+by adding bin counts, which makes any window of buckets (and the sketches of
+several worker processes) cheap to combine.
+
+Each process only holds the latencies recorded since its last checkpoint.
+Checkpoints merge them into the ``latency_sketches`` table of the history
+database, one row per database, stage and bucket shared by every worker.
+Recent buckets are hourly; each checkpoint also folds every row older than
+``compact_after`` into a daily row, so the table stays small however long
+the workers run. Reads merge the table with this process's pending
+latencies.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from talk2sql.json_encoding import dumps, loads
+
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+
+# (database, stage, bucket start, bucket width in seconds)
+SketchKey = Tuple[str, str, int, int]
+
+
+class DDSketch:
+    """Mergeable quantile sketch with relative-error guarantees."""
+
+    __slots__ = ("relative_accuracy", "gamma", "_log_gamma", "bins", "zero_count",
+                 "count", "sum", "min", "max")
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        """
+        Initialize an empty sketch.
+
+        Args:
+            relative_accuracy: Maximum relative error of reported quantiles (default: 0.01)
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, count: int = 1):
+        """Add a non-negative value (negative values are ignored)."""
+        if value is None or value < 0 or count <= 0:
+            return
+        if value == 0:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def remove(self, value: float, count: int = 1):
+        """
+        Take back values added earlier, here or in a sketch this one will be merged into.
+
+        Bins may go negative, so a sketch of pending changes can carry
+        removals; min and max are left as they were (they stay bounds).
+        """
+        if value is None or value < 0 or count <= 0:
+            return
+        if value == 0:
+            self.zero_count -= count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            remaining = self.bins.get(index, 0) - count
+            if remaining:
+                self.bins[index] = remaining
+            else:
+                self.bins.pop(index, None)
+        self.count -= count
+        self.sum -= value * count
+
+    def clamp(self):
+        """Drop bins left negative by removals of values that were never added."""
+        self.bins = {index: count for index, count in self.bins.items() if count > 0}
+        self.zero_count = max(self.zero_count, 0)
+        self.count = self.zero_count + sum(self.bins.values())
+        if self.count == 0:
+            self.sum = 0.0
+            self.min = math.inf
+            self.max = -math.inf
+
+    def merge(self, other: "DDSketch"):
+        """
+        Add another sketch's values to this one.
+
+        Raises:
+            ValueError: If the sketches have different accuracies
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile.
+
+        Args:
+            q: Quantile between 0 and 1
+
+        Returns:
+            Estimated value, or None for an empty sketch
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            if self.bins[index] <= 0:
+                continue
+            seen += self.bins[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        """Exact mean of the added values, or None for an empty sketch."""
+        return self.sum / self.count if self.count else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize to a JSON-ready dictionary."""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "bins": self.bins,
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "DDSketch":
+        """Rebuild a sketch from to_dict output."""
+        sketch = cls(data["relative_accuracy"])
+        sketch.bins = {int(index): count for index, count in data["bins"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        if sketch.count:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        return sketch
+
+
+class LatencySketches:
+    """Per-database, per-stage, per-time-bucket DDSketches, shared by workers through checkpoints."""
+
+    def __init__(self, db_path: str = None, relative_accuracy: float = 0.01,
+                 bucket_seconds: int = 3600, compact_after: int = 2 * 86400,
+                 compacted_bucket_seconds: int = 86400, checkpoint_interval: float = 60.0):
+        """
+        Initialize the sketch store.
+
+        Args:
+            db_path: History database holding checkpoints (None = memory only)
+            relative_accuracy: Maximum relative error of reported quantiles (default: 0.01)
+            bucket_seconds: Width of recent buckets (default: 1 hour)
+            compact_after: Age in seconds after which buckets are merged into wider ones (default: 2 days)
+            compacted_bucket_seconds: Width of compacted buckets (default: 1 day)
+            checkpoint_interval: Seconds between checkpoints (default: 60)
+        """
+        self.db_path = db_path
+        self.relative_accuracy = relative_accuracy
+        self.bucket_seconds = bucket_seconds
+        self.compact_after = compact_after
+        self.compacted_bucket_seconds = compacted_bucket_seconds
+        self.checkpoint_interval = checkpoint_interval
+
+        # Latencies recorded since the last checkpoint (all of them without db_path)
+        self._pending: Dict[SketchKey, DDSketch] = {}
+        self._last_checkpoint = time.monotonic()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def create_tables(conn: sqlite3.Connection):
+        """Create the checkpoint table."""
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS latency_sketches (
+                database TEXT,
+                stage TEXT,
+                start INTEGER,
+                width INTEGER,
+                sketch BLOB,
+                PRIMARY KEY (database, stage, start, width)
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_latency_sketches_start ON latency_sketches(start)")
+
+    def _bucket(self, timestamp: float, now: float) -> Tuple[int, int]:
+        """(start, width) of the bucket holding a timestamp, compacted if it is already old."""
+        width = self.bucket_seconds
+        if timestamp + width <= now - self.compact_after:
+            width = self.compacted_bucket_seconds
+        return int(timestamp // width * width), width
+
+    def record(self, database: Optional[str], latencies: Dict[str, Optional[float]],
+               timestamp: float = None, count: int = 1):
+        """
+        Add (or with count=-1, remove) one query's stage latencies.
+
+        Args:
+            database: Database the query ran against ("" or None if unknown)
+            latencies: Stage -> latency in milliseconds (missing stages are skipped)
+            timestamp: Unix time of the query (default: now)
+            count: Occurrences to add, negative to remove
+        """
+        now = time.time()
+        start, width = self._bucket(now if timestamp is None else timestamp, now)
+        with self._lock:
+            for stage, ms in latencies.items():
+                if ms is None:
+                    continue
+                key = (database or "", stage, start, width)
+                sketch = self._pending.get(key)
+                if sketch is None:
+                    sketch = self._pending[key] = DDSketch(self.relative_accuracy)
+                if count < 0:
+                    sketch.remove(ms, -count)
+                else:
+                    sketch.add(ms, count)
+
+    def _compact(self, now: float):
+        """Merge pending buckets older than compact_after into compacted buckets (lock held)."""
+        width = self.compacted_bucket_seconds
+        cutoff = now - self.compact_after
+        for key in [key for key in self._pending if key[3] < width and key[2] + key[3] <= cutoff]:
+            database, stage, start, _ = key
+            target = (database, stage, int(start // width * width), width)
+            sketch = self._pending.pop(key)
+            if target in self._pending:
+                self._pending[target].merge(sketch)
+            else:
+                self._pending[target] = sketch
+
+    def checkpoint_due(self) -> bool:
+        """Whether checkpoint_interval has passed since the last checkpoint."""
+        return time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+
+    def take_checkpoint(self) -> Optional[Callable[[sqlite3.Connection], None]]:
+        """
+        Hand over the pending latencies for merging into the checkpoint table.
+
+        Without db_path the pending sketches are the whole store; they are only
+        compacted in memory.
+
+        Returns:
+            Function merging them (and compacting old rows)
+            through a connection, e.g. via HistoryWriter.submit_write; None if
+            there is nothing to write
+        """
+        now = time.time()
+        with self._lock:
+            self._last_checkpoint = time.monotonic()
+            if not self.db_path:
+                self._compact(now)
+                return None
+            if not self._pending:
+                return None
+            pending = self._pending
+            self._pending = {}
+
+        def write(conn: sqlite3.Connection):
+            # Rows are read, merged and rewritten; take the write lock before reading
+            # so another worker's checkpoint can't interleave
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            for key, sketch in pending.items():
+                self._merge_row(conn, key, sketch)
+            self._compact_rows(conn, now)
+        return write
+
+    def _merge_row(self, conn: sqlite3.Connection, key: SketchKey, sketch: DDSketch):
+        """Merge a sketch into the row of a bucket (inside the checkpoint transaction)."""
+        row = conn.execute(
+            "SELECT sketch FROM latency_sketches WHERE database = ? AND stage = ? AND start = ? AND width = ?",
+            key
+        ).fetchone()
+        if row is not None:
+            stored = DDSketch.from_dict(loads(row[0]))
+            if stored.relative_accuracy == sketch.relative_accuracy:
+                stored.merge(sketch)
+                sketch = stored
+        sketch.clamp()
+        if sketch.count == 0:
+            conn.execute(
+                "DELETE FROM latency_sketches WHERE database = ? AND stage = ? AND start = ? AND width = ?",
+                key
+            )
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO latency_sketches (database, stage, start, width, sketch) "
+            "VALUES (?, ?, ?, ?, ?)",
+            key + (dumps(sketch.to_dict()),)
+        )
+
+    def _compact_rows(self, conn: sqlite3.Connection, now: float):
+        """Fold rows older than compact_after into compacted rows, whichever worker wrote them."""
+        width = self.compacted_bucket_seconds
+        cutoff = now - self.compact_after
+        rows = conn.execute(
+            "SELECT database, stage, start, width, sketch FROM latency_sketches "
+            "WHERE width < ? AND start + width <= ?",
+            (width, cutoff)
+        ).fetchall()
+
+        folded: Dict[SketchKey, DDSketch] = {}
+        for database, stage, start, row_width, data in rows:
+            conn.execute(
+                "DELETE FROM latency_sketches WHERE database = ? AND stage = ? AND start = ? AND width = ?",
+                (database, stage, start, row_width)
+            )
+            sketch = DDSketch.from_dict(loads(data))
+            key = (database, stage, int(start // width * width), width)
+            if key not in folded:
+                folded[key] = DDSketch(sketch.relative_accuracy)
+            if folded[key].relative_accuracy == sketch.relative_accuracy:
+                folded[key].merge(sketch)
+
+        for key, sketch in folded.items():
+            self._merge_row(conn, key, sketch)
+
+    def _checkpointed(self, since: Optional[float], until: Optional[float],
+                      database: Optional[str]) -> Iterable[Tuple[str, DDSketch]]:
+        """Checkpointed sketches overlapping a window, as (stage, sketch)."""
+        if not self.db_path or not os.path.exists(self.db_path):
+            return []
+
+        conditions = ["1 = 1"]
+        params = []
+        if since is not None:
+            conditions.append("start + width > ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("start < ?")
+            params.append(until)
+        if database is not None:
+            conditions.append("database = ?")
+            params.append(database)
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(
+                f"SELECT stage, sketch FROM latency_sketches WHERE {' AND '.join(conditions)}", params
+            ).fetchall()
+        except sqlite3.OperationalError:
+            # No checkpoints yet
+            return []
+        finally:
+            conn.close()
+        return [(stage, DDSketch.from_dict(loads(sketch))) for stage, sketch in rows]
+
+    def merged(self, since: float = None, until: float = None,
+               database: str = None) -> Dict[str, DDSketch]:
+        """
+        Merge the sketches of a window into one sketch per stage.
+
+        Buckets partly inside the window are included whole, so the window is
+        effectively widened to bucket boundaries. Other workers' latencies
+        appear once they have checkpointed.
+
+        Args:
+            since: Window start as Unix time (None = unbounded)
+            until: Window end as Unix time (None = unbounded)
+            database: Only this database (None = all databases)
+
+        Returns:
+            Stage -> merged sketch
+        """
+        merged: Dict[str, DDSketch] = {}
+
+        def add(stage, sketch):
+            if stage not in merged:
+                merged[stage] = DDSketch(self.relative_accuracy)
+            merged[stage].merge(sketch)
+
+        with self._lock:
+            for (db, stage, start, width), sketch in self._pending.items():
+                if since is not None and start + width <= since:
+                    continue
+                if until is not None and start >= until:
+                    continue
+                if database is not None and db != database:
+                    continue
+                add(stage, sketch)
+
+        for stage, sketch in self._checkpointed(since, until, database):
+            if sketch.relative_accuracy == self.relative_accuracy:
+                add(stage, sketch)
+
+        for sketch in merged.values():
+            sketch.clamp()
+        return merged
+
+    def quantiles(self, since: float = None, until: float = None, database: str = None,
+                  quantiles: Iterable[float] = DEFAULT_QUANTILES) -> Dict[str, Dict[str, Any]]:
+        """
+        Latency quantiles per stage over a window.
+
+        Args:
+            since: Window start as Unix time (None = unbounded)
+            until: Window end as Unix time (None = unbounded)
+            database: Only this database (None = all databases)
+            quantiles: Quantiles between 0 and 1 (default: p50, p95, p99)
+
+        Returns:
+            Stage -> {"count", "mean_ms", "p50_ms", ...}
+        """
+        result = {}
+        for stage, sketch in self.merged(since, until, database).items():
+            summary = {"count": sketch.count, "mean_ms": sketch.mean}
+            for q in quantiles:
+                summary[f"p{q * 100:g}_ms"] = sketch.quantile(q)
+            result[stage] = summary
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get store counters.
+
+        Returns:
+            Dictionary with the sketches held in memory (awaiting a checkpoint,
+            or all of them without a history database)
+        """
+        with self._lock:
+            return {"pending": len(self._pending)}
@@ -0,0 +1,63 @@
+"""
+Concurrent execution of independent pipeline stages.
+"""
+
+import contextvars
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class StageScheduler:
+    """Runs independent pipeline stages in parallel on a bounded thread pool."""
+
+    def __init__(self, max_workers: int = 3):
+        """
+        Initialize StageScheduler.
+
+        Args:
+            max_workers: Maximum number of stages running at once
+        """
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="talk2sql-stage")
+
+    def _run_stage(self, func: Callable[[], Any]) -> Dict[str, Any]:
+        """Run one stage, capturing its result, error and start/end times."""
+        start = datetime.datetime.now()
+        try:
+            result, error = func(), None
+        except Exception as e:
+            result, error = None, e
+        end = datetime.datetime.now()
+
+        return {
+            "result": result,
+            "error": error,
+            "start": start,
+            "end": end,
+            "ms": (end - start).total_seconds() * 1000
+        }
+
+    def run(self, stages: Dict[str, Callable[[], Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Run stages concurrently and wait for all of them.
+
+        A failing stage doesn't affect the others; its exception is returned
+        in its "error" field instead of being raised.
+
+        Args:
+            stages: Mapping of stage name to a zero-argument callable
+
+        Returns:
+            Mapping of stage name to {"result", "error", "start", "end", "ms"}
+        """
+        # Each stage runs in a copy of the caller's context so the active query session carries over
+        futures = {
+            name: self._executor.submit(contextvars.copy_context().run, self._run_stage, func)
+            for name, func in stages.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+    def shutdown(self):
+        """Stop the worker threads."""
+        self._executor.shutdown(wait=True)
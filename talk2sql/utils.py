@@ -32,6 +32,75 @@ def deterministic_uuid(content: Union[str, bytes]) -> str:
     return content_uuid
 
 
+class FallbackEmbedding(list):
+    """
+    Hash-based placeholder vector returned when the embeddings API fails.
+    
+    Vector stores flag points stored with one (payload "fallback_embedding"),
+    so skip-existing checks embed them again instead of keeping them forever.
+    """
+
+
+def fallback_payload(payload: Dict[str, Any], embedding: List[float]) -> Dict[str, Any]:
+    """
+    Flag a point payload whose vector is a FallbackEmbedding.
+    
+    Args:
+        payload: Payload to store
+        embedding: Vector stored with it
+        
+    Returns:
+        The payload, with "fallback_embedding": True added for placeholder vectors
+    """
+    if isinstance(embedding, FallbackEmbedding):
+        return {**payload, "fallback_embedding": True}
+    return payload
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimate the number of tokens in a text (about 4 characters per token).
+    
+    Args:
+        text: Text to estimate
+        
+    Returns:
+        Estimated token count
+    """
+    return len(text) // 4 + 1
+
+
+def chunk_texts(texts: List[str], max_items: int, max_tokens: int) -> List[List[int]]:
+    """
+    Split texts into batches bounded by item count and estimated token count.
+    
+    Args:
+        texts: Texts to split
+        max_items: Maximum number of texts per batch
+        max_tokens: Maximum estimated tokens per batch
+        
+    Returns:
+        List of batches, each a list of indexes into texts
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+        
+    if current:
+        batches.append(current)
+        
+    return batches
+
+
 def extract_tables_from_sql(sql: str) -> List[str]:
     """
     Extract table names from a SQL query.
@@ -1,3 +1,4 @@
 from talk2sql.vector_store.qdrant import QdrantVectorStore
+from talk2sql.vector_store.local import LocalVectorStore
 
-__all__ = ['QdrantVectorStore']
+__all__ = ['QdrantVectorStore', 'LocalVectorStore']
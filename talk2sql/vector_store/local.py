@@ -0,0 +1,531 @@
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+
+from .base import Talk2SQLBase
+from talk2sql.utils import deterministic_uuid, fallback_payload
+
+
+class _LocalCollection:
+    """
+    A single collection of vectors kept in one contiguous float32 matrix.
+
+    Rows are L2-normalised on insert so cosine similarity is a plain dot
+    product. When a directory is given, the matrix lives in a memory-mapped
+    file and IDs/payloads are stored next to it as JSON.
+    """
+
+    def __init__(self, name: str, dim: int, directory: str = None, initial_capacity: int = 1024):
+        self.name = name
+        self.dim = dim
+        self.directory = directory
+        self.initial_capacity = initial_capacity
+
+        self.ids = []
+        self.payloads = []
+        self.index = {}
+        self.count = 0
+        self.matrix = None
+
+        if directory:
+            self.vectors_path = os.path.join(directory, f"{name}.f32")
+            self.meta_path = os.path.join(directory, f"{name}.json")
+            self._load()
+
+        if self.matrix is None:
+            self.matrix = self._allocate(initial_capacity)
+
+    def _allocate(self, capacity: int) -> np.ndarray:
+        """Allocate an empty matrix (memory-mapped if the collection is persistent)."""
+        if self.directory:
+            return np.memmap(self.vectors_path, dtype=np.float32, mode="w+", shape=(capacity, self.dim))
+        return np.zeros((capacity, self.dim), dtype=np.float32)
+
+    def _load(self):
+        """Load IDs, payloads and the vector matrix from disk, if present."""
+        if not (os.path.exists(self.meta_path) and os.path.exists(self.vectors_path)):
+            return
+
+        try:
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+
+            if meta.get("dim") != self.dim:
+                print(f"Embedding size changed for local collection {self.name}, starting empty")
+                return
+
+            capacity = os.path.getsize(self.vectors_path) // (4 * self.dim)
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+            self.ids = meta["ids"]
+            self.payloads = meta["payloads"]
+            self.count = len(self.ids)
+            self.index = {point_id: row for row, point_id in enumerate(self.ids)}
+        except Exception as e:
+            print(f"Error loading local collection {self.name}, starting empty: {e}")
+            self.ids, self.payloads, self.index, self.count, self.matrix = [], [], {}, 0, None
+
+    def _ensure_capacity(self, needed: int):
+        """Grow the matrix geometrically so appends are amortised O(1)."""
+        capacity = self.matrix.shape[0]
+        if needed <= capacity:
+            return
+
+        # A zero-row matrix (initial_capacity=0 or an empty file on disk) would never grow
+        capacity = max(capacity, 1)
+        while capacity < needed:
+            capacity *= 2
+
+        old = np.array(self.matrix[:self.count])
+        if isinstance(self.matrix, np.memmap):
+            del self.matrix
+        self.matrix = self._allocate(capacity)
+        self.matrix[:self.count] = old
+
+    def flush(self):
+        """Persist the matrix and metadata (no-op for in-memory collections)."""
+        if not self.directory:
+            return
+
+        self.matrix.flush()
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "ids": self.ids, "payloads": self.payloads}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def upsert(self, points: List[Tuple[str, List[float], dict]]):
+        """
+        Insert or overwrite points.
+
+        Args:
+            points: List of (id, vector, payload) tuples
+        """
+        if not points:
+            return
+
+        vectors = np.asarray([vector for _, vector, _ in points], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+
+        self._ensure_capacity(self.count + len(points))
+        for (point_id, _, payload), vector in zip(points, vectors):
+            row = self.index.get(point_id)
+            if row is None:
+                row = self.count
+                self.index[point_id] = row
+                self.ids.append(point_id)
+                self.payloads.append(payload)
+                self.count += 1
+            else:
+                self.payloads[row] = payload
+            self.matrix[row] = vector
+
+        self.flush()
+
+    def delete(self, point_id: str) -> bool:
+        """
+        Delete a point by moving the last row into its slot.
+
+        Args:
+            point_id: ID of the point
+
+        Returns:
+            True if the point existed
+        """
+        row = self.index.pop(point_id, None)
+        if row is None:
+            return False
+
+        last = self.count - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.ids[row] = self.ids[last]
+            self.payloads[row] = self.payloads[last]
+            self.index[self.ids[row]] = row
+        self.ids.pop()
+        self.payloads.pop()
+        self.count = last
+
+        self.flush()
+        return True
+
+    def search(self, embedding: List[float], limit: int) -> List[dict]:
+        """
+        Brute-force top-k cosine search.
+
+        Args:
+            embedding: Query embedding
+            limit: Number of results
+
+        Returns:
+            Payloads of the best matches, highest score first
+        """
+        if self.count == 0 or limit <= 0:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        scores = self.matrix[:self.count] @ query
+        if limit < self.count:
+            top = np.argpartition(-scores, limit)[:limit]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)
+
+        return [self.payloads[row] for row in top]
+
+    def reset(self):
+        """Remove all points."""
+        self.ids, self.payloads, self.index, self.count = [], [], {}, 0
+        if isinstance(self.matrix, np.memmap):
+            del self.matrix
+        self.matrix = self._allocate(self.initial_capacity)
+        self.flush()
+
+
+class LocalVectorStore(Talk2SQLBase):
+    """In-process vector store using NumPy brute-force search, with optional memory-mapped persistence."""
+
+    def __init__(self, config=None):
+        """
+        Initialize local vector store.
+
+        Args:
+            config: Configuration dictionary with options:
+                - local_vector_path: Directory for memory-mapped storage (None = in-memory only)
+                - embedding_size: Size of embedding vectors
+                - questions_collection: Name for questions collection
+                - schema_collection: Name for schema collection
+                - docs_collection: Name for documentation collection
+                - n_results: Number of results to return (default: 5)
+                - max_schema_neighbors: Max foreign-key neighbour tables added to schema results (default: 10)
+        """
+        super().__init__(config)
+        config = config or {}
+
+        # Get configuration values
+        self.embedding_size = config.get("embedding_size", 1536)  # Default size for OpenAI embeddings
+        self.n_results = config.get("n_results", 5)
+        self.local_vector_path = config.get("local_vector_path")
+        self.max_schema_neighbors = config.get("max_schema_neighbors", 10)
+
+        # Collection names
+        self.questions_collection = config.get("questions_collection", "Talk2SQL_questions")
+        self.schema_collection = config.get("schema_collection", "Talk2SQL_schema")
+        self.docs_collection = config.get("docs_collection", "Talk2SQL_docs")
+
+        if self.local_vector_path:
+            os.makedirs(self.local_vector_path, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._setup_collections()
+
+    def _setup_collections(self):
+        """Open (or create) the three collections."""
+        self.collections: Dict[str, _LocalCollection] = {
+            name: _LocalCollection(name, self.embedding_size, self.local_vector_path)
+            for name in (self.questions_collection, self.schema_collection, self.docs_collection)
+        }
+
+    def _get_collection(self, name: str) -> _LocalCollection:
+        """Get a collection by name, opening it on first use (e.g. names from a query session)."""
+        collection = self.collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self.collections.get(name)
+                if collection is None:
+                    collection = _LocalCollection(name, self.embedding_size, self.local_vector_path)
+                    self.collections[name] = collection
+        return collection
+
+    def _generate_deterministic_id(self, content: str) -> str:
+        """Generate a deterministic ID from content (same scheme as QdrantVectorStore)."""
+        return deterministic_uuid(content)
+
+    def add_question_sql(self, question: str, sql: str) -> str:
+        """
+        Add question-SQL pair to vector store.
+
+        Args:
+            question: Natural language question
+            sql: Corresponding SQL query
+
+        Returns:
+            ID of the stored entry
+        """
+        point_id = self._generate_deterministic_id(f"Question: {question}\nSQL: {sql}")
+        embedding = self.generate_embedding(question)
+
+        with self._lock:
+            self._get_collection(self.questions_collection).upsert(
+                [(point_id, embedding, fallback_payload({"question": question, "sql": sql}, embedding))]
+            )
+
+        return f"{point_id}-q"
+
+    def add_question_sql_batch(self, examples: List[Tuple[str, str]], skip_existing: bool = True) -> List[str]:
+        """
+        Add many question-SQL pairs with batched embeddings and a single write.
+
+        Args:
+            examples: List of (question, sql) tuples
+            skip_existing: Don't re-embed pairs already in the collection
+
+        Returns:
+            IDs of the stored entries, in input order
+        """
+        ids = []
+        points = {}
+        for question, sql in examples:
+            point_id = self._generate_deterministic_id(f"Question: {question}\nSQL: {sql}")
+            ids.append(f"{point_id}-q")
+            points[point_id] = {"question": question, "sql": sql}
+
+        collection = self._get_collection(self.questions_collection)
+        # Points stored with a fallback (hash) vector are embedded again
+        point_ids = [
+            pid for pid in points
+            if not (skip_existing and pid in collection.index
+                    and not collection.payloads[collection.index[pid]].get("fallback_embedding"))
+        ]
+        if not point_ids:
+            return ids
+
+        embeddings = self.generate_embeddings([points[pid]["question"] for pid in point_ids])
+
+        with self._lock:
+            collection.upsert([
+                (pid, embedding, fallback_payload(points[pid], embedding))
+                for pid, embedding in zip(point_ids, embeddings)
+            ])
+
+        return ids
+
+    def add_schema(self, schema: str) -> str:
+        """
+        Add database schema to vector store.
+
+        Args:
+            schema: Database schema (DDL)
+
+        Returns:
+            ID of the stored entry
+        """
+        point_id = self._generate_deterministic_id(schema)
+        embedding = self.generate_embedding(schema)
+
+        with self._lock:
+            self._get_collection(self.schema_collection).upsert([(point_id, embedding, {"schema": schema})])
+
+        return f"{point_id}-s"
+
+    def add_table_schemas(self, tables: List[dict]) -> List[str]:
+        """
+        Add schema as one point per table, with foreign-key neighbours in the payload.
+
+        tables is the whole catalog: points of tables not in it (e.g. dropped since
+        the last indexing) are deleted from the schema collection.
+
+        Args:
+            tables: List of dicts with "table" (name), "schema" (DDL and notes) and
+                "neighbors" (names of tables it joins to)
+
+        Returns:
+            IDs of the stored entries
+        """
+        if not tables:
+            return []
+
+        # Keyed by collection and table, so re-training a changed table replaces its point
+        point_ids = [
+            self._generate_deterministic_id(f"{self.schema_collection}:{table['table']}")
+            for table in tables
+        ]
+        embeddings = self.generate_embeddings([table["schema"] for table in tables])
+
+        with self._lock:
+            collection = self._get_collection(self.schema_collection)
+            collection.upsert([
+                (point_id, embedding, {
+                    "schema": table["schema"],
+                    "table": table["table"],
+                    "neighbors": list(table.get("neighbors", []))
+                })
+                for point_id, embedding, table in zip(point_ids, embeddings, tables)
+            ])
+
+            # Per-table points whose table is gone; whole-schema points (no "table") are kept
+            names = {table["table"] for table in tables}
+            stale = [
+                point_id for point_id, payload in zip(collection.ids, collection.payloads)
+                if payload.get("table") is not None and payload["table"] not in names
+            ]
+            for point_id in stale:
+                collection.delete(point_id)
+
+        return [f"{point_id}-s" for point_id in point_ids]
+
+    def _schema_with_neighbors(self, payloads: List[dict]) -> List[str]:
+        """
+        Turn schema search hits into schema strings, adding the tables they join to.
+
+        Args:
+            payloads: Payloads of the matched schema points, best match first
+
+        Returns:
+            Schema strings for the matched tables followed by their missing neighbours
+        """
+        schemas = [payload["schema"] for payload in payloads]
+
+        found = {payload["table"] for payload in payloads if payload.get("table")}
+        missing = []
+        for payload in payloads:
+            for neighbor in payload.get("neighbors", []):
+                if neighbor not in found and neighbor not in missing:
+                    missing.append(neighbor)
+        missing = set(missing[:self.max_schema_neighbors])
+
+        if missing:
+            with self._lock:
+                schemas.extend(
+                    payload["schema"]
+                    for payload in self._get_collection(self.schema_collection).payloads
+                    if payload.get("table") in missing
+                )
+
+        return schemas
+
+    def add_documentation(self, documentation: str) -> str:
+        """
+        Add documentation to vector store.
+
+        Args:
+            documentation: Documentation text
+
+        Returns:
+            ID of the stored entry
+        """
+        point_id = self._generate_deterministic_id(documentation)
+        embedding = self.generate_embedding(documentation)
+
+        with self._lock:
+            self._get_collection(self.docs_collection).upsert(
+                [(point_id, embedding, {"documentation": documentation})]
+            )
+
+        return f"{point_id}-d"
+
+    def _search(self, collection_name: str, question: str, embedding: List[float] = None) -> List[dict]:
+        """Search one collection with the (shared) question embedding."""
+        embedding = self._get_query_embedding(question, embedding)
+        with self._lock:
+            return self._get_collection(collection_name).search(embedding, self.n_results)
+
+    def get_similar_questions(self, question: str, embedding: List[float] = None) -> list:
+        """
+        Get similar questions with their SQL from vector store.
+
+        Args:
+            question: Natural language question
+            embedding: Precomputed question embedding (optional)
+
+        Returns:
+            List of question-SQL pairs
+        """
+        return self._search(self.questions_collection, question, embedding)
+
+    def get_related_schema(self, question: str, embedding: List[float] = None) -> list:
+        """
+        Get related schema information from vector store.
+
+        Args:
+            question: Natural language question
+            embedding: Precomputed question embedding (optional)
+
+        Returns:
+            List of schema strings
+        """
+        return self._schema_with_neighbors(self._search(self.schema_collection, question, embedding))
+
+    def get_related_documentation(self, question: str, embedding: List[float] = None) -> list:
+        """
+        Get related documentation from vector store.
+
+        Args:
+            question: Natural language question
+            embedding: Precomputed question embedding (optional)
+
+        Returns:
+            List of documentation strings
+        """
+        return [payload["documentation"] for payload in self._search(self.docs_collection, question, embedding)]
+
+    def get_all_training_data(self) -> pd.DataFrame:
+        """
+        Get all training data from the questions collection.
+
+        Returns:
+            DataFrame with question, SQL, and ID
+        """
+        with self._lock:
+            collection = self._get_collection(self.questions_collection)
+            return pd.DataFrame([
+                {
+                    "id": f"{point_id}-q",
+                    "question": payload.get("question", ""),
+                    "sql": payload.get("sql", "")
+                }
+                for point_id, payload in zip(collection.ids, collection.payloads)
+            ])
+
+    def remove_training_data(self, id: str) -> bool:
+        """
+        Remove training data entry by ID.
+
+        Args:
+            id: Entry ID (with -q suffix)
+
+        Returns:
+            Success flag
+        """
+        point_id = id[:-2] if id.endswith("-q") else id
+
+        try:
+            with self._lock:
+                return self._get_collection(self.questions_collection).delete(point_id)
+        except Exception as e:
+            print(f"Error removing training data: {e}")
+            return False
+
+    def reset_collection(self, collection_type: str = "all") -> bool:
+        """
+        Reset (empty) a collection or all collections.
+
+        Args:
+            collection_type: Collection type ("questions", "schema", "docs", or "all")
+
+        Returns:
+            Success flag
+        """
+        try:
+            collections = []
+            if collection_type == "questions" or collection_type == "all":
+                collections.append(self.questions_collection)
+            if collection_type == "schema" or collection_type == "all":
+                collections.append(self.schema_collection)
+            if collection_type == "docs" or collection_type == "all":
+                collections.append(self.docs_collection)
+
+            with self._lock:
+                for collection in collections:
+                    self._get_collection(collection).reset()
+
+            return True
+        except Exception as e:
+            print(f"Error resetting collections: {e}")
+            return False
@@ -1,11 +1,16 @@
 import hashlib
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
 import pandas as pd
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, MatchAny,
+    FilterSelector, IsEmptyCondition, PayloadField
+)
 
 from .base import Talk2SQLBase
+from talk2sql.utils import fallback_payload
 
 class QdrantVectorStore(Talk2SQLBase):
     """Vector store implementation using Qdrant for semantic search and storage."""
@@ -23,12 +28,16 @@ class QdrantVectorStore(Talk2SQLBase):
                 - schema_collection: Name for schema collection
                 - docs_collection: Name for documentation collection
                 - n_results: Number of results to return (default: 5)
+                - upsert_batch_size: Points per upsert request for bulk ingest (default: 500)
+                - max_schema_neighbors: Max foreign-key neighbour tables added to schema results (default: 10)
         """
         super().__init__(config)
         
         # Get configuration values
         self.embedding_size = config.get("embedding_size", 1536)  # Default size for OpenAI embeddings
         self.n_results = config.get("n_results", 5)
+        self.upsert_batch_size = config.get("upsert_batch_size", 500)
+        self.max_schema_neighbors = config.get("max_schema_neighbors", 10)
         
         # Collection names
         self.questions_collection = config.get("questions_collection", "Talk2SQL_questions")
@@ -48,6 +57,12 @@ class QdrantVectorStore(Talk2SQLBase):
             api_key=self.api_key,
         )
         
+        # Engines reassign self.client to their LLM client, so batch operations use this reference
+        self.qdrant_client = self.client
+        
+        # Small pool for fanning retrieval out across collections
+        self._retrieval_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="qdrant-retrieval")
+        
         # Only setup collections if this class is being used directly, not through inheritance
         if self.__class__.__name__ == "QdrantVectorStore":
             self._setup_collections()
@@ -119,16 +134,97 @@ class QdrantVectorStore(Talk2SQLBase):
                 PointStruct(
                     id=point_id,
                     vector=embedding,
-                    payload={
+                    payload=fallback_payload({
                         "question": question,
                         "sql": sql
-                    }
+                    }, embedding)
                 )
             ]
         )
         
         return f"{point_id}-q"
     
+    def _get_existing_point_ids(self, collection_name: str, point_ids: List[str]) -> set:
+        """
+        Find which point IDs already exist in a collection using batched retrieves.
+        
+        Points stored with a fallback (hash) vector don't count, so they get embedded again.
+        
+        Args:
+            collection_name: Collection to check
+            point_ids: Candidate point IDs
+            
+        Returns:
+            Set of IDs that are already stored with a real embedding
+        """
+        existing = set()
+        for start in range(0, len(point_ids), self.upsert_batch_size):
+            chunk = point_ids[start:start + self.upsert_batch_size]
+            try:
+                records = self.qdrant_client.retrieve(
+                    collection_name=collection_name,
+                    ids=chunk,
+                    with_payload=["fallback_embedding"],
+                    with_vectors=False
+                )
+            except Exception as e:
+                print(f"Error checking existing points in {collection_name}: {e}")
+                continue
+            existing.update(
+                str(record.id) for record in records
+                if not (record.payload or {}).get("fallback_embedding")
+            )
+        return existing
+    
+    def add_question_sql_batch(self, examples: List[Tuple[str, str]], skip_existing: bool = True) -> List[str]:
+        """
+        Add many question-SQL pairs with batched embeddings and chunked upserts.
+        
+        Args:
+            examples: List of (question, sql) tuples
+            skip_existing: Don't re-embed or re-upsert pairs already in the collection
+            
+        Returns:
+            IDs of the stored entries, in input order
+        """
+        ids = []
+        points = {}
+        for question, sql in examples:
+            point_id = self._generate_deterministic_id(f"Question: {question}\nSQL: {sql}")
+            ids.append(f"{point_id}-q")
+            points[point_id] = {"question": question, "sql": sql}
+        
+        # IDs are deterministic, so anything already stored is identical and can be skipped
+        point_ids = list(points.keys())
+        if skip_existing and point_ids:
+            existing = self._get_existing_point_ids(self.questions_collection, point_ids)
+            point_ids = [pid for pid in point_ids if pid not in existing]
+            if existing:
+                print(f"Skipping {len(existing)} training examples already in {self.questions_collection}")
+        
+        if not point_ids:
+            return ids
+        
+        # Embed all new questions in as few API calls as possible
+        embeddings = self.generate_embeddings([points[pid]["question"] for pid in point_ids])
+        
+        # Upsert in large chunks instead of one request per example
+        for start in range(0, len(point_ids), self.upsert_batch_size):
+            chunk = point_ids[start:start + self.upsert_batch_size]
+            self.qdrant_client.upsert(
+                collection_name=self.questions_collection,
+                points=[
+                    PointStruct(
+                        id=pid,
+                        vector=embedding,
+                        payload=fallback_payload(points[pid], embedding)
+                    )
+                    for pid, embedding in zip(chunk, embeddings[start:start + self.upsert_batch_size])
+                ]
+            )
+        
+        return ids
+    
     def add_schema(self, schema: str) -> str:
         """
         Add database schema to vector store.
@@ -161,6 +257,100 @@ class QdrantVectorStore(Talk2SQLBase):
         
         return f"{point_id}-s"
     
+    def add_table_schemas(self, tables: List[dict]) -> List[str]:
+        """
+        Add schema as one point per table, with foreign-key neighbours in the payload.
+        
+        tables is the whole catalog: points of tables not in it (e.g. dropped since
+        the last indexing) are deleted from the schema collection.
+        
+        Args:
+            tables: List of dicts with "table" (name), "schema" (DDL and notes) and
+                "neighbors" (names of tables it joins to)
+            
+        Returns:
+            IDs of the stored entries
+        """
+        if not tables:
+            return []
+        
+        # Keyed by collection and table, so re-training a changed table replaces its point
+        point_ids = [
+            self._generate_deterministic_id(f"{self.schema_collection}:{table['table']}")
+            for table in tables
+        ]
+        embeddings = self.generate_embeddings([table["schema"] for table in tables])
+        
+        for start in range(0, len(tables), self.upsert_batch_size):
+            end = start + self.upsert_batch_size
+            self.qdrant_client.upsert(
+                collection_name=self.schema_collection,
+                points=[
+                    PointStruct(
+                        id=point_id,
+                        vector=embedding,
+                        payload={
+                            "schema": table["schema"],
+                            "table": table["table"],
+                            "neighbors": list(table.get("neighbors", []))
+                        }
+                    )
+                    for point_id, embedding, table in zip(point_ids[start:end], embeddings[start:end], tables[start:end])
+                ]
+            )
+        
+        # Per-table points whose table is gone; whole-schema points (no "table") are kept
+        self.qdrant_client.delete(
+            collection_name=self.schema_collection,
+            points_selector=FilterSelector(
+                filter=Filter(
+                    must_not=[
+                        FieldCondition(key="table", match=MatchAny(any=[table["table"] for table in tables])),
+                        IsEmptyCondition(is_empty=PayloadField(key="table"))
+                    ]
+                )
+            )
+        )
+        
+        return [f"{point_id}-s" for point_id in point_ids]
+    
+    def _schema_with_neighbors(self, payloads: List[dict]) -> List[str]:
+        """
+        Turn schema search hits into schema strings, adding the tables they join to.
+        
+        Args:
+            payloads: Payloads of the matched schema points, best match first
+            
+        Returns:
+            Schema strings for the matched tables followed by their missing neighbours
+        """
+        schemas = [payload["schema"] for payload in payloads]
+        
+        found = {payload["table"] for payload in payloads if payload.get("table")}
+        missing = []
+        for payload in payloads:
+            for neighbor in payload.get("neighbors", []):
+                if neighbor not in found and neighbor not in missing:
+                    missing.append(neighbor)
+        missing = missing[:self.max_schema_neighbors]
+        
+        if not missing:
+            return schemas
+        
+        try:
+            points, _ = self.qdrant_client.scroll(
+                collection_name=self.schema_collection,
+                scroll_filter=Filter(must=[FieldCondition(key="table", match=MatchAny(any=missing))]),
+                limit=len(missing),
+                with_payload=True,
+                with_vectors=False
+            )
+            schemas.extend(point.payload["schema"] for point in points)
+        except Exception as e:
+            print(f"Error fetching neighbouring table schemas: {e}")
+        
+        return schemas
+    
     def add_documentation(self, documentation: str) -> str:
         """
         Add documentation to vector store.
@@ -193,17 +383,18 @@ class QdrantVectorStore(Talk2SQLBase):
         
         return f"{point_id}-d"
     
-    def get_similar_questions(self, question: str) -> list:
+    def get_similar_questions(self, question: str, embedding: List[float] = None) -> list:
         """
         Get similar questions with their SQL from vector store.
         
         Args:
             question: Natural language question
+            embedding: Precomputed question embedding (optional)
             
         Returns:
             List of question-SQL pairs
         """
-        embedding = self.generate_embedding(question)
+        embedding = self._get_query_embedding(question, embedding)
         
         results = self.client.search(
             collection_name=self.questions_collection,
@@ -213,17 +404,18 @@ class QdrantVectorStore(Talk2SQLBase):
         
         return [point.payload for point in results]
     
-    def get_related_schema(self, question: str) -> list:
+    def get_related_schema(self, question: str, embedding: List[float] = None) -> list:
         """
         Get related schema information from vector store.
         
         Args:
             question: Natural language question
+            embedding: Precomputed question embedding (optional)
             
         Returns:
             List of schema strings
         """
-        embedding = self.generate_embedding(question)
+        embedding = self._get_query_embedding(question, embedding)
         
         results = self.client.search(
             collection_name=self.schema_collection,
@@ -231,19 +423,20 @@ class QdrantVectorStore(Talk2SQLBase):
             limit=self.n_results
         )
         
-        return [point.payload["schema"] for point in results]
+        return self._schema_with_neighbors([point.payload for point in results])
     
-    def get_related_documentation(self, question: str) -> list:
+    def get_related_documentation(self, question: str, embedding: List[float] = None) -> list:
         """
         Get related documentation from vector store.
         
         Args:
             question: Natural language question
+            embedding: Precomputed question embedding (optional)
             
         Returns:
             List of documentation strings
         """
-        embedding = self.generate_embedding(question)
+        embedding = self._get_query_embedding(question, embedding)
         
         results = self.client.search(
             collection_name=self.docs_collection,
@@ -253,6 +446,71 @@ class QdrantVectorStore(Talk2SQLBase):
         
         return [point.payload["documentation"] for point in results]
     
+    def get_related_context(self, question: str, embedding: List[float] = None) -> dict:
+        """
+        Get similar questions, schema and documentation in a single batched request.
+        
+        Args:
+            question: Natural language question
+            embedding: Precomputed question embedding (optional)
+            
+        Returns:
+            Dictionary with "similar_questions", "schema" and "documentation" lists
+        """
+        embedding = self._get_query_embedding(question, embedding)
+        collections = [self.questions_collection, self.schema_collection, self.docs_collection]
+        
+        try:
+            batches = self._search_collections_batch(collections, embedding)
+        except Exception as e:
+            print(f"Error running batched retrieval, falling back to per-collection search: {e}")
+            return {
+                "similar_questions": self.get_similar_questions(question, embedding=embedding),
+                "schema": self.get_related_schema(question, embedding=embedding),
+                "documentation": self.get_related_documentation(question, embedding=embedding),
+            }
+        
+        questions, schema, docs = batches
+        return {
+            "similar_questions": [point.payload for point in questions],
+            "schema": self._schema_with_neighbors([point.payload for point in schema]),
+            "documentation": [point.payload["documentation"] for point in docs],
+        }
+    
+    def _search_collections_batch(self, collections: List[str], embedding: List[float]) -> List[list]:
+        """
+        Search several collections with one embedding concurrently.
+        
+        Qdrant batch endpoints are scoped to a single collection, so each collection gets
+        one batch request and the requests run in parallel; the caller waits for a single
+        round trip instead of one per collection.
+        
+        Args:
+            collections: Collection names to search
+            embedding: Query embedding
+            
+        Returns:
+            List of scored points per collection, in the same order
+        """
+        if hasattr(self.qdrant_client, "search_batch"):
+            from qdrant_client.models import SearchRequest
+            
+            def search(name):
+                return self.qdrant_client.search_batch(
+                    collection_name=name,
+                    requests=[SearchRequest(vector=embedding, limit=self.n_results, with_payload=True)]
+                )[0]
+        else:
+            from qdrant_client.models import QueryRequest
+            
+            def search(name):
+                return self.qdrant_client.query_batch_points(
+                    collection_name=name,
+                    requests=[QueryRequest(query=embedding, limit=self.n_results, with_payload=True)]
+                )[0].points
+        
+        return list(self._retrieval_executor.map(search, collections))
+    
     def get_all_training_data(self) -> pd.DataFrame:
         """
         Get all training data from the questions collection.
@@ -0,0 +1,53 @@
+import pickle
+import sqlite3
+
+import pandas as pd
+
+from talk2sql.blob_store import BlobStore
+from talk2sql.engine.Talk2SQL_azure import Talk2SQLAzure
+from talk2sql.metrics import MetricsRollup
+from talk2sql.sketch import LatencySketches
+
+
+def _engine(db_path):
+    """History-only engine; skips the Azure and Qdrant clients."""
+    engine = Talk2SQLAzure.__new__(Talk2SQLAzure)
+    engine.save_query_history = True
+    engine.history_db_path = db_path
+    engine.debug_mode = False
+    engine.history_writer = None
+    engine.blob_store = BlobStore()
+    engine.metrics_rollup = MetricsRollup(db_path)
+    engine.latency_sketches = LatencySketches(db_path)
+    return engine
+
+
+def test_legacy_pickled_data_survives_blob_migration(tmp_path):
+    db_path = str(tmp_path / "history.sqlite")
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE query_history (id TEXT PRIMARY KEY, timestamp TEXT, question TEXT, sql TEXT, "
+        "success INTEGER, error_message TEXT, retry_count INTEGER, data BLOB, columns TEXT, "
+        "visualization BLOB, summary TEXT, total_time_ms REAL, sql_generation_time_ms REAL, "
+        "sql_execution_time_ms REAL, visualization_time_ms REAL, explanation_time_ms REAL, "
+        "timing_details TEXT, used_memory INTEGER)"
+    )
+    pickled = pickle.dumps(pd.DataFrame({"n": [1, 2]}))
+    conn.execute(
+        "INSERT INTO query_history (id, timestamp, question, success, data) VALUES (?, ?, ?, 1, ?)",
+        ("old", "2024-01-01T10:00:00", "pickled", pickled)
+    )
+    conn.execute(
+        "INSERT INTO query_history (id, timestamp, question, success, data) VALUES (?, ?, ?, 1, ?)",
+        ("new", "2024-01-02T10:00:00", "json", '[{"n": 3}]')
+    )
+    conn.commit()
+    conn.close()
+
+    engine = _engine(db_path)
+    engine._init_history_db()
+
+    history = {entry["id"]: entry for entry in engine.get_query_history()}
+    assert set(history) == {"old", "new"}
+    assert history["old"]["data"]["n"].tolist() == [1, 2]
+    assert history["new"]["data"]["n"].tolist() == [3]
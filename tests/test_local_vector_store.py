@@ -0,0 +1,51 @@
+from talk2sql.utils import FallbackEmbedding
+from talk2sql.vector_store.local import LocalVectorStore
+
+
+class _Store(LocalVectorStore):
+    """Local store whose embeddings API can be switched off."""
+
+    def __init__(self):
+        self.api_up = False
+        self.embedded = []
+        super().__init__({"embedding_size": 3})
+
+    def generate_embedding(self, text):
+        self.embedded.append(text)
+        return [1.0, 0.0, 0.0] if self.api_up else FallbackEmbedding([0.0, 1.0, 0.0])
+
+
+for _name in LocalVectorStore.__abstractmethods__ - set(vars(_Store)):
+    setattr(_Store, _name, lambda self, *args, **kwargs: None)
+_Store.__abstractmethods__ = frozenset()
+
+
+def test_fallback_vectors_are_embedded_again():
+    store = _Store()
+    examples = [("How many orders?", "SELECT COUNT(*) FROM orders")]
+
+    store.add_question_sql_batch(examples)
+    store.add_question_sql_batch(examples)
+    assert len(store.embedded) == 2
+
+    store.api_up = True
+    store.add_question_sql_batch(examples)
+    store.add_question_sql_batch(examples)
+    assert len(store.embedded) == 3
+    collection = store._get_collection(store.questions_collection)
+    assert "fallback_embedding" not in collection.payloads[0]
+
+
+def test_reindexing_drops_tables_missing_from_the_catalog():
+    store = _Store()
+    store.api_up = True
+    store.add_schema("CREATE TABLE legacy (id INTEGER)")
+    store.add_table_schemas([
+        {"table": "orders", "schema": "CREATE TABLE orders (id INTEGER)"},
+        {"table": "old_orders", "schema": "CREATE TABLE old_orders (id INTEGER)"},
+    ])
+
+    store.add_table_schemas([{"table": "orders", "schema": "CREATE TABLE orders (id INTEGER, total REAL)"}])
+
+    payloads = store._get_collection(store.schema_collection).payloads
+    assert sorted(payload.get("table", "") for payload in payloads) == ["", "orders"]
@@ -0,0 +1,46 @@
+import sqlite3
+
+from talk2sql.metrics import STAGE_COLUMNS, MetricsRollup, classify_error
+
+
+def _record(conn, rollup, timestamp, success, error_message=None, total_ms=100.0):
+    conn.execute(
+        "INSERT INTO query_history (timestamp, success, retry_count, used_memory, error_message, total_time_ms) "
+        "VALUES (?, ?, 0, 0, ?, ?)",
+        (timestamp, int(success), error_message, total_ms)
+    )
+    rollup.record(conn, timestamp, success, error_message=error_message, latencies={"total": total_ms})
+
+
+def test_summary_starts_exactly_at_a_mid_day_timestamp(tmp_path):
+    db_path = str(tmp_path / "history.sqlite")
+    rollup = MetricsRollup(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE query_history (timestamp TEXT, success INTEGER, retry_count INTEGER, "
+        "used_memory INTEGER, error_message TEXT, " + ", ".join(f"{c} REAL" for c in STAGE_COLUMNS.values()) + ")"
+    )
+    rollup.create_tables(conn)
+    _record(conn, rollup, "2024-01-01T09:00:00", True)
+    _record(conn, rollup, "2024-01-02T08:00:00", False, "no such table: orders", total_ms=900.0)
+    _record(conn, rollup, "2024-01-02T13:00:00", True)
+    _record(conn, rollup, "2024-01-03T10:00:00", False, "Query timeout")
+    conn.commit()
+    conn.close()
+
+    summary = rollup.summary("2024-01-02T12:00:00")
+    assert summary["totals"]["total"] == 2
+    assert summary["totals"]["success"] == 1
+    assert summary["errors"]["class"] == {"timeout": 1}
+    assert summary["stages"]["total"]["count"] == 2
+    assert [day["day"] for day in summary["days"]] == ["2024-01-02", "2024-01-03"]
+
+    assert rollup.summary("2024-01-02")["totals"]["total"] == 3
+    assert rollup.summary()["totals"]["total"] == 4
+
+
+def test_missing_objects_are_schema_errors():
+    assert classify_error("no such table: orders") == "table_not_found"
+    assert classify_error("no such column: total") == "column_not_found"
+    assert classify_error("Relation 'x' does not exist") == "schema_error"
+    assert classify_error("no such function: median") == "schema_error"
@@ -0,0 +1,25 @@
+import sqlite3
+
+import pandas as pd
+
+from talk2sql.cache.result import QueryResultCache
+
+
+def test_non_deterministic_queries_are_not_cached(tmp_path):
+    db_path = str(tmp_path / "data.sqlite")
+    sqlite3.connect(db_path).close()
+    cache = QueryResultCache()
+    runs = []
+
+    def execute():
+        runs.append(1)
+        return pd.DataFrame({"n": [len(runs)]})
+
+    for sql in ("SELECT random()", "SELECT date('now')", "SELECT CURRENT_TIMESTAMP"):
+        cache.get_or_execute(db_path, sql, execute)
+        cache.get_or_execute(db_path, sql, execute)
+    assert len(runs) == 6
+
+    cache.get_or_execute(db_path, "SELECT 1", execute)
+    assert cache.get_or_execute(db_path, "SELECT 1", execute).attrs["result_cache_hit"]
+    assert len(runs) == 7
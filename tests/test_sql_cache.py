@@ -0,0 +1,24 @@
+from talk2sql.cache.sql import SQLAnswerCache
+
+
+def _embed():
+    """Same vector for every question, so only the literal check can tell them apart."""
+    return [1.0, 0.0, 0.0]
+
+
+def test_similarity_tier_is_off_by_default():
+    cache = SQLAnswerCache()
+    cache.put("db", "fp", "Top 10 customers by revenue", "SELECT 10", embedding=_embed())
+
+    assert cache.get("db", "fp", "Top customers by revenue please", embed=_embed) is None
+
+
+def test_questions_differing_only_in_a_number_both_miss():
+    cache = SQLAnswerCache(similarity_threshold=0.9)
+    cache.put("db", "fp", "Top 10 customers by revenue", "SELECT ... LIMIT 10", embedding=_embed())
+
+    assert cache.get("db", "fp", "Top 5 customers by revenue", embed=_embed) is None
+    assert cache.get("db", "fp", "Top 20 customers by revenue", embed=_embed) is None
+    assert cache.get("db", "fp", "Orders shipped to 'Berlin' in 10 days", embed=_embed) is None
+    assert cache.get("db", "fp", "top 10 customers by revenue?", embed=_embed) == ("SELECT ... LIMIT 10", "exact")
+    assert cache.get("db", "fp", "Show the top 10 customers by revenue", embed=_embed) == ("SELECT ... LIMIT 10", "similar")